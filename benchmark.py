@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for image_apis.image_processing
+
+Runs the processing functions and their helpers over synthetic images of
+several sizes, without the server, a database or network access, and
+reports latency percentiles, throughput and peak RSS. Results can be saved
+as JSON and compared against a baseline run:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.10
+
+Background removal uses a locally cached rembg model when one is found
+(U2NET_HOME, ~/.u2net) and a deterministic stub session otherwise, so the
+suite also runs on CPU-only machines without network access.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor.settings')
+
+from image_apis import image_processing as ip  # noqa: E402
+from image_apis.tiling import TiledCLAHE  # noqa: E402
+
+SIZES = {
+    'small': (320, 240),
+    'medium': (1024, 768),
+    'large': (2048, 1536),
+}
+
+
+def synthetic_image(width, height, seed=0):
+    """Deterministic photo-like BGR test image: gradients, shapes and noise"""
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[:, :, 0] = 255 * x / width
+    img[:, :, 1] = 255 * y / height
+    img[:, :, 2] = 128 + 100 * np.sin(x / 37.0) * np.cos(y / 23.0)
+    img = img.astype(np.uint8)
+
+    for _ in range(12):
+        center = (int(rng.randint(width)), int(rng.randint(height)))
+        radius = int(rng.randint(max(min(width, height) // 20, 2), max(min(width, height) // 5, 3)))
+        color = tuple(int(c) for c in rng.randint(0, 255, 3))
+        cv2.circle(img, center, radius, color, -1)
+
+    noise = rng.normal(0, 8, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+class StubSession:
+    """
+    Stand-in for a rembg session: a centered elliptical foreground mask,
+    so the surrounding pipeline (cutout, post-processing, encoding) runs
+    without the model
+    """
+    model_name = 'stub'
+
+    def predict(self, img, *args, **kwargs):
+        width, height = img.size
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(mask, (width // 2, height // 2), (width // 3, height // 3), 0, 0, 360, 255, -1)
+        return [Image.fromarray(cv2.GaussianBlur(mask, (0, 0), 3))]
+
+
+def load_session(choice):
+    """rembg session for the benchmarks: 'stub', 'auto' or a model name"""
+    if choice == 'stub':
+        return StubSession(), 'stub'
+
+    model_name = 'u2net' if choice == 'auto' else choice
+    home = os.path.expanduser(os.getenv('U2NET_HOME', os.path.join(os.getenv('XDG_DATA_HOME', '~'), '.u2net')))
+    if not os.path.exists(os.path.join(home, f'{model_name}.onnx')):
+        if choice == 'auto':
+            return StubSession(), 'stub'
+        sys.exit(f"Model {model_name} is not cached in {home}; use --rembg-session stub")
+
+    from rembg import new_session
+    return new_session(model_name), model_name
+
+
+class RSSSampler:
+    """Peak resident set size while a block runs, sampled from /proc"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = resource.getpagesize()
+
+    def current(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # ru_maxrss is KiB on Linux; a process-wide high-water mark
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def build_benchmarks(session, quality, workers):
+    """
+    Benchmark cases as (name, setup, func): setup(img, encoded) returns the
+    arguments passed to func, so only func itself is timed
+    """
+    def encoded_args(ext='.png'):
+        return lambda img, encoded: (encoded[ext],)
+
+    def box(img):
+        height, width = img.shape[:2]
+        return width // 3, height // 3, width // 2, height // 2
+
+    def inpaint_args(img, encoded):
+        x1, y1, x2, y2 = box(img)
+        mask = np.zeros(img.shape[:2], dtype=np.uint8)
+        mask[y1:y2, x1:x2] = 255
+        return img, mask
+
+    def blend_args(img, encoded):
+        region, mask = inpaint_args(img, encoded)
+        result_ns = cv2.inpaint(region, mask, 3, cv2.INPAINT_NS)
+        result_advanced = ip.advanced_inpainting(region, mask)
+        return region.copy(), result_ns, result_advanced, mask, float(max(img.shape[:2]))
+
+    def tiled_clahe(channel):
+        clahe = TiledCLAHE(channel.shape, clip_limit=2.0)
+        clahe.accumulate(channel, 0, 0)
+        clahe.finalize()
+        return clahe.apply(channel, 0, 0)
+
+    def rgba_args(img, encoded):
+        rgba = cv2.cvtColor(img, cv2.COLOR_BGR2RGBA)
+        return (Image.fromarray(rgba),)
+
+    return [
+        # Top-level processing functions (decode, process, encode)
+        ('upscale_image_advanced', encoded_args(),
+         lambda data: ip.upscale_image_advanced(data, 2, quality=quality)),
+        ('remove_background_advanced', encoded_args(),
+         lambda data: ip.remove_background_advanced(data, session=session, quality=quality)),
+        ('remove_object_advanced', lambda img, encoded: (encoded['.png'],) + box(img),
+         lambda data, *b: ip.remove_object_advanced(data, *b, quality=quality)),
+        ('enhance_image_quality_advanced', encoded_args(),
+         lambda data: ip.enhance_image_quality_advanced(data, quality=quality)),
+        ('enhance_image_quality_advanced[parallel]', encoded_args(),
+         lambda data: ip.enhance_image_quality_advanced(data, workers=workers, quality=quality)),
+
+        # Codecs
+        ('decode_image[png]', encoded_args('.png'), ip.decode_image),
+        ('decode_image[jpg]', encoded_args('.jpg'), ip.decode_image),
+        ('encode_image[png]', lambda img, encoded: (img, '.png'), ip.encode_image),
+        ('encode_image[jpg]', lambda img, encoded: (img, '.jpg'), ip.encode_image),
+
+        # Upscaling helpers
+        ('enhanced_basic_upscaling', lambda img, encoded: (img, 2), ip.enhanced_basic_upscaling),
+        ('upscale_frame_tiled', lambda img, encoded: (img, 2, 16 * 1024 * 1024),
+         lambda img, scale, budget: ip.upscale_frame_tiled(img, scale, budget, quality=quality)),
+        ('enhance_final_quality', lambda img, encoded: (img,), ip.enhance_final_quality),
+
+        # Background removal helpers
+        ('post_process_background_removal', rgba_args, ip.post_process_background_removal),
+
+        # Object removal helpers
+        ('advanced_inpainting', inpaint_args, ip.advanced_inpainting),
+        ('blend_inpainting_results', blend_args, ip.blend_inpainting_results),
+
+        # Enhancement helpers
+        ('enhance_colors', lambda img, encoded: (img,), ip.enhance_colors),
+        ('adaptive_sharpening', lambda img, encoded: (img,), ip.adaptive_sharpening),
+        ('enhance_contrast', lambda img, encoded: (img,), ip.enhance_contrast),
+        ('enhance_colors_and_sharpen', lambda img, encoded: (img,), ip.enhance_colors_and_sharpen),
+        ('enhance_contrast_and_finish', lambda img, encoded: (img,), ip.enhance_contrast_and_finish),
+        ('enhance_frame_parallel', lambda img, encoded: (img, workers),
+         lambda img, w: ip.enhance_frame_parallel(img, w, quality=quality)),
+        ('TiledCLAHE', lambda img, encoded: (np.ascontiguousarray(img[:, :, 0]),), tiled_clahe),
+    ]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+def run_case(func, args, iterations, warmup, megapixels):
+    for _ in range(warmup):
+        func(*args)
+
+    timings = []
+    with RSSSampler() as rss:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+
+    mean = statistics.fmean(timings)
+    return {
+        'iterations': iterations,
+        'mean': mean,
+        'min': min(timings),
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'throughput': 1 / mean if mean else None,
+        'megapixels_per_second': megapixels / mean if mean else None,
+        'peak_rss_mb': rss.peak / (1024 * 1024),
+    }
+
+
+def compare(results, baseline, metric, threshold):
+    """Print a comparison table; returns the names of regressed benchmarks"""
+    regressions = []
+    print(f"\n{'benchmark':<58} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<58} {'-':>10} {result[metric]:>10.4f} {'new':>8}")
+            continue
+        change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<58} {base[metric]:>10.4f} {result[metric]:>10.4f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"comma separated sizes from {', '.join(SIZES)} (default: small,medium)")
+    parser.add_argument('--iterations', type=int, default=5, help='timed runs per case (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs per case (default: 1)')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--quality', default='best', choices=ip.QUALITY_TIERS, help='quality tier')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='threads for the parallel enhancement cases')
+    parser.add_argument('--rembg-session', default='auto',
+                        help="'auto' (cached u2net or stub), 'stub' or a cached model name")
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--metric', default='p50', choices=['mean', 'min', 'p50', 'p90', 'p99'],
+                        help='latency metric compared with the baseline (default: p50)')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed slowdown vs. the baseline before failing (default: 0.10)')
+    args = parser.parse_args()
+
+    session, session_name = load_session(args.rembg_session)
+    cases = [case for case in build_benchmarks(session, args.quality, args.workers)
+             if args.filter in case[0]]
+
+    results = {}
+    for size_name in args.sizes.split(','):
+        width, height = SIZES[size_name]
+        img = synthetic_image(width, height)
+        encoded = {ext: ip.encode_image(img, ext) for ext in ('.png', '.jpg')}
+        megapixels = width * height / 1e6
+
+        for name, setup, func in cases:
+            key = f'{name}/{size_name}'
+            result = run_case(func, setup(img, encoded), args.iterations, args.warmup, megapixels)
+            results[key] = result
+            print(f"{key:<58} p50 {result['p50'] * 1000:9.2f} ms  p90 {result['p90'] * 1000:9.2f} ms  "
+                  f"{result['megapixels_per_second']:8.2f} MP/s  RSS {result['peak_rss_mb']:7.1f} MB")
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'rembg_session': session_name,
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
 from django.contrib import admin
+from django.utils.html import format_html_join
 from .models import ProcessedImage
 
 @admin.register(ProcessedImage)
 class ProcessedImageAdmin(admin.ModelAdmin):
-    list_display = ['id', 'processing_type', 'created_at', 'processing_time']
-    list_filter = ['processing_type', 'created_at']
+    list_display = ['id', 'processing_type', 'quality', 'status', 'created_at', 'processing_time']
+    list_filter = ['processing_type', 'quality', 'status', 'created_at']
     search_fields = ['processing_type']
-    readonly_fields = ['created_at', 'processing_time']
+    readonly_fields = ['created_at', 'processing_time', 'stage_timings_table', 'started_at',
+                       'finished_at', 'error']
     
     fieldsets = (
         ('Image Information', {
-            'fields': ('original_image', 'processed_image', 'processing_type')
+            'fields': ('original_image', 'processed_image', 'processing_type', 'quality')
         }),
         ('Processing Details', {
-            'fields': ('created_at', 'processing_time'),
+            'fields': ('status', 'error', 'created_at', 'started_at', 'finished_at',
+                       'processing_time', 'stage_timings_table'),
             'classes': ('collapse',)
         }),
     )
+    
+    @admin.display(description='Stage timings')
+    def stage_timings_table(self, obj):
+        """One line per stage with its time and share of the total"""
+        if not obj.stage_timings:
+            return '-'
+        total = sum(obj.stage_timings.values()) or 1
+        return format_html_join(
+            '', '<div>{}: {} ms ({}%)</div>',
+            ((name, f'{seconds * 1000:.1f}', f'{seconds / total * 100:.0f}')
+             for name, seconds in obj.stage_timings.items())
+        )
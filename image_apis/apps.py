@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ImageApisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'image_apis'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.files.storage import storages
+
+        # Fail at startup, not on the first upload, when media storage is misconfigured
+        storages['default']
+
+        # Load the background removal model when the worker starts
+        if getattr(settings, 'REMBG_PRELOAD', False):
+            from .sessions import get_session
+            get_session()
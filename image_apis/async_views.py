@@ -0,0 +1,209 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from .cache import result_cache
+from .compute import compute_pool
+from .encoders import OUTPUT_FORMATS, format_for_ext
+from .jobs import (
+    complete_processing, fail_processing, job_queue, start_processing, store_result
+)
+from .metrics import metrics
+from .operations import get_operation
+from .renderers import wants_binary
+from .serializers import ImageUploadSerializer, ProcessedImageSerializer
+from .timing import StageTimer
+from .validation import check_limits
+from .views import _claim, _resolve_output
+
+# Computations running in this process, by cache key, so identical
+# concurrent requests await the first one instead of starting their own
+_in_flight = {}
+
+
+@csrf_exempt
+@metrics.track_request('async')
+async def process_image_async(request, operation):
+    """
+    Async endpoint for every registered processing operation
+
+    Takes the same parameters as process_image_api. The image is processed
+    on the compute process pool while the event loop keeps serving other
+    requests; validation, the result cache and storage run on threads.
+    Like the DRF endpoints it is exempt from CSRF checks.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed.'}, status=405)
+
+    try:
+        operation = get_operation(operation)
+        prepared = await sync_to_async(_prepare_request)(request, operation)
+        if isinstance(prepared, HttpResponse):
+            return prepared
+        upload, params, binary = prepared
+
+        if binary:
+            return await _binary_response(upload, operation, params)
+
+        cache_key = None
+        processed_image = None
+        if result_cache.enabled:
+            cache_key = result_cache.make_key(upload, operation.name, params)
+
+            # An identical request in this process is already computing it
+            future = _in_flight.get(cache_key)
+            if future is not None:
+                return _cached_response(request, await asyncio.shield(future))
+
+            # Claim the key, or find the row of an identical request in
+            # this process or another
+            processed_image, cached = await sync_to_async(_claim)(upload, operation, params, cache_key)
+            if cached:
+                if processed_image.status != 'completed':
+                    # Waiting can take minutes: do it on a thread of its own, not
+                    # the shared thread that serves every other sync call
+                    processed_image = await sync_to_async(_wait_for, thread_sensitive=False)(processed_image)
+                return _cached_response(request, processed_image)
+
+        future = asyncio.get_running_loop().create_future()
+        if cache_key:
+            _in_flight[cache_key] = future
+        try:
+            processed_image = await _process_and_store(upload, operation, params, processed_image)
+            future.set_result(processed_image)
+        except Exception as e:
+            # Waiting requests get the error too; retrieve it here in case there are none
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            _in_flight.pop(cache_key, None)
+
+        serializer = ProcessedImageSerializer(processed_image, context={'request': request})
+        return JsonResponse(serializer.data, status=201)
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def _prepare_request(request, operation):
+    """
+    Parse and validate the multipart request (sync: reads the request body).
+    Returns (upload, params, binary) or an error response.
+    """
+    data = request.POST.copy()
+    data.update(request.FILES)
+
+    serializer = ImageUploadSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    params, errors = operation.parse_params(data)
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    upload = serializer.validated_data['original_image']
+    error = check_limits(operation, upload.image_info, params)
+    if error:
+        return JsonResponse({'original_image': [error]}, status=400)
+
+    binary = wants_binary(request)
+    return upload, _resolve_output(request, upload, operation, params, binary=binary), binary
+
+
+def _wait_for(processed_image):
+    """result_cache.wait on a pool thread, closing the connection it opened"""
+    try:
+        return result_cache.wait(processed_image)
+    finally:
+        connection.close()
+
+
+async def _run_on_pool(upload, operation, params):
+    """Process an upload on the compute pool; returns (output, processing_time, timer)"""
+    upload.seek(0)
+    image_data = upload.read()
+
+    (output, processing_time), stages = await compute_pool.process(operation.func, image_data, **params)
+    timer = StageTimer()
+    for name, seconds in stages.items():
+        timer.add(name, seconds)
+    return output, processing_time, timer
+
+
+async def _process_and_store(upload, operation, params, processed_image=None):
+    """
+    Process an upload on the pool and store the result: in the pending row
+    that claimed its cache key, or in a new row
+    """
+    if processed_image is None:
+        started_at = timezone.now()
+        output, processing_time, timer = await _run_on_pool(upload, operation, params)
+        return await sync_to_async(store_result)(
+            upload, operation.name, output, processing_time, started_at,
+            ext=params['ext'], quality=params['quality'], timer=timer
+        )
+
+    try:
+        await sync_to_async(start_processing)(processed_image)
+        output, processing_time, timer = await _run_on_pool(upload, operation, params)
+        await sync_to_async(complete_processing)(
+            processed_image, output, processing_time, params['ext'], timer
+        )
+    except Exception as e:
+        await sync_to_async(fail_processing)(processed_image, e)
+        raise
+    finally:
+        # Release requests waiting on this result
+        result_cache.finished(processed_image)
+
+    await sync_to_async(result_cache.maybe_evict)()
+    return processed_image
+
+
+async def _binary_response(upload, operation, params):
+    """Process on the pool and send the encoded result; nothing is stored"""
+    output, processing_time, timer = await _run_on_pool(upload, operation, params)
+
+    ext = params['ext']
+    encoding = params.get('encoding')
+    fmt = OUTPUT_FORMATS[encoding['output_format']] if encoding else format_for_ext(ext)
+    response = HttpResponse(output, content_type=fmt.media_type)
+    response['Content-Disposition'] = f'inline; filename="{operation.name}{ext}"'
+    response['X-Processing-Time'] = f'{processing_time:.3f}'
+    response['Server-Timing'] = timer.server_timing()
+    response['Vary'] = 'Accept'
+    metrics.inc('image_api_output_bytes_total', len(output), processing_type=operation.name)
+    return response
+
+
+def _cached_response(request, processed_image):
+    if processed_image.status == 'failed':
+        return JsonResponse({'error': processed_image.error}, status=500)
+    serializer = ProcessedImageSerializer(processed_image, context={'request': request})
+    response = JsonResponse(serializer.data, status=200)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+async def health(request):
+    """
+    Liveness and load of this worker: database reachability, compute pool
+    and job queue. Served by the event loop even while images process.
+    """
+    try:
+        await sync_to_async(connection.ensure_connection)()
+        database = 'ok'
+    except Exception as e:
+        database = str(e)
+
+    healthy = database == 'ok'
+    return JsonResponse({
+        'status': 'ok' if healthy else 'unavailable',
+        'database': database,
+        'compute_pool': compute_pool.status(),
+        'job_queue': {'pending': job_queue.pending, 'max_pending': job_queue.max_pending},
+    }, status=200 if healthy else 503)
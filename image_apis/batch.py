@@ -0,0 +1,65 @@
+import mimetypes
+import os
+import tarfile
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class ArchiveError(Exception):
+    """Raised when an uploaded archive cannot be read or exceeds the limits"""
+
+
+def extract_archive(archive, max_items, max_bytes):
+    """
+    Read the images of an uploaded zip or tar archive as in-memory uploads.
+
+    Members that are not JPEG, PNG or WebP files (by extension) are skipped.
+    The number of images and their total uncompressed size are bounded so
+    a small archive cannot expand into unbounded memory.
+    """
+    archive.seek(0)
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        return _extract_zip(archive, max_items, max_bytes)
+
+    archive.seek(0)
+    try:
+        with tarfile.open(fileobj=archive, mode='r:*') as tar:
+            members = [m for m in tar.getmembers() if m.isfile() and _is_image(m.name)]
+            _check_limits([m.size for m in members], max_items, max_bytes)
+            return [_upload(m.name, tar.extractfile(m).read()) for m in members]
+    except tarfile.TarError:
+        raise ArchiveError("Unsupported archive. Please upload a zip or tar file.")
+
+
+def _extract_zip(archive, max_items, max_bytes):
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            members = [m for m in zf.infolist() if not m.is_dir() and _is_image(m.filename)]
+            _check_limits([m.file_size for m in members], max_items, max_bytes)
+            return [_upload(m.filename, zf.read(m)) for m in members]
+    except zipfile.BadZipFile:
+        raise ArchiveError("Could not read the zip archive.")
+
+
+def _check_limits(sizes, max_items, max_bytes):
+    if not sizes:
+        raise ArchiveError("The archive contains no JPEG, PNG or WebP images.")
+    if len(sizes) > max_items:
+        raise ArchiveError(f"Too many images in the archive. Maximum is {max_items}.")
+    if sum(sizes) > max_bytes:
+        raise ArchiveError(f"Archive contents too large. Maximum is {max_bytes} bytes uncompressed.")
+
+
+def _is_image(name):
+    base = os.path.basename(name)
+    return not base.startswith('.') and os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _upload(name, content):
+    """Wrap archive member bytes as an uploaded file"""
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return SimpleUploadedFile(os.path.basename(name), content, content_type=content_type)
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ProcessedImage
+from .storage import delete_if_unreferenced, recently_written
+from .uploadhandlers import content_hash
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'MAX_BYTES': 1024 * 1024 * 1024,
+    'MAX_ENTRIES': None,
+    'TTL': 7 * 24 * 60 * 60,
+    'EVICT_INTERVAL': 60,
+    'WAIT_TIMEOUT': 300,
+}
+
+
+class ResultCache:
+    """
+    Content-addressed cache of processing results.
+
+    Results are ProcessedImage rows tagged with a cache key derived from the
+    input bytes, the processing type and its parameters. Identical requests
+    reuse a completed row instead of recomputing it, or wait for a row that
+    is still being processed. A computation claims its key by inserting a
+    pending row before it starts, so identical requests coalesce across
+    worker processes too. Rows left in flight for longer than WAIT_TIMEOUT
+    by a worker that died are ignored and recomputed.
+
+    Evicted entries (least recently used beyond the size bounds, or older
+    than the TTL) lose their cache key and their processed file, which is
+    deleted unless another row shares it. The rows and their originals are
+    kept: clients may still hold their ids, and deleting them is the
+    retention policy's job (see cleanup_media).
+    """
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_SETTINGS, **(options or {})}
+        self._locks = {}
+        self._events = {}
+        self._lock = threading.Lock()
+        self._last_evict = 0
+
+    @property
+    def enabled(self):
+        return self.options['ENABLED']
+
+    def make_key(self, uploaded_file, processing_type, params):
+        """Cache key for an upload processed with the given parameters"""
+        payload = json.dumps({
+            'content': content_hash(uploaded_file),
+            'type': processing_type,
+            'params': params,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Serialize lookup-or-claim for one key within this process, so
+        identical concurrent requests here do not all insert a row
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def lookup(self, key):
+        """Completed or in-flight result for a key, or None"""
+        processed_image = self._live(key).order_by('-created_at').first()
+
+        if processed_image is not None and processed_image.status == 'completed':
+            self._touch(processed_image)
+        return processed_image
+
+    def claim(self, key, **fields):
+        """
+        Create the pending row that computes a key and register it, or find
+        the row of an identical request that claimed it first. Returns
+        (row, created) like get_or_create.
+
+        Keys are not unique in the database, so two processes may both
+        insert a row. Each checks afterwards: of the live rows for the key,
+        the oldest computes it and the others are deleted in favour of it.
+        """
+        processed_image = ProcessedImage.objects.create(cache_key=key, status='pending', **fields)
+        self.register(processed_image)
+        rival = self._live(key).filter(
+            Q(pk__lt=processed_image.pk) | Q(status='completed')
+        ).exclude(pk=processed_image.pk).order_by('pk').first()
+        if rival is None:
+            return processed_image, True
+
+        self.finished(processed_image)
+        delete_if_unreferenced(processed_image.original_image)
+        processed_image.delete()
+        return rival, False
+
+    def _live(self, key):
+        """Completed and in-flight rows for a key"""
+        queryset = ProcessedImage.objects.filter(cache_key=key).exclude(status='failed')
+        ttl = self.options['TTL']
+        if ttl:
+            queryset = queryset.filter(created_at__gte=timezone.now() - timedelta(seconds=ttl))
+
+        # A row in flight for longer than anyone would wait for it was abandoned
+        # by a worker that died, unless this process is still computing it
+        stale_before = timezone.now() - timedelta(seconds=self.options['WAIT_TIMEOUT'])
+        with self._lock:
+            running = list(self._events)
+        return queryset.annotate(
+            in_flight_since=Coalesce('started_at', 'created_at')
+        ).exclude(
+            Q(status__in=['pending', 'processing'], in_flight_since__lt=stale_before)
+            & ~Q(pk__in=running)
+        )
+
+    def _touch(self, processed_image):
+        """
+        Record a cache hit for LRU eviction. Eviction runs at most once per
+        EVICT_INTERVAL, so a more precise time is never used: hot entries
+        are written once per interval instead of on every hit.
+        """
+        now = timezone.now()
+        interval = timedelta(seconds=self.options['EVICT_INTERVAL'])
+        last_accessed_at = processed_image.last_accessed_at
+        if last_accessed_at is not None and now - last_accessed_at < interval:
+            return
+        processed_image.last_accessed_at = now
+        processed_image.save(update_fields=['last_accessed_at'])
+
+    def register(self, processed_image):
+        """Mark a freshly created row as the in-flight computation for its key"""
+        with self._lock:
+            self._events[processed_image.pk] = threading.Event()
+
+    def finished(self, processed_image):
+        """Wake requests waiting on this row"""
+        with self._lock:
+            event = self._events.pop(processed_image.pk, None)
+        if event is not None:
+            event.set()
+
+    def wait(self, processed_image, timeout=None):
+        """
+        Wait for an in-flight row to complete or fail and return it fresh.
+        Rows computed by another process are polled from the database.
+        """
+        timeout = self.options['WAIT_TIMEOUT'] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        event = self._events.get(processed_image.pk)
+
+        while processed_image.status not in ('completed', 'failed'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Timed out waiting for an identical request to finish.")
+            if event is not None:
+                event.wait(min(1.0, remaining))
+            else:
+                time.sleep(min(0.25, remaining))
+            processed_image.refresh_from_db()
+        return processed_image
+
+    def maybe_evict(self):
+        """Run eviction at most once per EVICT_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self._last_evict < self.options['EVICT_INTERVAL']:
+            return 0
+        self._last_evict = now
+        return self.evict()
+
+    def evict(self):
+        """Apply TTL, entry and size bounds; returns the number of evicted rows"""
+        entries = ProcessedImage.objects.filter(
+            cache_key__isnull=False, status='completed'
+        )
+        evicted = 0
+
+        ttl = self.options['TTL']
+        if ttl:
+            cutoff = timezone.now() - timedelta(seconds=ttl)
+            evicted += self._forget(entries.filter(created_at__lt=cutoff))
+
+        # Least recently used first
+        lru = entries.annotate(
+            last_used=Coalesce('last_accessed_at', 'finished_at', 'created_at')
+        ).order_by('last_used')
+
+        max_entries = self.options['MAX_ENTRIES']
+        if max_entries is not None:
+            excess = entries.count() - max_entries
+            if excess > 0:
+                evicted += self._forget(entries.filter(
+                    id__in=list(lru[:excess].values_list('id', flat=True))
+                ))
+
+        max_bytes = self.options['MAX_BYTES']
+        if max_bytes is not None:
+            total = entries.aggregate(total=Sum('processed_size'))['total'] or 0
+            victims = []
+            for row in lru.only('id', 'processed_size').iterator():
+                if total <= max_bytes:
+                    break
+                victims.append(row.id)
+                total -= row.processed_size or 0
+            evicted += self._forget(entries.filter(id__in=victims))
+
+        return evicted
+
+    def _forget(self, queryset):
+        """
+        Drop rows from the cache and delete their processed files. Files
+        written within the grace period (an identical result may be about
+        to reference them) are left in the cache for a later pass.
+        """
+        rows = [
+            row for row in queryset.only('id', 'processed_image')
+            if not _in_grace_period(row.processed_image)
+        ]
+        # Unlisted first, so no lookup serves a row whose file is going away
+        evicted = ProcessedImage.objects.filter(pk__in=[row.pk for row in rows]).update(
+            cache_key=None, processed_image=None, processed_size=None
+        )
+        for row in rows:
+            delete_if_unreferenced(row.processed_image)
+        return evicted
+
+
+def _in_grace_period(field_file):
+    storage = field_file.storage
+    return bool(field_file) and storage.exists(field_file.name) and recently_written(storage, field_file.name)
+
+
+result_cache = ResultCache(getattr(settings, 'IMAGE_RESULT_CACHE', None))
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import transport
+from .metrics import metrics
+from .timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'WORKERS': None,
+    'MAX_TASKS_PER_CHILD': 100,
+    'PRELOAD_MODELS': None,
+    'SHARED_MEMORY_MIN_BYTES': 256 * 1024,
+}
+
+
+# Number of worker processes of the pool this process belongs to, if any
+_pool_workers = None
+
+
+def cpu_share():
+    """
+    CPUs one task may use: all of them, or inside a compute pool worker
+    its share of them, so tasks running side by side do not oversubscribe
+    """
+    cpus = os.cpu_count() or 1
+    if _pool_workers is None:
+        return cpus
+    return max(cpus // _pool_workers, 1)
+
+
+def _init_worker(preload_models, pool_workers=None):
+    """Set up Django in a new worker process and load its models up front"""
+    global _pool_workers
+    _pool_workers = pool_workers
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_processor.settings')
+    import django
+    django.setup()
+
+    from .sessions import configured_model, registry
+    model_name, options = configured_model()
+    for name in ([model_name] if preload_models is None else preload_models):
+        try:
+            registry.warm(name, **options)
+        except Exception:
+            # The model is loaded on first use instead
+            logger.warning("Could not preload model %s in a compute worker", name, exc_info=True)
+
+
+def _run_timed(func, args, kwargs):
+    """Run a processing function in a worker; returns its result and stage timings"""
+    timer = StageTimer()
+    with timer.activate():
+        result = func(*args, **kwargs)
+    return result, timer.stages
+
+
+def _run_shared(func, image_data, output_name, min_bytes, kwargs):
+    """
+    Run a processing function in a worker on encoded image bytes, or on a
+    BufferRef read in place from shared memory. An output of at least
+    min_bytes is written to the segment named by the web process and
+    returned as its BufferRef instead of being pickled back.
+    """
+    if isinstance(image_data, transport.BufferRef):
+        with transport.attach(image_data) as data:
+            output, processing_time = func(data, **kwargs)
+    else:
+        output, processing_time = func(image_data, **kwargs)
+
+    if len(output) >= min_bytes:
+        output = transport.write(output_name, output)
+    return output, processing_time
+
+
+class ComputePool:
+    """
+    Process pool running CPU-bound processing for the async views.
+
+    Work runs in separate processes, so neither the GIL nor a slow image
+    holds up the event loop. Workers are spawned (not forked) on first use,
+    load their models in the initializer, and are replaced after
+    MAX_TASKS_PER_CHILD tasks so fragmentation and leaks cannot grow
+    without bound. A pool whose worker died is replaced for later tasks.
+    """
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_SETTINGS, **(options or {})}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def workers(self):
+        return self.options['WORKERS'] or os.cpu_count()
+
+    @property
+    def pending(self):
+        """Number of tasks queued or running"""
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Segments left by web processes that crashed mid-task
+                transport.cleanup_stale()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.options['PRELOAD_MODELS'], self.workers),
+                    max_tasks_per_child=self.options['MAX_TASKS_PER_CHILD'],
+                )
+            return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in a worker process. Returns its result
+        and the stage timings recorded while it ran.
+        """
+        executor = self._get_executor()
+        with self._lock:
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, _run_timed, func, args, kwargs)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def process(self, func, image_data, **kwargs):
+        """
+        Run a processing function taking encoded image bytes and returning
+        (output, processing_time) in a worker process. Returns that result
+        and the stage timings.
+
+        Uploads and outputs of at least SHARED_MEMORY_MIN_BYTES pass through
+        shared memory instead of being pickled through the pool's pipes.
+        Outputs are checked on their own: a small upload upscaled to a
+        large result still returns it through shared memory. The worker
+        decodes the upload in place, and the segments are unlinked here
+        even if the worker dies.
+        """
+        min_bytes = self.options['SHARED_MEMORY_MIN_BYTES']
+        if min_bytes is None:
+            return await self.run(func, image_data, **kwargs)
+
+        with transport.SharedBuffers() as buffers:
+            if len(image_data) >= min_bytes:
+                image_data = buffers.share(image_data)
+            (output, processing_time), stages = await self.run(
+                _run_shared, func, image_data, buffers.reserve(), min_bytes, kwargs
+            )
+            if isinstance(output, transport.BufferRef):
+                output = transport.read(output)
+            return (output, processing_time), stages
+
+    def _discard(self, executor):
+        """Drop a broken pool so the next task starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'max_tasks_per_child': self.options['MAX_TASKS_PER_CHILD'],
+            'started': self._executor is not None,
+            'pending': self._pending,
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+compute_pool = ComputePool(getattr(settings, 'IMAGE_COMPUTE_POOL', None))
+metrics.add_collector(lambda: [('image_api_compute_pool_pending', {}, compute_pool.pending)])
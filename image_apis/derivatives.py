@@ -0,0 +1,193 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .encoders import OUTPUT_FORMATS, encode
+
+DEFAULT_SETTINGS = {
+    'ROOT': None,
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'EVICT_INTERVAL': 60,
+}
+
+
+def target_size(width, height, params):
+    """
+    Size to resize a width x height source to, and the (w, h) to center
+    crop the result to (cover only). Downscales only, except for fill.
+    """
+    box_width, box_height = params.get('width'), params.get('height')
+    if box_width is None or box_height is None:
+        # One side given: scale to it, keeping the aspect ratio
+        scale = min(box_width / width if box_height is None else box_height / height, 1)
+        return (max(round(width * scale), 1), max(round(height * scale), 1)), None
+
+    fit = params.get('fit', 'contain')
+    if fit == 'fill':
+        return (box_width, box_height), None
+
+    if fit == 'cover':
+        scale = min(max(box_width / width, box_height / height), 1)
+        size = (max(math.ceil(width * scale), 1), max(math.ceil(height * scale), 1))
+        return size, (min(box_width, size[0]), min(box_height, size[1]))
+
+    scale = min(box_width / width, box_height / height, 1)
+    return (max(round(width * scale), 1), max(round(height * scale), 1)), None
+
+
+def render_derivative(source, params):
+    """
+    Decode an image file object at reduced size and encode its derivative.
+
+    JPEG sources use draft mode, so the decoder itself scales by 1/2, 1/4
+    or 1/8 and never materializes the full-size frame.
+    """
+    image = Image.open(source)
+    size, crop = target_size(image.width, image.height, params)
+
+    # Let the JPEG decoder do most of the downscaling
+    if image.format == 'JPEG':
+        image.draft('RGB', size)
+
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if crop is not None:
+        left = (size[0] - crop[0]) // 2
+        top = (size[1] - crop[1]) // 2
+        image = image.crop((left, top, left + crop[0], top + crop[1]))
+
+    array = np.asarray(image)
+    code = cv2.COLOR_RGBA2BGRA if image.mode == 'RGBA' else cv2.COLOR_RGB2BGR
+    return encode(
+        cv2.cvtColor(array, code),
+        params['output_format'],
+        output_quality=params.get('output_quality'),
+        effort='fast',
+    )
+
+
+class DerivativeCache:
+    """
+    Bounded on-disk cache of resized derivatives.
+
+    Derivatives are files named after a hash of their source file and
+    parameters, created on first request. Reads refresh a file's mtime and
+    the least recently used files are deleted once the directory grows
+    beyond MAX_BYTES.
+    """
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_SETTINGS, **(options or {})}
+        self._lock = threading.Lock()
+        self._last_evict = 0
+
+    @property
+    def root(self):
+        return str(self.options['ROOT'] or os.path.join(settings.MEDIA_ROOT, 'derivatives'))
+
+    def make_key(self, processed_image, source, params):
+        """Cache key for a derivative of one of a ProcessedImage's files"""
+        field = getattr(processed_image, f'{source}_image')
+        payload = json.dumps({
+            'id': processed_image.pk,
+            'created_at': processed_image.created_at.isoformat(),
+            'file': field.name,
+            'params': params,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key, output_format):
+        return os.path.join(self.root, key[:2], key + OUTPUT_FORMATS[output_format].ext)
+
+    def open(self, processed_image, source, params):
+        """
+        Open the derivative file for reading, rendering it first on a miss;
+        returns (file, hit). The file is opened here, so an eviction
+        running concurrently can unlink it but not fail the read.
+        """
+        key = self.make_key(processed_image, source, params)
+        path = self.path(key, params['output_format'])
+
+        try:
+            derivative = open(path, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted since it was opened; still readable
+                pass
+            return derivative, True
+
+        field = getattr(processed_image, f'{source}_image')
+        with field.open('rb') as f:
+            output = render_derivative(f, params)
+
+        # Write atomically so concurrent readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(output)
+        derivative = open(tmp_path, 'rb')
+        os.replace(tmp_path, path)
+
+        self.maybe_evict()
+        return derivative, False
+
+    def maybe_evict(self):
+        """Run eviction at most once per EVICT_INTERVAL seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_evict < self.options['EVICT_INTERVAL']:
+                return 0
+            self._last_evict = now
+        return self.evict()
+
+    def evict(self):
+        """Delete least recently used derivatives beyond MAX_BYTES; returns the count"""
+        max_bytes = self.options['MAX_BYTES']
+        if max_bytes is None:
+            return 0
+
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    # Still being written; renamed into place when done
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return evicted
+
+
+derivative_cache = DerivativeCache(getattr(settings, 'IMAGE_DERIVATIVE_CACHE', None))
@@ -0,0 +1,178 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Encoder effort: 'fast' favours latency, 'max' the smallest file
+EFFORT_LEVELS = ('fast', 'default', 'max')
+
+
+class OutputFormat:
+    """
+    An output encoding clients can request.
+
+    name            value of the output_format parameter
+    ext             file extension of stored results
+    media_type      Content-Type of binary responses
+    encoder         function taking (img, output_quality, effort)
+    alpha           whether transparency is kept (otherwise it is
+                    flattened onto white)
+    """
+
+    def __init__(self, name, ext, media_type, encoder, alpha=True):
+        self.name = name
+        self.ext = ext
+        self.media_type = media_type
+        self.encoder = encoder
+        self.alpha = alpha
+
+
+def _cv2_encode(ext, img, params):
+    success, buffer = cv2.imencode(ext, img, params)
+    if not success:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buffer.tobytes()
+
+
+def _encode_png(img, output_quality, effort):
+    level = {'fast': 1, 'default': 6, 'max': 9}[effort]
+    return _cv2_encode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, level])
+
+
+def _encode_jpeg(img, output_quality, effort):
+    params = [cv2.IMWRITE_JPEG_QUALITY, output_quality or 95]
+    if effort != 'fast':
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    if effort == 'max':
+        params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    return _cv2_encode('.jpg', img, params)
+
+
+def _encode_webp(img, output_quality, effort, lossless=False):
+    # OpenCV exposes no WebP effort setting, Pillow's libwebp does (method 0-6)
+    if img.ndim == 3 and img.shape[2] == 4:
+        image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA))
+    else:
+        image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+    method = {'fast': 0, 'default': 4, 'max': 6}[effort]
+    if lossless:
+        # For lossless WebP, quality is the compression effort
+        quality = {'fast': 0, 'default': 75, 'max': 100}[effort]
+    else:
+        quality = output_quality or 85
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', lossless=lossless, quality=quality, method=method)
+    return buffer.getvalue()
+
+
+def _encode_webp_lossless(img, output_quality, effort):
+    return _encode_webp(img, output_quality, effort, lossless=True)
+
+
+def _encode_avif(img, output_quality, effort):
+    speed = {'fast': 10, 'default': 6, 'max': 5}[effort]
+    return _cv2_encode('.avif', img, [
+        cv2.IMWRITE_AVIF_QUALITY, output_quality or 80,
+        cv2.IMWRITE_AVIF_SPEED, speed,
+    ])
+
+
+OUTPUT_FORMATS = {}
+
+
+def register(output_format):
+    OUTPUT_FORMATS[output_format.name] = output_format
+    return output_format
+
+
+register(OutputFormat('png', '.png', 'image/png', _encode_png))
+register(OutputFormat('jpeg', '.jpg', 'image/jpeg', _encode_jpeg, alpha=False))
+register(OutputFormat('webp', '.webp', 'image/webp', _encode_webp))
+register(OutputFormat('webp_lossless', '.webp', 'image/webp', _encode_webp_lossless))
+
+# AVIF only when this OpenCV build ships an AVIF writer
+if cv2.haveImageWriter('.avif'):
+    register(OutputFormat('avif', '.avif', 'image/avif', _encode_avif))
+
+# Format used for each upload extension when no output format is requested
+EXTENSION_FORMATS = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp_lossless'}
+
+# Used instead when the client asked for an output_quality, which only
+# lossy encoders honour
+LOSSY_FORMATS = {'webp_lossless': 'webp'}
+
+
+def format_for_ext(ext, output_quality=None):
+    name = EXTENSION_FORMATS.get(ext, 'png')
+    if output_quality is not None:
+        name = LOSSY_FORMATS.get(name, name)
+    return OUTPUT_FORMATS[name]
+
+
+def encode(img, output_format, output_quality=None, effort='default'):
+    """Encode a BGR or BGRA array with a registered output format"""
+    fmt = OUTPUT_FORMATS[output_format]
+    if not fmt.alpha and img.ndim == 3 and img.shape[2] == 4:
+        img = flatten_alpha(img)
+    return fmt.encoder(img, output_quality, effort)
+
+
+def flatten_alpha(img, background=255):
+    """Composite a BGRA array onto a solid background, returning BGR"""
+    alpha = img[:, :, 3:].astype(np.float32) * np.float32(1 / 255)
+    flat = img[:, :, :3].astype(np.float32) * alpha
+    flat += np.float32(background) * (1 - alpha)
+    return np.rint(flat).astype(np.uint8)
+
+
+# Accept header types answered with JSON; a client listing one of them
+# before any image type gets the JSON representation
+DOCUMENT_TYPES = ('application/json', 'text/html', 'application/xhtml+xml', 'application/*',
+                  'text/*', '*/*')
+
+
+def _accepted(accept_header):
+    """Media types of an Accept header, most preferred first (q, then position)"""
+    candidates = []
+    for position, item in enumerate(accept_header.split(',')):
+        parts = [part.strip() for part in item.split(';')]
+        media_type, q = parts[0].lower(), 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidates.append((-q, position, media_type))
+    return [media_type for _, _, media_type in sorted(candidates)]
+
+
+def negotiate(accept_header):
+    """
+    Output format preferred by an Accept header, or None when it names no
+    specific supported image type (e.g. only image/* or */*)
+    """
+    for media_type in _accepted(accept_header):
+        for fmt in OUTPUT_FORMATS.values():
+            # webp (lossy) is listed before webp_lossless, so it wins for image/webp
+            if fmt.media_type == media_type:
+                return fmt
+    return None
+
+
+def prefers_image(accept_header):
+    """
+    Whether an Accept header prefers an image (image/* or any image type)
+    to a JSON or HTML document. Browsers list text/html first, so they get
+    JSON even though they also accept images.
+    """
+    for media_type in _accepted(accept_header):
+        if media_type.startswith('image/'):
+            return True
+        if media_type in DOCUMENT_TYPES:
+            return False
+    return False
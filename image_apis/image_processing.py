@@ -1,36 +1,210 @@
 import cv2
 import numpy as np
 from PIL import Image
-import io
 import time
-import os
-from rembg import remove, new_session
+from rembg import remove
+from rembg.bg import naive_cutout
+from .compute import cpu_share
+from .sessions import get_session, predict_masks
+from .encoders import encode
+from .tiling import TiledCLAHE, allocate_frame, apply_in_place, iter_tiles, run_tiles
+from .timing import stage
+import threading
 
-def upscale_image_advanced(image_path, scale_factor=4):
+# Rough peak bytes per output pixel of the whole-frame upscaling pipeline,
+# and of one tile in the tiled pipeline (which holds more temporaries)
+UPSCALE_BYTES_PER_PIXEL = 12
+TILE_BYTES_PER_PIXEL = 48
+
+# Input pixels of context around each tile: Lanczos reads 4, sharpening 1
+UPSCALE_TILE_HALO = 6
+
+# Pixels of context kept around the object removal box; the inpainting
+# passes read at most 7 pixels beyond the (dilated) mask
+INPAINT_CONTEXT_MARGIN = 32
+INPAINT_DILATE_KERNEL = np.ones((5, 5), np.uint8)
+
+# Input pixels of context around each enhancement tile: NL-means reads 13,
+# then upscaling and the two sharpening passes a few more
+ENHANCE_TILE_HALO = 24
+
+# Quality tiers trade result quality for speed; 'best' runs the full pipeline
+QUALITY_TIERS = ('fast', 'balanced', 'best')
+
+UPSCALE_PRESETS = {
+    # Bilinear resize only
+    'fast': {'interpolation': cv2.INTER_LINEAR, 'sharpen': False, 'final_quality': False},
+    # Bicubic resize, sharpening and CLAHE
+    'balanced': {'interpolation': cv2.INTER_CUBIC, 'sharpen': True, 'final_quality': True},
+    # Lanczos resize, sharpening and CLAHE
+    'best': {'interpolation': cv2.INTER_LANCZOS4, 'sharpen': True, 'final_quality': True},
+}
+
+BACKGROUND_REMOVAL_PRESETS = {
+    # Small u2netp model, raw alpha mask, fastest PNG compression
+    'fast': {'model': 'u2netp', 'post_process': False, 'png_compression': 1},
+    # Configured model with edge smoothing, moderate compression
+    'balanced': {'model': None, 'post_process': True, 'png_compression': 3},
+    # Configured model with edge smoothing, smallest PNG
+    'best': {'model': None, 'post_process': True, 'png_compression': 9},
+}
+
+OBJECT_REMOVAL_PRESETS = {
+    # Single Telea pass
+    'fast': {'method': 'telea'},
+    # Two-pass Telea + NS inpainting (advanced_inpainting)
+    'balanced': {'method': 'multipass'},
+    # Telea, NS and two-pass results blended by distance
+    'best': {'method': 'blend'},
+}
+
+ENHANCE_PRESETS = {
+    # Denoising skipped
+    'fast': {'denoise': None},
+    # NL-means (h, hColor, template, search) with a smaller search window
+    'balanced': {'denoise': (10, 10, 7, 11)},
+    # Full NL-means
+    'best': {'denoise': (10, 10, 7, 21)},
+}
+
+def get_preset(presets, quality):
+    """Preset for a quality tier, rejecting unknown tiers"""
+    if quality not in presets:
+        raise ValueError(f"Unknown quality '{quality}'. Use one of: {', '.join(QUALITY_TIERS)}.")
+    return presets[quality]
+
+def decode_image(image_data, flags=cv2.IMREAD_COLOR):
+    """Decode encoded image bytes (or pass through an array) as a BGR array"""
+    if isinstance(image_data, np.ndarray):
+        return image_data
+    
+    with stage('decode'):
+        buffer = np.frombuffer(image_data, dtype=np.uint8)
+        img = cv2.imdecode(buffer, flags)
+    if img is None:
+        raise ValueError("Could not read image")
+    return img
+
+def encode_image(img, ext='.png', params=None, encoding=None):
+    """
+    Encode an array into image bytes in the format given by ext, or with
+    an explicit encoding (output_format, output_quality, effort) when the
+    client requested one
+    """
+    with stage('encode'):
+        if encoding is not None:
+            return encode(img, **encoding)
+        
+        success, buffer = cv2.imencode(ext, img, params or [])
+    if not success:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buffer.tobytes()
+
+def upscale_image_advanced(image_data, scale_factor=4, ext='.png', memory_budget=None,
+                           quality='best', encoding=None):
     """
     Advanced upscaling using enhanced basic methods
     """
     start_time = time.time()
     
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError("Could not read image")
+    # Decode image from the upload buffer
+    img = decode_image(image_data)
     
-    # Enhanced basic upscaling
-    upscaled = enhanced_basic_upscaling(img, scale_factor)
+    upscaled = upscale_frame(img, scale_factor, memory_budget=memory_budget, quality=quality)
     
-    # Apply final enhancement
-    upscaled = enhance_final_quality(upscaled)
-    
-    # Save the upscaled image
-    output_path = image_path.replace('.', '_upscaled_advanced.')
-    cv2.imwrite(output_path, upscaled)
+    # Encode the upscaled image
+    output = encode_image(upscaled, ext, encoding=encoding)
     
     processing_time = time.time() - start_time
-    return output_path, processing_time
+    return output, processing_time
+
+def upscale_frame(img, scale_factor=4, memory_budget=None, quality='best'):
+    """
+    Upscale a decoded BGR array
+
+    When the whole-frame pipeline would need more than memory_budget bytes
+    the image is upscaled tile by tile instead.
+    """
+    preset = get_preset(UPSCALE_PRESETS, quality)
+    height, width = img.shape[:2]
+    output_pixels = height * width * scale_factor * scale_factor
+    if memory_budget and output_pixels * UPSCALE_BYTES_PER_PIXEL > memory_budget:
+        return upscale_frame_tiled(img, scale_factor, memory_budget, quality=quality)
+    
+    # Enhanced basic upscaling
+    with stage('upscale'):
+        upscaled = enhanced_basic_upscaling(
+            img, scale_factor, preset['interpolation'], sharpen=preset['sharpen']
+        )
+    
+    # Apply final enhancement
+    if preset['final_quality']:
+        with stage('final_quality'):
+            upscaled = enhance_final_quality(upscaled)
+    return upscaled
 
-def enhanced_basic_upscaling(img, scale_factor):
+def upscale_frame_tiled(img, scale_factor=4, memory_budget=256 * 1024 * 1024, tile_size=None,
+                        quality='best'):
+    """
+    Tiled version of upscale_frame with bounded peak memory
+
+    Tiles overlap by UPSCALE_TILE_HALO input pixels so Lanczos resampling
+    and sharpening match the whole-frame result exactly; CLAHE histograms
+    are gathered over the whole output before any tile is equalized, so
+    there are no seams. Half of the budget goes to the working tiles; an
+    output frame larger than the other half is backed by a temporary
+    memory-mapped file.
+    """
+    preset = get_preset(UPSCALE_PRESETS, quality)
+    scale_factor = int(scale_factor)
+    height, width = img.shape[:2]
+    out_height, out_width = height * scale_factor, width * scale_factor
+    halo = UPSCALE_TILE_HALO
+    
+    if tile_size is None:
+        tile_pixels = memory_budget // 2 // TILE_BYTES_PER_PIXEL
+        tile_size = int(np.sqrt(tile_pixels)) // scale_factor - 2 * halo
+    tile_size = max(tile_size, 16)
+    
+    output = allocate_frame((out_height, out_width, 3), np.uint8, memory_budget // 2)
+    clahe = TiledCLAHE((out_height, out_width), clip_limit=3.0)
+    
+    # Pass 1: upscale and sharpen each tile, keep it as LAB and collect
+    # the L channel histograms
+    with stage('upscale'):
+        for y0, y1, x0, x1 in iter_tiles(height, width, tile_size, tile_size):
+            py0, px0 = max(y0 - halo, 0), max(x0 - halo, 0)
+            patch = img[py0:min(y1 + halo, height), px0:min(x1 + halo, width)]
+            
+            upscaled = enhanced_basic_upscaling(
+                patch, scale_factor, preset['interpolation'], sharpen=preset['sharpen']
+            )
+            upscaled = upscaled[(y0 - py0) * scale_factor:(y1 - py0) * scale_factor,
+                                (x0 - px0) * scale_factor:(x1 - px0) * scale_factor]
+            
+            if not preset['final_quality']:
+                output[y0 * scale_factor:y1 * scale_factor, x0 * scale_factor:x1 * scale_factor] = upscaled
+                continue
+            
+            lab = cv2.cvtColor(upscaled, cv2.COLOR_BGR2LAB)
+            output[y0 * scale_factor:y1 * scale_factor, x0 * scale_factor:x1 * scale_factor] = lab
+            clahe.accumulate(lab[:, :, 0], y0 * scale_factor, x0 * scale_factor)
+    
+    if not preset['final_quality']:
+        return output
+    clahe.finalize()
+    
+    # Pass 2: equalize, convert back to BGR and blur, in place
+    def final_quality(patch, y0, x0):
+        patch[:, :, 0] = clahe.apply(patch[:, :, 0], y0, x0)
+        enhanced = cv2.cvtColor(patch, cv2.COLOR_LAB2BGR)
+        return cv2.GaussianBlur(enhanced, (3, 3), 0.5)
+    
+    out_tile = (tile_size + 2 * halo) * scale_factor
+    with stage('final_quality'):
+        return apply_in_place(output, out_tile, 1, final_quality)
+
+def enhanced_basic_upscaling(img, scale_factor, interpolation=cv2.INTER_LANCZOS4, sharpen=True):
     """Enhanced basic upscaling with better algorithms"""
     # Get original dimensions
     height, width = img.shape[:2]
@@ -40,7 +214,9 @@ def enhanced_basic_upscaling(img, scale_factor):
     new_height = int(height * scale_factor)
     
     # Use Lanczos interpolation for better quality
-    upscaled = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+    upscaled = cv2.resize(img, (new_width, new_height), interpolation=interpolation)
+    if not sharpen:
+        return upscaled
     
     # Apply advanced sharpening
     kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
@@ -51,103 +227,305 @@ def enhanced_basic_upscaling(img, scale_factor):
     
     return upscaled
 
-def remove_background_advanced(image_path):
+def remove_background_advanced(image_data, session=None, ext='.png', quality='best',
+                               encoding=None):
     """
     Advanced background removal using enhanced rembg
     """
     start_time = time.time()
     
-    # Read image
-    input_image = Image.open(image_path)
-    
-    # Use rembg with improved session
-    session = new_session("u2net")
-    output_image = remove(input_image, session=session)
+    # Decode image from the upload buffer
+    img = decode_image(image_data)
     
-    # Apply post-processing for better quality
-    output_image = post_process_background_removal(output_image)
+    preset = get_preset(BACKGROUND_REMOVAL_PRESETS, quality)
+    result = remove_background_frame(img, session=session, quality=quality)
     
-    # Save the processed image
-    output_path = image_path.replace('.', '_no_bg_advanced.')
-    output_image.save(output_path, 'PNG', optimize=True)
+    # Encode with an alpha-capable format
+    output = encode_image(
+        result, ext, [cv2.IMWRITE_PNG_COMPRESSION, preset['png_compression']], encoding
+    )
     
     processing_time = time.time() - start_time
-    return output_path, processing_time
+    return output, processing_time
 
-def remove_object_advanced(image_path, x1, y1, x2, y2):
+def remove_background_frame(img, session=None, quality='best'):
+    """Remove the background of a decoded BGR array, returning BGRA"""
+    preset = get_preset(BACKGROUND_REMOVAL_PRESETS, quality)
+    input_image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    
+    # Reuse the process-wide session instead of reloading the model
+    if session is None:
+        session = get_session(preset['model'])
+    with stage('inference'):
+        output_image = remove(input_image, session=session)
+    
+    return _finish_cutout(output_image, preset)
+
+def remove_background_batch(images_data, session=None, ext='.png', quality='best', batch_size=8,
+                            encoding=None):
+    """
+    Background removal for several encoded images at once
+
+    The model runs on stacked batches of batch_size images through one
+    shared session (one image per call when the model cannot batch).
+    Returns, for each input, either (output, processing_time) or the
+    exception that image failed with; processing_time includes an equal
+    share of its batch's inference time.
+    """
+    preset = get_preset(BACKGROUND_REMOVAL_PRESETS, quality)
+    if session is None:
+        session = get_session(preset['model'])
+    
+    results = [None] * len(images_data)
+    frames = []
+    for index, image_data in enumerate(images_data):
+        start_time = time.time()
+        try:
+            img = decode_image(image_data)
+            input_image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            frames.append((index, input_image, time.time() - start_time))
+        except Exception as e:
+            results[index] = e
+    
+    for start in range(0, len(frames), batch_size):
+        chunk = frames[start:start + batch_size]
+        inference_start = time.time()
+        try:
+            with stage('inference'):
+                masks = predict_masks(session, [frame[1] for frame in chunk], batch_size)
+        except Exception as e:
+            for index, _, _ in chunk:
+                results[index] = e
+            continue
+        inference_share = (time.time() - inference_start) / len(chunk)
+        
+        for (index, input_image, elapsed), mask in zip(chunk, masks):
+            start_time = time.time()
+            try:
+                result = _finish_cutout(naive_cutout(input_image, mask), preset)
+                output = encode_image(
+                    result, ext, [cv2.IMWRITE_PNG_COMPRESSION, preset['png_compression']], encoding
+                )
+                results[index] = (output, elapsed + inference_share + time.time() - start_time)
+            except Exception as e:
+                results[index] = e
+    
+    return results
+
+def _finish_cutout(output_image, preset):
+    """Post-process an RGBA cutout and return it as a BGRA array"""
+    # Apply post-processing for better quality
+    if preset['post_process']:
+        with stage('post_process'):
+            output_image = post_process_background_removal(output_image)
+    
+    return cv2.cvtColor(np.asarray(output_image), cv2.COLOR_RGBA2BGRA)
+
+def remove_object_advanced(image_data, x1, y1, x2, y2, ext='.png', quality='best',
+                           encoding=None):
     """
     Advanced object removal using multiple inpainting methods
     """
     start_time = time.time()
     
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError("Could not read image")
+    # Decode image from the upload buffer
+    img = decode_image(image_data)
     
-    # Create mask for the region to remove
-    mask = np.zeros(img.shape[:2], dtype=np.uint8)
-    mask[y1:y2, x1:x2] = 255
+    result = remove_object_frame(img, x1, y1, x2, y2, quality=quality)
     
-    # Method 1: OpenCV Telea inpainting
-    result_telea = cv2.inpaint(img, mask, 3, cv2.INPAINT_TELEA)
+    # Encode the processed image
+    output = encode_image(result, ext, encoding=encoding)
     
-    # Method 2: OpenCV NS inpainting
-    result_ns = cv2.inpaint(img, mask, 3, cv2.INPAINT_NS)
+    processing_time = time.time() - start_time
+    return output, processing_time
+
+def remove_object_frame(img, x1, y1, x2, y2, quality='best'):
+    """
+    Remove the object inside (x1, y1, x2, y2) from a decoded BGR array
+
+    Only a crop around the box plus INPAINT_CONTEXT_MARGIN pixels of
+    context is inpainted and pasted back, so the cost scales with the
+    removed area rather than the photo size.
+    """
+    preset = get_preset(OBJECT_REMOVAL_PRESETS, quality)
+    height, width = img.shape[:2]
+    x1, x2 = max(x1, 0), min(x2, width)
+    y1, y2 = max(y1, 0), min(y2, height)
+    if x1 >= x2 or y1 >= y2:
+        return img.copy()
+    
+    # Crop the region of interest with context for the inpainting passes
+    margin = INPAINT_CONTEXT_MARGIN
+    cx0, cy0 = max(x1 - margin, 0), max(y1 - margin, 0)
+    cx1, cy1 = min(x2 + margin, width), min(y2 + margin, height)
+    roi = img[cy0:cy1, cx0:cx1]
     
-    # Method 3: Advanced inpainting with edge-aware blending
-    result_advanced = advanced_inpainting(img, mask)
+    # Create mask for the region to remove
+    mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+    mask[y1 - cy0:y2 - cy0, x1 - cx0:x2 - cx0] = 255
+    
+    if preset['method'] == 'telea':
+        with stage('inpaint'):
+            result = cv2.inpaint(roi, mask, 3, cv2.INPAINT_TELEA)
+    elif preset['method'] == 'multipass':
+        with stage('inpaint'):
+            result = advanced_inpainting(roi, mask)
+    else:
+        # Method 1: OpenCV NS inpainting
+        with stage('inpaint_ns'):
+            result_ns = cv2.inpaint(roi, mask, 3, cv2.INPAINT_NS)
+        
+        # Method 2: Advanced inpainting with edge-aware blending
+        with stage('inpaint_advanced'):
+            result_advanced = advanced_inpainting(roi, mask)
+        
+        # Blend results into the output, weighting by distance as if over the whole frame
+        with stage('blend'):
+            output = img.copy()
+            max_distance = _max_distance_to_box(width, height, x1, y1, x2, y2)
+            blend_inpainting_results(
+                output[cy0:cy1, cx0:cx1], result_ns, result_advanced, mask, max_distance
+            )
+        return output
+    
+    # Paste the inpainted region back
+    output = img.copy()
+    output[cy0:cy1, cx0:cx1] = result
+    return output
+
+def _max_distance_to_box(width, height, x1, y1, x2, y2):
+    """Largest distance from any pixel of the frame to the box (at a corner)"""
+    distances = []
+    for x, y in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)):
+        dx = max(x1 - x, 0, x - (x2 - 1))
+        dy = max(y1 - y, 0, y - (y2 - 1))
+        distances.append(np.hypot(dx, dy))
+    return max(distances)
+
+def enhance_image_quality_advanced(image_data, ext='.png', workers=None, tile_size=256,
+                                   quality='best', encoding=None):
+    """
+    Advanced image enhancement using multiple techniques
+    """
+    start_time = time.time()
     
-    # Blend results for better quality
-    result = blend_inpainting_results(result_telea, result_ns, result_advanced, mask)
+    # Decode image from the upload buffer
+    img = decode_image(image_data)
     
-    # Apply post-processing
-    result = post_process_inpainting(result, mask)
+    img = enhance_frame(img, workers=workers, tile_size=tile_size, quality=quality)
     
-    # Save the processed image
-    output_path = image_path.replace('.', '_object_removed_advanced.')
-    cv2.imwrite(output_path, result)
+    # Encode the enhanced image
+    output = encode_image(img, ext, encoding=encoding)
     
     processing_time = time.time() - start_time
-    return output_path, processing_time
+    return output, processing_time
 
-def enhance_image_quality_advanced(image_path):
+def enhance_frame(img, workers=None, tile_size=256, quality='best'):
     """
-    Advanced image enhancement using multiple techniques
+    Enhance a decoded BGR array
+
+    With more than one worker the image is split into bands of tile_size
+    rows that are processed on a thread pool (see enhance_frame_parallel).
+    workers='auto' uses this process's share of the CPUs (see cpu_share).
     """
-    start_time = time.time()
-    
-    # Read image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError("Could not read image")
+    preset = get_preset(ENHANCE_PRESETS, quality)
+    if workers == 'auto':
+        workers = cpu_share()
+    if workers and workers > 1 and img.shape[0] > tile_size:
+        return enhance_frame_parallel(img, workers, tile_size, quality=quality)
     
     # Step 1: Noise reduction
-    img = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
+    if preset['denoise']:
+        with stage('denoise'):
+            img = cv2.fastNlMeansDenoisingColored(img, None, *preset['denoise'])
     
     # Step 2: Super resolution for small images
     height, width = img.shape[:2]
     if height < 512 or width < 512:
-        img = enhanced_basic_upscaling(img, 2)
-    
-    # Step 3: Color enhancement
-    img = enhance_colors(img)
-    
-    # Step 4: Sharpening
-    img = adaptive_sharpening(img)
-    
-    # Step 5: Contrast enhancement
-    img = enhance_contrast(img)
-    
-    # Step 6: Final quality boost
-    img = enhance_final_quality(img)
-    
-    # Save the enhanced image
-    output_path = image_path.replace('.', '_enhanced_advanced.')
-    cv2.imwrite(output_path, img)
-    
-    processing_time = time.time() - start_time
-    return output_path, processing_time
+        with stage('upscale'):
+            img = enhanced_basic_upscaling(img, 2)
+    
+    # Steps 3-4: Color enhancement and sharpening
+    work = np.empty_like(img)
+    scratch = np.empty_like(img)
+    with stage('colors_sharpen'):
+        enhance_colors_and_sharpen(img, out=work, scratch=scratch)
+    
+    # Steps 5-6: Contrast enhancement and final quality boost
+    with stage('contrast_finish'):
+        return enhance_contrast_and_finish(work, out=work, lab=scratch)
+
+def enhance_frame_parallel(img, workers, tile_size=256, quality='best'):
+    """
+    Tile-parallel version of enhance_frame
+
+    Tiles are horizontal bands of tile_size rows spanning the full width:
+    OpenCV's vectorised color conversions round the last pixels of a row
+    differently, so keeping whole rows makes the result identical to the
+    whole-frame pipeline. Bands overlap by ENHANCE_TILE_HALO rows so
+    denoising, upscaling and sharpening see all the context they need.
+    The two CLAHE stages need statistics of the whole frame, so the
+    pipeline runs in three parallel passes separated by histogram merges:
+      1. denoise, upscale, color and sharpen each band, collect L histograms
+      2. contrast CLAHE per band and the BGR round trip between the two
+         CLAHE passes, collect histograms for the final CLAHE
+      3. final CLAHE and blur per band (1px halo) into the output frame
+    """
+    preset = get_preset(ENHANCE_PRESETS, quality)
+    height, width = img.shape[:2]
+    halo = ENHANCE_TILE_HALO
+    scale = 2 if height < 512 or width < 512 else 1
+    out_height, out_width = height * scale, width * scale
+    
+    lab_frame = np.empty((out_height, out_width, 3), dtype=np.uint8)
+    output = np.empty_like(lab_frame)
+    contrast = TiledCLAHE((out_height, out_width), clip_limit=2.0)
+    final = TiledCLAHE((out_height, out_width), clip_limit=3.0)
+    hist_lock = threading.Lock()
+    
+    def local_stages(y0, y1, x0, x1):
+        py0 = max(y0 - halo, 0)
+        band = img[py0:min(y1 + halo, height)]
+        
+        if preset['denoise']:
+            band = cv2.fastNlMeansDenoisingColored(band, None, *preset['denoise'])
+        if scale > 1:
+            band = enhanced_basic_upscaling(band, scale)
+        band = enhance_colors_and_sharpen(band)
+        
+        lab = cv2.cvtColor(band[(y0 - py0) * scale:(y1 - py0) * scale], cv2.COLOR_BGR2LAB)
+        lab_frame[y0 * scale:y1 * scale] = lab
+        with hist_lock:
+            contrast.accumulate(lab[:, :, 0], y0 * scale, 0)
+    
+    def contrast_stage(y0, y1, x0, x1):
+        lab = lab_frame[y0:y1]
+        lab[:, :, 0] = contrast.apply(lab[:, :, 0], y0, 0)
+        # Requantize through BGR, as enhance_contrast_and_finish does
+        cv2.cvtColor(cv2.cvtColor(lab, cv2.COLOR_LAB2BGR), cv2.COLOR_BGR2LAB, dst=lab)
+        with hist_lock:
+            final.accumulate(lab[:, :, 0], y0, 0)
+    
+    def final_stage(y0, y1, x0, x1):
+        py0, py1 = max(y0 - 1, 0), min(y1 + 1, out_height)
+        lab = lab_frame[py0:py1].copy()
+        lab[:, :, 0] = final.apply(lab[:, :, 0], py0, 0)
+        enhanced = cv2.GaussianBlur(cv2.cvtColor(lab, cv2.COLOR_LAB2BGR), (3, 3), 0.5)
+        output[y0:y1] = enhanced[y0 - py0:y1 - py0]
+    
+    # Bands run on worker threads, so stages are timed per pass
+    with stage('local_stages'):
+        run_tiles(local_stages, iter_tiles(height, width, tile_size, width), workers)
+        contrast.finalize()
+    
+    out_tiles = list(iter_tiles(out_height, out_width, tile_size * scale, out_width))
+    with stage('contrast'):
+        run_tiles(contrast_stage, out_tiles, workers)
+        final.finalize()
+    
+    with stage('final_quality'):
+        run_tiles(final_stage, out_tiles, workers)
+    return output
 
 # Helper functions for advanced processing
 
@@ -189,44 +567,118 @@ def post_process_background_removal(image):
 def advanced_inpainting(img, mask):
     """Advanced inpainting with multiple passes"""
     # Create a larger mask for better context
-    kernel = np.ones((5, 5), np.uint8)
-    expanded_mask = cv2.dilate(mask, kernel, iterations=1)
+    expanded_mask = cv2.dilate(mask, INPAINT_DILATE_KERNEL, iterations=1)
     
     # Multi-scale inpainting
-    result = img.copy()
-    
     # First pass: large scale
-    result = cv2.inpaint(result, expanded_mask, 5, cv2.INPAINT_TELEA)
+    result = cv2.inpaint(img, expanded_mask, 5, cv2.INPAINT_TELEA)
     
     # Second pass: original scale
     result = cv2.inpaint(result, mask, 3, cv2.INPAINT_NS)
     
     return result
 
-def blend_inpainting_results(result1, result2, result3, mask):
-    """Blend multiple inpainting results"""
-    # Create weight mask based on distance from mask edge
-    distance = cv2.distanceTransform(255 - mask, cv2.DIST_L2, 5)
-    distance = np.clip(distance / distance.max(), 0, 1)
-    
-    # Blend results
-    blended = (result1 * distance[:, :, np.newaxis] + 
-               result2 * (1 - distance[:, :, np.newaxis]) * 0.5 +
-               result3 * (1 - distance[:, :, np.newaxis]) * 0.5)
-    
-    return blended.astype(np.uint8)
+def blend_inpainting_results(region, result_ns, result_advanced, mask, max_distance):
+    """
+    Blend inpainting results into ``region`` (the original pixels) in place
 
-def post_process_inpainting(result, mask):
-    """Post-process inpainting result"""
-    # Apply slight blur to mask edges
-    kernel = np.ones((3, 3), np.uint8)
-    blurred_mask = cv2.GaussianBlur(mask, (5, 5), 0)
-    
-    # Blend original and inpainted result
-    alpha = blurred_mask / 255.0
-    result = result * alpha[:, :, np.newaxis] + result * (1 - alpha[:, :, np.newaxis])
+    The blend weight w is the distance to the mask over max_distance, and
+    each pixel becomes w * telea + (1 - w) * mean(ns, advanced). Inside the
+    mask w is 0, so that is the integer mean of the two results. Outside
+    it Telea and NS both keep the original pixels and advanced_inpainting
+    only changed the ring covered by its dilated mask, so everywhere else
+    the blend is the original pixel and is left untouched. The Telea pass
+    is therefore never needed, and only the ring is blended, in float32.
+    Pixels in the ring match a full float64 blend to within one level.
+    """
+    expanded = cv2.dilate(mask, INPAINT_DILATE_KERNEL, iterations=1)
+    x, y, w, h = cv2.boundingRect(expanded)
+    window = np.s_[y:y + h, x:x + w]
+    inside = mask[window] > 0
+    ring = (expanded[window] > 0) & ~inside
+    target = region[window]
+    
+    # Inside the mask: mean of the NS and two-pass results
+    mean = result_ns[window].astype(np.uint16)
+    mean += result_advanced[window]
+    mean >>= 1
+    target[inside] = mean[inside]
+    
+    # Ring: w * original + (1 - w) * (original + advanced) / 2
+    distance = cv2.distanceTransform(255 - mask[window], cv2.DIST_L2, 5)
+    weight = distance[ring]
+    # A box covering the whole frame leaves no pixel outside it (distance 0)
+    weight *= np.float32(1.0 / max(max_distance, 1))
+    np.minimum(weight, 1, out=weight)
+    weight = weight[:, np.newaxis]
+    
+    original = target[ring].astype(np.float32)
+    blended = result_advanced[window][ring].astype(np.float32)
+    blended += original
+    blended *= 0.5
+    original -= blended
+    original *= weight
+    blended += original
+    target[ring] = blended.astype(np.uint8)
+    return region
+
+# Saturation x1.2 and value x1.1 from enhance_colors as one 3-channel table
+_COLOR_LUT = np.dstack([
+    np.arange(256), np.rint(np.arange(256) * 1.2), np.rint(np.arange(256) * 1.1)
+]).clip(0, 255).astype(np.uint8)
+
+SHARPEN_KERNEL = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+
+_clahe_local = threading.local()
+
+def get_clahe(clip_limit, tile_grid_size=(8, 8)):
+    """CLAHE instance for the calling thread, created once per configuration"""
+    instances = getattr(_clahe_local, 'instances', None)
+    if instances is None:
+        instances = _clahe_local.instances = {}
+    key = (clip_limit, tile_grid_size)
+    clahe = instances.get(key)
+    if clahe is None:
+        clahe = instances[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+    return clahe
+
+def enhance_colors_and_sharpen(img, out=None, scratch=None):
+    """
+    enhance_colors followed by adaptive_sharpening, bit-identical to the
+    two separate stages. The saturation / value scaling is a single table
+    lookup and all intermediates live in the out / scratch buffers
+    (allocated when not given). Returns out.
+    """
+    out = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=out)
+    cv2.LUT(out, _COLOR_LUT, dst=out)
+    scratch = cv2.cvtColor(out, cv2.COLOR_HSV2BGR, dst=scratch)
     
-    return result.astype(np.uint8)
+    cv2.filter2D(scratch, -1, SHARPEN_KERNEL, dst=out)
+    cv2.addWeighted(scratch, 0.7, out, 0.3, 0, dst=out)
+    return out
+
+def enhance_contrast_and_finish(img, out=None, lab=None):
+    """
+    enhance_contrast followed by enhance_final_quality, bit-identical to
+    the two separate stages, with per-thread CLAHE instances and every
+    intermediate in the out / lab buffers (allocated when not given).
+    ``out`` may be ``img``. Returns out.
+    """
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab)
+    lightness = cv2.extractChannel(lab, 0)
+    get_clahe(2.0).apply(lightness, dst=lightness)
+    cv2.insertChannel(lightness, lab, 0)
+    
+    # Requantize through BGR between the passes, as the separate stages do
+    out = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out)
+    cv2.cvtColor(out, cv2.COLOR_BGR2LAB, dst=lab)
+    cv2.extractChannel(lab, 0, dst=lightness)
+    get_clahe(3.0).apply(lightness, dst=lightness)
+    cv2.insertChannel(lightness, lab, 0)
+    
+    # Back to BGR in place, then the artifact-reducing blur into out
+    cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=lab)
+    return cv2.GaussianBlur(lab, (3, 3), 0.5, dst=out)
 
 def enhance_colors(img):
     """Enhance colors using multiple techniques"""
@@ -272,18 +724,23 @@ def enhance_contrast(img):
     return enhanced
 
 # Keep original functions for backward compatibility
-def upscale_image(image_path, scale_factor=2):
+def upscale_image(image_data, scale_factor=2, ext='.png', memory_budget=None, quality='best',
+                  encoding=None):
     """Original upscaling function - now calls advanced version"""
-    return upscale_image_advanced(image_path, scale_factor)
+    return upscale_image_advanced(image_data, scale_factor, ext=ext, memory_budget=memory_budget,
+                                  quality=quality, encoding=encoding)
 
-def remove_background(image_path):
+def remove_background(image_data, ext='.png', quality='best', encoding=None):
     """Original background removal function - now calls advanced version"""
-    return remove_background_advanced(image_path)
+    return remove_background_advanced(image_data, ext=ext, quality=quality, encoding=encoding)
 
-def remove_object(image_path, x1, y1, x2, y2):
+def remove_object(image_data, x1, y1, x2, y2, ext='.png', quality='best', encoding=None):
     """Original object removal function - now calls advanced version"""
-    return remove_object_advanced(image_path, x1, y1, x2, y2)
+    return remove_object_advanced(image_data, x1, y1, x2, y2, ext=ext, quality=quality,
+                                  encoding=encoding)
 
-def enhance_image_quality(image_path):
+def enhance_image_quality(image_data, ext='.png', workers=None, tile_size=256, quality='best',
+                          encoding=None):
     """Original enhancement function - now calls advanced version"""
-    return enhance_image_quality_advanced(image_path) 
\ No newline at end of file
+    return enhance_image_quality_advanced(image_data, ext=ext, workers=workers, tile_size=tile_size,
+                                          quality=quality, encoding=encoding)
\ No newline at end of file
@@ -0,0 +1,230 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ProcessedImage
+from .cache import result_cache
+from .metrics import metrics
+from .storage import processed_name
+from .timing import StageTimer
+
+# Persist the time of the ProcessedImage write itself in stage_timings. It
+# is only known after the row is written, so this costs one extra UPDATE.
+RECORD_DB_WRITE_TIME = getattr(settings, 'IMAGE_STAGE_TIMINGS_DB_WRITE', False)
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds the maximum number of jobs"""
+
+
+def process_and_store(upload, processing_type, func, image_data, cache_key=None,
+                      ext='.png', quality='best', **kwargs):
+    """
+    Process an upload inline and persist it with a single INSERT once
+    processing has finished. Nothing is written when processing fails.
+    """
+    started_at = timezone.now()
+    timer = StageTimer()
+
+    # Process the image, timing its stages
+    with timer.activate():
+        output, processing_time = func(image_data, ext=ext, quality=quality, **kwargs)
+
+    return store_result(
+        upload, processing_type, output, processing_time, started_at,
+        cache_key=cache_key, ext=ext, quality=quality, timer=timer
+    )
+
+
+def store_result(upload, processing_type, output, processing_time, started_at,
+                 cache_key=None, ext='.png', quality='best', timer=None):
+    """
+    Persist an upload and its encoded result as a completed ProcessedImage,
+    adding the storage and DB write stages to the processing stage timings
+    """
+    timer = timer or StageTimer()
+    processed_image = ProcessedImage(
+        original_image=upload,
+        processing_type=processing_type,
+        quality=quality,
+        cache_key=cache_key,
+        processing_time=processing_time,
+        processed_size=len(output),
+        original_size=upload.size,
+        status='completed',
+        started_at=started_at,
+        finished_at=timezone.now(),
+    )
+    # Both files are written before the INSERT so the two are timed apart
+    with timer.stage('storage_write'):
+        processed_image.original_image.save(upload.name, upload, save=False)
+        processed_image.processed_image.save(
+            processed_name(output, ext),
+            ContentFile(output),
+            save=False
+        )
+    _save_with_timings(processed_image, timer)
+    metrics.inc('image_api_output_bytes_total', len(output), processing_type=processing_type)
+
+    if cache_key:
+        result_cache.maybe_evict()
+    return processed_image
+
+
+def run_processing(processed_image, func, image_data=None, ext='.png', **kwargs):
+    """
+    Run a processing function for a queued ProcessedImage and store the result.
+
+    The function works on in-memory buffers: ``image_data`` is the encoded
+    upload (read back from storage when not given) and the encoded output
+    is written to storage exactly once.
+
+    The row moves from pending to processing to completed (or failed, with
+    the error message recorded) so the job can be polled.
+    """
+    start_processing(processed_image)
+
+    try:
+        timer = StageTimer()
+        if image_data is None:
+            with timer.stage('storage_read'):
+                with processed_image.original_image.open('rb') as f:
+                    image_data = f.read()
+
+        # Process the image, timing its stages
+        with timer.activate():
+            output, processing_time = func(image_data, ext=ext, **kwargs)
+
+        complete_processing(processed_image, output, processing_time, ext, timer)
+    except Exception as e:
+        fail_processing(processed_image, e)
+        raise
+    finally:
+        # Release requests waiting on this result
+        if processed_image.cache_key:
+            result_cache.finished(processed_image)
+
+    if processed_image.cache_key:
+        result_cache.maybe_evict()
+    return processed_image
+
+
+def start_processing(processed_image):
+    """Move a pending ProcessedImage to processing"""
+    processed_image.status = 'processing'
+    processed_image.started_at = timezone.now()
+    processed_image.save(update_fields=['status', 'started_at'])
+
+
+def complete_processing(processed_image, output, processing_time, ext, timer):
+    """Store the encoded result of a ProcessedImage and mark it completed"""
+    with timer.stage('storage_write'):
+        processed_image.processed_image.save(
+            processed_name(output, ext),
+            ContentFile(output),
+            save=False
+        )
+
+    processed_image.processing_time = processing_time
+    processed_image.processed_size = len(output)
+    processed_image.status = 'completed'
+    processed_image.finished_at = timezone.now()
+    _save_with_timings(processed_image, timer)
+    metrics.inc('image_api_output_bytes_total', len(output),
+                processing_type=processed_image.processing_type)
+
+
+def fail_processing(processed_image, error):
+    """Mark a ProcessedImage failed, recording the error for the poller"""
+    processed_image.status = 'failed'
+    processed_image.error = str(error)
+    processed_image.finished_at = timezone.now()
+    processed_image.save(update_fields=['status', 'error', 'finished_at'])
+
+
+def _save_with_timings(processed_image, timer):
+    """
+    Save a ProcessedImage with its stage timings, timing the save as the
+    db_write stage. The returned instance always includes db_write; the
+    stored row only with IMAGE_STAGE_TIMINGS_DB_WRITE.
+    """
+    processed_image.stage_timings = timer.as_dict()
+    with timer.stage('db_write'):
+        processed_image.save()
+
+    processed_image.stage_timings = timer.as_dict()
+    if RECORD_DB_WRITE_TIME:
+        ProcessedImage.objects.filter(pk=processed_image.pk).update(
+            stage_timings=processed_image.stage_timings
+        )
+
+
+class JobQueue:
+    """
+    Bounded worker pool for processing jobs submitted in async mode.
+
+    OpenCV and onnxruntime release the GIL while they work, so a small
+    thread pool keeps several images processing at once. At most
+    ``max_pending`` jobs may be queued or running; further submissions are
+    rejected with QueueFull instead of piling up.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """Number of jobs queued or running"""
+        return self._pending
+
+    def submit(self, processed_image, func, **kwargs):
+        """Queue a job for a ProcessedImage that was created as pending"""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull("Processing queue is full, please retry later.")
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='image-job'
+                )
+            self._pending += 1
+
+        try:
+            return self._executor.submit(self._run, processed_image.pk, func, kwargs)
+        except Exception:
+            self._release()
+            raise
+
+    def _run(self, image_id, func, kwargs):
+        close_old_connections()
+        try:
+            processed_image = ProcessedImage.objects.get(pk=image_id)
+            run_processing(processed_image, func, **kwargs)
+        except Exception:
+            # The failure is recorded on the row for the poller
+            pass
+        finally:
+            close_old_connections()
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+
+job_queue = JobQueue(
+    max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+    max_pending=getattr(settings, 'IMAGE_PROCESSING_MAX_PENDING', 32),
+)
+metrics.add_collector(lambda: [('image_api_job_queue_depth', {}, job_queue.pending)])
@@ -0,0 +1,191 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from image_apis.models import ProcessedImage
+
+DEFAULT_SETTINGS = {
+    'MAX_AGE_DAYS': None,
+    'MAX_BYTES': None,
+    'GRACE_SECONDS': 3600,
+    'BATCH_SIZE': 500,
+}
+
+# Rows no request or job is still working on; queued and running rows
+# are never deleted, whatever their age
+FINISHED_STATUSES = ('completed', 'failed')
+
+# Storage directories holding ProcessedImage files, including the flat
+# layout used before sharding (and the temp files the old views left there)
+MEDIA_PREFIXES = ('originals', 'processed', 'original_images', 'processed_images')
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the retention policies (age, total size) to processed images, "
+        "delete the rows in batches with the files no other row uses, and "
+        "delete orphaned media files. Safe to run while serving traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float,
+                            help="Delete finished rows created more than this many days ago.")
+        parser.add_argument('--max-bytes', type=int,
+                            help="Delete the oldest finished rows until their originals "
+                                 "and results total at most this many bytes.")
+        parser.add_argument('--grace-seconds', type=int,
+                            help="Never delete files written or reused more recently than this.")
+        parser.add_argument('--batch-size', type=int,
+                            help="Rows deleted per query and files checked per query.")
+        parser.add_argument('--skip-orphans', action='store_true',
+                            help="Do not scan storage for files no row references.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be deleted without deleting anything.")
+
+    def handle(self, *args, **options):
+        policy = {**DEFAULT_SETTINGS, **getattr(settings, 'IMAGE_RETENTION', {})}
+        for key in ('max_age_days', 'max_bytes', 'grace_seconds', 'batch_size'):
+            if options[key] is not None:
+                policy[key.upper()] = options[key]
+
+        self.dry_run = options['dry_run']
+        self.batch_size = policy['BATCH_SIZE']
+        self.grace_cutoff = timezone.now() - timedelta(seconds=policy['GRACE_SECONDS'])
+        self.stats = {'rows': 0, 'files': 0, 'bytes': 0, 'orphan_files': 0, 'orphan_bytes': 0}
+
+        if policy['MAX_AGE_DAYS'] is not None:
+            cutoff = timezone.now() - timedelta(days=policy['MAX_AGE_DAYS'])
+            expired = ProcessedImage.objects.filter(
+                status__in=FINISHED_STATUSES, created_at__lt=cutoff
+            ).order_by('pk')
+            self._delete_rows(list(expired.values_list('pk', flat=True)))
+
+        if policy['MAX_BYTES'] is not None:
+            self._delete_rows(self._over_budget(policy['MAX_BYTES']))
+
+        if not options['skip_orphans']:
+            self._delete_orphans()
+
+        stats = self.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would delete' if self.dry_run else 'Deleted'} {stats['rows']} rows and "
+            f"{stats['files']} files ({stats['orphan_files']} orphaned, "
+            f"{_format_bytes(stats['orphan_bytes'])}); "
+            f"{'would reclaim' if self.dry_run else 'reclaimed'} {_format_bytes(stats['bytes'])}."
+        ))
+
+    def _over_budget(self, max_bytes):
+        """
+        Ids of the oldest finished rows to delete to get under max_bytes,
+        read in full before any row is deleted
+        """
+        finished = ProcessedImage.objects.filter(status__in=FINISHED_STATUSES)
+        sizes = finished.annotate(
+            size=Coalesce('processed_size', 0) + Coalesce('original_size', 0)
+        )
+        total = sizes.aggregate(total=Sum('size'))['total'] or 0
+        ids = []
+        for pk, size in sizes.order_by('created_at', 'pk').values_list('pk', 'size'):
+            if total <= max_bytes:
+                break
+            total -= size
+            ids.append(pk)
+        return ids
+
+    def _delete_rows(self, ids):
+        """
+        Delete rows one batch per query, then the files they leave
+        unreferenced. ids is a list: no cursor over the table stays open
+        while its rows are deleted.
+        """
+        for batch in _batches(ids, self.batch_size):
+            rows = ProcessedImage.objects.filter(pk__in=batch)
+            names = {
+                name for pair in rows.values_list('original_image', 'processed_image')
+                for name in pair if name
+            }
+            if not self.dry_run:
+                rows.delete()
+            self.stats['rows'] += len(batch)
+            self._delete_files(names, exclude_ids=batch)
+
+    def _delete_orphans(self):
+        """Delete stored files that no row references"""
+        for prefix in MEDIA_PREFIXES:
+            for batch in _batches(_walk(default_storage, prefix), self.batch_size):
+                self._delete_files(set(batch), orphans=True)
+
+    def _delete_files(self, names, exclude_ids=(), orphans=False):
+        referenced = self._referenced(names, exclude_ids)
+        for name in sorted(names - referenced):
+            size = self._delete_file(name)
+            if size is None:
+                continue
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+            if orphans:
+                self.stats['orphan_files'] += 1
+                self.stats['orphan_bytes'] += size
+
+    def _referenced(self, names, exclude_ids=()):
+        """The names still used by rows other than exclude_ids"""
+        if not names:
+            return set()
+        rows = ProcessedImage.objects.filter(
+            Q(original_image__in=names) | Q(processed_image__in=names)
+        ).exclude(pk__in=exclude_ids)
+        return {
+            name for pair in rows.values_list('original_image', 'processed_image')
+            for name in pair if name in names
+        }
+
+    def _delete_file(self, name):
+        """
+        Delete one file and return its size, or None when it is gone or was
+        written (or reused by an identical upload) within the grace period:
+        its row may not have been saved yet
+        """
+        try:
+            if default_storage.get_modified_time(name) > self.grace_cutoff:
+                return None
+            size = default_storage.size(name)
+            if not self.dry_run:
+                default_storage.delete(name)
+        except FileNotFoundError:
+            return None
+        return size
+
+
+def _walk(storage, path):
+    """Names of all files under a storage directory"""
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f'{path}/{name}'
+    for directory in directories:
+        yield from _walk(storage, f'{path}/{directory}')
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
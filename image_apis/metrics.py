@@ -0,0 +1,369 @@
+import asyncio
+import atexit
+import fcntl
+import functools
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_SETTINGS = {
+    'DIR': None,
+    'FLUSH_INTERVAL': 5,
+}
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# name: (type, help)
+METRICS = {
+    'image_api_requests_total': (
+        'counter', 'Processing requests by processing type and HTTP status code'),
+    'image_api_request_duration_seconds': (
+        'histogram', 'Processing request latency by processing type'),
+    'image_api_requests_in_flight': (
+        'gauge', 'Processing requests currently being handled'),
+    'image_api_received_bytes_total': (
+        'counter', 'Request body bytes received by processing type'),
+    'image_api_output_bytes_total': (
+        'counter', 'Encoded result bytes produced by processing type'),
+    'image_api_model_session_hits_total': (
+        'counter', 'Requests served by an already loaded model session'),
+    'image_api_model_session_loads_total': (
+        'counter', 'Model sessions loaded'),
+    'image_api_job_queue_depth': (
+        'gauge', 'Async jobs queued or running'),
+    'image_api_compute_pool_pending': (
+        'gauge', 'Tasks queued or running on the async views\' process pool'),
+    'image_api_process_resident_memory_bytes': (
+        'gauge', 'Resident memory of each live worker process'),
+}
+
+# Gauges kept per process rather than summed across processes
+PER_PROCESS_GAUGES = {'image_api_process_resident_memory_bytes'}
+
+# Counters and histograms of exited processes, summed into one file
+EXITED_FILE = 'exited.json'
+
+
+class Metrics:
+    """
+    In-process counters, gauges and histograms in the Prometheus text format.
+
+    Updates only touch a dict under a lock. With a DIR configured every
+    process also writes its values to DIR/<pid>.json (at most once per
+    FLUSH_INTERVAL seconds and at exit) and a scrape of any process sums
+    the files of all of them, so each worker of a multi-process server
+    reports for the whole deployment. Counters of processes that have
+    exited are kept: a scrape folds them into DIR/exited.json and deletes
+    their files, and so does a new process reusing an exited one's pid
+    before it replaces that file. Their gauges are dropped.
+    """
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_SETTINGS, **(options or {})}
+        self._lock = threading.Lock()
+        self._values = {}
+        self._collectors = []
+        self._last_flush = 0
+        self._token = None
+        self._token_pid = None
+        self._flushed_pid = None
+
+    @property
+    def directory(self):
+        return self.options['DIR']
+
+    @property
+    def token(self):
+        """Identifies this process; unlike its pid, never reused"""
+        if self._token_pid != os.getpid():
+            self._token = uuid.uuid4().hex
+            self._token_pid = os.getpid()
+        return self._token
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter or gauge"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._maybe_flush()
+
+    def dec(self, name, amount=1, **labels):
+        self.inc(name, -amount, **labels)
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            buckets = self._values.get(key)
+            if buckets is None:
+                buckets = self._values[key] = [0] * len(LATENCY_BUCKETS) + [0.0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+                    break
+            buckets[-1] += value
+        self._maybe_flush()
+
+    def add_collector(self, collector):
+        """
+        Register a function returning (name, labels, value) gauge samples
+        read at flush and scrape time, e.g. the job queue depth
+        """
+        self._collectors.append(collector)
+        return collector
+
+    def snapshot(self):
+        """This process's samples, including the collected gauges"""
+        with self._lock:
+            samples = [
+                [name, dict(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.append([name, labels, value])
+        return {'pid': os.getpid(), 'token': self.token, 'samples': samples}
+
+    def flush(self):
+        """Write this process's snapshot to DIR atomically"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        if self._flushed_pid != os.getpid():
+            # An exited process with the same pid may have left its counters here
+            with self._directory_lock():
+                self._fold(path)
+            self._flushed_pid = os.getpid()
+        _write_json(path, self.snapshot())
+
+    @contextmanager
+    def _directory_lock(self):
+        """Serialize folding files into EXITED_FILE across processes"""
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fold(self, path):
+        """
+        Add the counters and histograms of an exited process's file to
+        EXITED_FILE and delete it. Call with the directory lock held.
+        """
+        data = _read_json(path)
+        if data is None or data.get('token') == self.token:
+            return
+        exited_path = os.path.join(self.directory, EXITED_FILE)
+        exited = _read_json(exited_path) or {'pid': None, 'samples': []}
+        totals = {}
+        for name, labels, value in exited['samples'] + data['samples']:
+            if METRICS[name][0] != 'gauge':
+                _add(totals, name, _label_key(labels), value)
+        exited['samples'] = [[name, dict(labels), value] for (name, labels), value in totals.items()]
+        _write_json(exited_path, exited)
+        os.remove(path)
+
+    def _maybe_flush(self):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_flush < self.options['FLUSH_INTERVAL']:
+                return
+            self._last_flush = now
+        self.flush()
+
+    def collect(self):
+        """
+        Snapshots of every process: this one live, the others from DIR,
+        and the summed counters of exited processes
+        """
+        current = self.snapshot()
+        if not self.directory:
+            return [(current, True)]
+
+        self.flush()
+        snapshots = [(current, True)]
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if os.path.basename(path) == EXITED_FILE:
+                continue
+            data = _read_json(path)
+            if data is None or data['pid'] == current['pid']:
+                continue
+            if _pid_alive(data['pid']):
+                snapshots.append((data, True))
+                continue
+            with self._directory_lock():
+                if not _pid_alive(data['pid']):
+                    self._fold(path)
+
+        exited = _read_json(os.path.join(self.directory, EXITED_FILE))
+        if exited is not None:
+            snapshots.append((exited, False))
+        return snapshots
+
+    def render(self):
+        """All processes' metrics in the Prometheus text exposition format"""
+        totals = {}
+        for snapshot, alive in self.collect():
+            for name, labels, value in snapshot['samples']:
+                kind = METRICS[name][0]
+                if kind == 'gauge' and not alive:
+                    continue
+                if name in PER_PROCESS_GAUGES:
+                    labels = {**labels, 'pid': str(snapshot['pid'])}
+                _add(totals, name, _label_key(labels), value)
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            samples = sorted(
+                (labels, value) for (sample_name, labels), value in totals.items()
+                if sample_name == name
+            )
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                if kind == 'histogram':
+                    lines.extend(_histogram_lines(name, labels, value))
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def track_request(self, mode):
+        """
+        Decorator adding request count, latency, in-flight and received bytes
+        metrics to a processing view (sync or async) taking an ``operation``
+        argument; mode ('single', 'batch' or 'async') tells the kinds of
+        endpoint apart
+        """
+        def decorator(view):
+            if asyncio.iscoroutinefunction(view):
+                @functools.wraps(view)
+                async def async_wrapper(request, *args, **kwargs):
+                    start_time = self._request_started(mode)
+                    code = 500
+                    try:
+                        response = await view(request, *args, **kwargs)
+                        code = response.status_code
+                        return response
+                    finally:
+                        self._request_finished(request, kwargs, mode, start_time, code)
+                return async_wrapper
+
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                start_time = self._request_started(mode)
+                code = 500
+                try:
+                    response = view(request, *args, **kwargs)
+                    code = response.status_code
+                    return response
+                finally:
+                    self._request_finished(request, kwargs, mode, start_time, code)
+            return wrapper
+        return decorator
+
+    def _request_started(self, mode):
+        self.inc('image_api_requests_in_flight', mode=mode)
+        return time.perf_counter()
+
+    def _request_finished(self, request, kwargs, mode, start_time, code):
+        labels = {'processing_type': kwargs.get('operation', ''), 'mode': mode}
+        self.dec('image_api_requests_in_flight', mode=mode)
+        self.observe('image_api_request_duration_seconds',
+                     time.perf_counter() - start_time, **labels)
+        self.inc('image_api_requests_total', code=str(code), **labels)
+        self.inc('image_api_received_bytes_total',
+                 int(request.META.get('CONTENT_LENGTH') or 0), **labels)
+
+
+def _add(totals, name, labels, value):
+    """Sum a sample into totals keyed by (name, label key)"""
+    key = (name, labels)
+    if isinstance(value, list):
+        current = totals.get(key, [0] * len(value))
+        totals[key] = [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _read_json(path):
+    """Parsed JSON file, or None when it is missing or being replaced"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as tmp:
+        json.dump(data, tmp)
+    os.replace(tmp_path, path)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _histogram_lines(name, labels, buckets):
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else str(bound)
+        yield f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}'
+    yield f'{name}_sum{_format_labels(labels)} {_format_value(buckets[-1])}'
+    yield f'{name}_count{_format_labels(labels)} {cumulative}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _resident_memory():
+    """Resident set size of this process from /proc (Linux only)"""
+    try:
+        with open('/proc/self/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return []
+    return [('image_api_process_resident_memory_bytes', {}, rss_pages * os.sysconf('SC_PAGE_SIZE'))]
+
+
+metrics = Metrics(getattr(settings, 'IMAGE_METRICS', None))
+metrics.add_collector(_resident_memory)
+atexit.register(metrics.flush)
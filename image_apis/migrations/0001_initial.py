@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:49
+
+import image_apis.models
+import image_apis.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_image', models.ImageField(upload_to=image_apis.storage.sharded_original_path)),
+                ('processed_image', models.ImageField(blank=True, null=True, upload_to=image_apis.storage.sharded_processed_path)),
+                ('processing_type', models.CharField(choices=image_apis.models.processing_type_choices, max_length=32)),
+                ('quality', models.CharField(choices=[('fast', 'Fast'), ('balanced', 'Balanced'), ('best', 'Best')], default='best', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processing_time', models.FloatField(blank=True, null=True)),
+                ('stage_timings', models.JSONField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('cache_key', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('processed_size', models.BigIntegerField(blank=True, null=True)),
+                ('original_size', models.BigIntegerField(blank=True, null=True)),
+                ('last_accessed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['-created_at', '-id'], name='processed_created_idx'), models.Index(fields=['processing_type', '-created_at', '-id'], name='processed_type_created_idx')],
+            },
+        ),
+    ]
@@ -1,28 +1,53 @@
 from django.db import models
-import os
-import uuid
+from .storage import sharded_original_path, sharded_processed_path
 
-def get_upload_path(instance, filename):
-    """Generate unique upload path for images"""
-    ext = filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
-    return os.path.join('processed_images', filename)
+QUALITY_CHOICES = [
+    ('fast', 'Fast'),
+    ('balanced', 'Balanced'),
+    ('best', 'Best'),
+]
+
+def processing_type_choices():
+    """Processing types come from the operation registry, plus pipelines"""
+    from .operations import OPERATIONS
+    from .pipeline import PIPELINE, PIPELINE_LABEL
+    return [(operation.name, operation.label) for operation in OPERATIONS.values()] + [
+        (PIPELINE, PIPELINE_LABEL)
+    ]
 
 class ProcessedImage(models.Model):
-    PROCESSING_TYPES = [
-        ('upscale', 'Image Upscaler'),
-        ('background_removal', 'Background Remover'),
-        ('object_removal', 'Object Remover'),
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
     ]
     
-    original_image = models.ImageField(upload_to='original_images/')
-    processed_image = models.ImageField(upload_to=get_upload_path, null=True, blank=True)
-    processing_type = models.CharField(max_length=20, choices=PROCESSING_TYPES)
+    # Files are stored under sharded content-hash names (see storage.py)
+    original_image = models.ImageField(upload_to=sharded_original_path)
+    processed_image = models.ImageField(upload_to=sharded_processed_path, null=True, blank=True)
+    processing_type = models.CharField(max_length=32, choices=processing_type_choices)
+    quality = models.CharField(max_length=10, choices=QUALITY_CHOICES, default='best')
     created_at = models.DateTimeField(auto_now_add=True)
     processing_time = models.FloatField(null=True, blank=True)  # in seconds
+    stage_timings = models.JSONField(null=True, blank=True)  # seconds per stage
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    cache_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    processed_size = models.BigIntegerField(null=True, blank=True)  # in bytes
+    original_size = models.BigIntegerField(null=True, blank=True)  # in bytes
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination of the processed images listing
+            models.Index(fields=['-created_at', '-id'], name='processed_created_idx'),
+            # The same listing filtered by processing type
+            models.Index(fields=['processing_type', '-created_at', '-id'], name='processed_type_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_processing_type_display()} - {self.created_at}"
@@ -0,0 +1,162 @@
+from functools import partial
+from .image_processing import (
+    upscale_image, remove_background, remove_object, enhance_image_quality,
+    upscale_image_advanced, remove_background_advanced, remove_object_advanced, enhance_image_quality_advanced,
+    remove_background_batch, upscale_frame, remove_background_frame, remove_object_frame, enhance_frame
+)
+from .serializers import (
+    ProcessingParamsSerializer, UpscaleParamsSerializer, ObjectRemovalParamsSerializer
+)
+from django.conf import settings
+
+# Upscales whose whole-frame pipeline would exceed this many bytes run tiled
+UPSCALE_MEMORY_BUDGET = getattr(settings, 'IMAGE_UPSCALE_MEMORY_BUDGET', None)
+
+# Enhancement runs on this many threads, in bands of this many rows
+ENHANCE_PARALLELISM = {
+    'workers': getattr(settings, 'IMAGE_ENHANCE_WORKERS', 'auto'),
+    'tile_size': getattr(settings, 'IMAGE_ENHANCE_TILE_SIZE', 256),
+}
+
+# Batch requests run background removal on this many images per inference call
+BATCH_INFERENCE_SIZE = getattr(settings, 'IMAGE_BATCH_INFERENCE_SIZE', 8)
+
+
+class Operation:
+    """
+    A processing operation exposed by the API.
+
+    name            processing_type stored on ProcessedImage
+    label           human readable name shown in the admin
+    route           URL path segment under /api/
+    url_name        name of the generated URL pattern
+    func            processing function taking (image_data, ext=..., quality=..., **params)
+    params          serializer validating the request parameters (including
+                    the quality tier), or None
+    defaults        fixed parameters passed to func
+    output_ext      forced output format, or None to keep the upload's format
+    batch_func      function processing many images at once for batch
+                    requests, taking (images_data, ext=..., **params) and
+                    returning (output, processing_time) or an exception per
+                    image; requires output_ext. None processes them one by one
+    output_size     function taking (width, height, params) and returning
+                    the output dimensions, checked against the megapixel
+                    limits before decoding; None keeps the input size
+    frame_func      function applying the operation to a decoded frame,
+                    taking (img, quality=..., **params) and returning the
+                    new frame, used by pipelines; None keeps it out of them
+    """
+
+    def __init__(self, name, label, route, url_name, func, params=None,
+                 defaults=None, output_ext=None, batch_func=None, output_size=None,
+                 frame_func=None):
+        self.name = name
+        self.label = label
+        self.route = route
+        self.url_name = url_name
+        self.func = func
+        self.params = params
+        self.defaults = defaults or {}
+        self.output_ext = output_ext
+        self.batch_func = batch_func
+        self._output_size = output_size
+        self.frame_func = frame_func
+
+    def output_size(self, width, height, params):
+        """Dimensions of the result for an input of width x height"""
+        if self._output_size is None:
+            return width, height
+        return self._output_size(width, height, params)
+
+    def parse_params(self, data):
+        """Validate request parameters; returns (params, errors)"""
+        params = dict(self.defaults)
+        if self.params is None:
+            return params, None
+
+        serializer = self.params(data=data)
+        if not serializer.is_valid():
+            return None, serializer.errors
+        params.update(serializer.validated_data)
+        return params, None
+
+
+def upscaled_size(width, height, params):
+    scale_factor = params['scale_factor']
+    return width * scale_factor, height * scale_factor
+
+
+def enhanced_size(width, height, params):
+    # Enhancement doubles small images (see enhance_frame)
+    scale = 2 if width < 512 or height < 512 else 1
+    return width * scale, height * scale
+
+
+OPERATIONS = {}
+
+
+def register(operation):
+    """Add an operation to the registry; its URL is routed automatically"""
+    OPERATIONS[operation.name] = operation
+    return operation
+
+
+def get_operation(name):
+    return OPERATIONS[name]
+
+
+def find_operation(key):
+    """Registered operation by name or route, or None"""
+    if key in OPERATIONS:
+        return OPERATIONS[key]
+    for operation in OPERATIONS.values():
+        if operation.route == key:
+            return operation
+    return None
+
+
+# Basic Image processing APIs
+register(Operation(
+    'upscale', 'Image Upscaler', 'upscale', 'upscale_image',
+    upscale_image, params=ProcessingParamsSerializer,
+    defaults={'scale_factor': 2, 'memory_budget': UPSCALE_MEMORY_BUDGET},
+    output_size=upscaled_size, frame_func=upscale_frame,
+))
+register(Operation(
+    'background_removal', 'Background Remover', 'remove-background', 'remove_background',
+    remove_background, params=ProcessingParamsSerializer, output_ext='.png',
+    batch_func=partial(remove_background_batch, batch_size=BATCH_INFERENCE_SIZE),
+    frame_func=remove_background_frame,
+))
+register(Operation(
+    'object_removal', 'Object Remover', 'remove-object', 'remove_object',
+    remove_object, params=ObjectRemovalParamsSerializer, frame_func=remove_object_frame,
+))
+register(Operation(
+    'enhancement', 'Image Enhancer', 'enhance', 'enhance_image',
+    enhance_image_quality, params=ProcessingParamsSerializer, defaults=ENHANCE_PARALLELISM,
+    output_size=enhanced_size, frame_func=enhance_frame,
+))
+
+# Advanced Image processing APIs
+register(Operation(
+    'upscale_advanced', 'Advanced Image Upscaler', 'upscale-advanced', 'upscale_image_advanced',
+    upscale_image_advanced, params=UpscaleParamsSerializer,
+    defaults={'memory_budget': UPSCALE_MEMORY_BUDGET},
+    output_size=upscaled_size, frame_func=upscale_frame,
+))
+register(Operation(
+    'background_removal_advanced', 'Advanced Background Remover', 'remove-background-advanced', 'remove_background_advanced',
+    remove_background_advanced, params=ProcessingParamsSerializer, output_ext='.png',
+    batch_func=partial(remove_background_batch, batch_size=BATCH_INFERENCE_SIZE),
+    frame_func=remove_background_frame,
+))
+register(Operation(
+    'object_removal_advanced', 'Advanced Object Remover', 'remove-object-advanced', 'remove_object_advanced',
+    remove_object_advanced, params=ObjectRemovalParamsSerializer, frame_func=remove_object_frame,
+))
+register(Operation(
+    'enhancement_advanced', 'Advanced Image Enhancer', 'enhance-advanced', 'enhance_image_advanced',
+    enhance_image_quality_advanced, params=ProcessingParamsSerializer,
+    defaults=ENHANCE_PARALLELISM, output_size=enhanced_size, frame_func=enhance_frame,
+))
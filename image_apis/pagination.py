@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ProcessedImageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Each page is fetched with ``WHERE created_at < <cursor> ORDER BY
+    created_at DESC, id DESC LIMIT n`` on the composite indexes declared
+    on ProcessedImage, so the cost of a page does not grow with the table.
+    Rows sharing a timestamp are disambiguated by the cursor's offset.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = getattr(settings, 'PROCESSED_IMAGES_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PROCESSED_IMAGES_MAX_PAGE_SIZE', 200)
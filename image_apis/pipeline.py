@@ -0,0 +1,118 @@
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .image_processing import decode_image, encode_image
+from .operations import Operation, find_operation, get_operation
+
+PIPELINE = 'pipeline'
+PIPELINE_LABEL = 'Processing Pipeline'
+
+# Upper bound on the steps of one pipeline request
+PIPELINE_MAX_STEPS = getattr(settings, 'IMAGE_PIPELINE_MAX_STEPS', 8)
+
+# The output encoding belongs to the pipeline, which encodes once
+ENCODING_PARAMS = ('output_format', 'output_quality', 'effort')
+
+
+def parse_steps(raw_steps, quality):
+    """
+    Validate the steps of a pipeline request, a list of
+    {"operation": <name or route>, ...parameters}. Steps without a quality
+    use the pipeline's. Returns ([(operation, params)], errors).
+    """
+    if not isinstance(raw_steps, list) or not raw_steps:
+        return None, ['Give a non-empty list of steps.']
+    if len(raw_steps) > PIPELINE_MAX_STEPS:
+        return None, [f'Too many steps. Maximum is {PIPELINE_MAX_STEPS}.']
+
+    steps = []
+    errors = {}
+    for index, raw_step in enumerate(raw_steps):
+        if not isinstance(raw_step, dict):
+            errors[index] = ['Each step must be an object.']
+            continue
+        operation = find_operation(raw_step.get('operation'))
+        if operation is None or operation.frame_func is None:
+            errors[index] = {'operation': [f"Unknown operation '{raw_step.get('operation')}'."]}
+            continue
+        encoding = [key for key in ENCODING_PARAMS if key in raw_step]
+        if encoding:
+            errors[index] = {key: ['Set the output encoding on the pipeline, not on a step.']
+                             for key in encoding}
+            continue
+
+        params, step_errors = operation.parse_params({'quality': quality, **raw_step})
+        if step_errors:
+            errors[index] = step_errors
+            continue
+        steps.append((operation, params))
+
+    if errors:
+        return None, errors
+    return steps, None
+
+
+def pipeline_operation(steps):
+    """
+    Operation running the steps as one processing function. Its results
+    keep an alpha channel (PNG) once a step has added one.
+    """
+    output_ext = next(
+        (operation.output_ext for operation, _ in reversed(steps) if operation.output_ext), None
+    )
+    return Operation(
+        PIPELINE, PIPELINE_LABEL, 'pipeline', 'process_pipeline',
+        run_pipeline, output_ext=output_ext,
+    )
+
+
+def run_pipeline(image_data, steps, ext='.png', quality='best', encoding=None,
+                 intermediates=None):
+    """
+    Run operations one after another on a single decoded frame, encoding
+    only the final result
+
+    steps is a list of (operation name, params) and quality is recorded
+    per step. When intermediates is a list, the encoded result of every
+    step but the last is appended to it as (operation name, output,
+    seconds elapsed).
+    """
+    start_time = time.time()
+
+    # Decode image from the upload buffer, once for every step
+    img = decode_image(image_data)
+
+    for index, (name, params) in enumerate(steps):
+        img = _apply(get_operation(name).frame_func, img, params)
+        if intermediates is not None and index < len(steps) - 1:
+            output = encode_image(img, ext, encoding=encoding)
+            intermediates.append((name, output, time.time() - start_time))
+
+    # Encode the final image
+    output = encode_image(img, ext, encoding=encoding)
+
+    processing_time = time.time() - start_time
+    return output, processing_time
+
+
+def _apply(frame_func, img, params):
+    """
+    Apply a frame function. Frames with an alpha channel (after background
+    removal) are processed as BGR and keep their alpha, resized with them.
+    """
+    if img.shape[2] != 4:
+        return frame_func(img, **params)
+
+    alpha = img[..., 3]
+    result = frame_func(np.ascontiguousarray(img[..., :3]), **params)
+    height, width = result.shape[:2]
+    if alpha.shape != (height, width):
+        alpha = cv2.resize(alpha, (width, height), interpolation=cv2.INTER_LINEAR)
+    if result.shape[2] == 4:
+        # A second cutout keeps what the earlier ones removed
+        np.minimum(result[..., 3], alpha, out=result[..., 3])
+        return result
+    return np.dstack((result, alpha))
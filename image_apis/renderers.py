@@ -0,0 +1,39 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .encoders import prefers_image
+
+
+class ImageRenderer(BaseRenderer):
+    """
+    Accepts ``image/*`` in the Accept header so clients can ask for the
+    processed image bytes instead of JSON.
+
+    Views return the image itself as a plain HttpResponse; anything else
+    rendered through this renderer (validation errors, exceptions) is
+    sent as JSON with a JSON content type.
+    """
+    media_type = 'image/*'
+    format = 'image'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+def wants_binary(request):
+    """
+    Whether the client asked for the image bytes themselves, with
+    return=binary (query string or form field) or an Accept header that
+    prefers an image to JSON. Shared by the DRF and the async views, for
+    Django and DRF requests alike.
+    """
+    data = getattr(request, 'data', request.POST)
+    value = request.GET.get('return', data.get('return', ''))
+    return value == 'binary' or prefers_image(request.META.get('HTTP_ACCEPT', ''))
@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from .models import ProcessedImage
+from django.urls import reverse
+from django.conf import settings
+from .models import ProcessedImage, QUALITY_CHOICES
+from .encoders import OUTPUT_FORMATS, EFFORT_LEVELS
+from .validation import inspect_image
 
 class ImageUploadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,13 +15,66 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         if value.size > 10 * 1024 * 1024:
             raise serializers.ValidationError("Image file too large. Maximum size is 10MB.")
         
-        # Validate file type
-        allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']
-        if value.content_type not in allowed_types:
+        # Validate file type from the magic bytes rather than the client's content_type,
+        # reading the dimensions from the header for the megapixel limits
+        info = inspect_image(value)
+        if info is None:
             raise serializers.ValidationError("Unsupported file type. Please upload JPEG, PNG, or WebP images.")
+        value.image_info = info
         
         return value
 
+class ProcessingParamsSerializer(serializers.Serializer):
+    quality = serializers.ChoiceField(
+        choices=QUALITY_CHOICES,
+        default=getattr(settings, 'IMAGE_DEFAULT_QUALITY', 'best')
+    )
+    # Output encoding; without these the result keeps the upload's format
+    output_format = serializers.ChoiceField(choices=list(OUTPUT_FORMATS), required=False)
+    output_quality = serializers.IntegerField(min_value=1, max_value=100, required=False)
+    effort = serializers.ChoiceField(choices=EFFORT_LEVELS, required=False)
+
+class UpscaleParamsSerializer(ProcessingParamsSerializer):
+    scale_factor = serializers.IntegerField(default=4, min_value=1, max_value=8)
+
+class ObjectRemovalParamsSerializer(ProcessingParamsSerializer):
+    x1 = serializers.IntegerField(default=0, min_value=0)
+    y1 = serializers.IntegerField(default=0, min_value=0)
+    x2 = serializers.IntegerField(default=0, min_value=0)
+    y2 = serializers.IntegerField(default=0, min_value=0)
+    
+    def validate(self, data):
+        if data['x1'] >= data['x2'] or data['y1'] >= data['y2']:
+            raise serializers.ValidationError(
+                "Invalid coordinates. x2 must be greater than x1 and y2 must be greater than y1."
+            )
+        return data
+
+class PipelineParamsSerializer(ProcessingParamsSerializer):
+    # JSON list of {"operation": <name or route>, ...parameters}, run in order
+    steps = serializers.JSONField()
+    # Also store the result of every step before the last
+    intermediates = serializers.BooleanField(default=False)
+
+class DerivativeParamsSerializer(serializers.Serializer):
+    width = serializers.IntegerField(min_value=1, max_value=4096, required=False)
+    height = serializers.IntegerField(min_value=1, max_value=4096, required=False)
+    fit = serializers.ChoiceField(choices=['contain', 'cover', 'fill'], default='contain')
+    output_format = serializers.ChoiceField(
+        choices=[name for name in ('webp', 'jpeg', 'png', 'avif') if name in OUTPUT_FORMATS],
+        default='webp'
+    )
+    output_quality = serializers.IntegerField(min_value=1, max_value=100, default=80)
+    source = serializers.ChoiceField(choices=['processed', 'original'], default='processed')
+    
+    def validate(self, data):
+        if data.get('width') is None and data.get('height') is None:
+            raise serializers.ValidationError("Give a width, a height or both.")
+        return data
+
+class ThumbnailParamsSerializer(serializers.Serializer):
+    thumbnail = serializers.IntegerField(min_value=16, max_value=1024, required=False)
+
 class ProcessedImageSerializer(serializers.ModelSerializer):
     original_image_url = serializers.SerializerMethodField()
     processed_image_url = serializers.SerializerMethodField()
@@ -25,14 +82,47 @@ class ProcessedImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProcessedImage
         fields = ['id', 'original_image_url', 'processed_image_url', 'processing_type', 
-                 'created_at', 'processing_time']
+                 'quality', 'created_at', 'processing_time', 'status', 'error', 'started_at',
+                 'finished_at']
     
     def get_original_image_url(self, obj):
         if obj.original_image:
-            return self.context['request'].build_absolute_uri(obj.original_image.url)
+            return self._absolute_url(obj.original_image.url)
         return None
     
     def get_processed_image_url(self, obj):
         if obj.processed_image:
-            return self.context['request'].build_absolute_uri(obj.processed_image.url)
-        return None 
\ No newline at end of file
+            return self._absolute_url(obj.processed_image.url)
+        return None
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        
+        # Listings can ask for thumbnails (?thumbnail=<size>) next to the full images
+        size = self.context.get('thumbnail_size')
+        if size:
+            data['thumbnail_url'] = None
+            if instance.processed_image:
+                path = reverse('processed_image_derivative', args=[instance.pk])
+                data['thumbnail_url'] = self._absolute_url(f'{path}?width={size}&height={size}')
+        
+        # Per-stage breakdown of the processing time, on request (?timings=true)
+        if self.context.get('include_timings'):
+            data['stage_timings'] = instance.stage_timings
+        return data
+    
+    def _absolute_url(self, url):
+        """
+        Absolute URL for a media file. The scheme and host are resolved once
+        per response (the context is shared by every row of a list) instead
+        of calling build_absolute_uri for each file.
+        """
+        if '://' in url:
+            return url
+        if not url.startswith('/'):
+            return self.context['request'].build_absolute_uri(url)
+        base_url = self.context.get('base_url')
+        if base_url is None:
+            base_url = self.context['request'].build_absolute_uri('/').rstrip('/')
+            self.context['base_url'] = base_url
+        return base_url + url 
\ No newline at end of file
@@ -0,0 +1,194 @@
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+from rembg import new_session
+
+from .metrics import metrics
+
+DEFAULT_MODEL = "u2net"
+
+# Models whose rembg predict() is a plain U2-Net forward pass on a 320x320
+# ImageNet-normalized input, which can be reimplemented over a stacked batch
+BATCHABLE_MODELS = {"u2net", "u2netp", "u2net_human_seg", "silueta"}
+U2NET_INPUT_SIZE = (320, 320)
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+
+
+class SessionRegistry:
+    """
+    Process-wide registry of rembg sessions.
+
+    Each session is loaded once per worker process and shared by every
+    request that asks for the same model and runtime options. onnxruntime
+    sessions are safe to run from several threads, so only loading needs
+    to be serialized.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._loaded_at = {}
+        self._load_times = {}
+        self._hits = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name=DEFAULT_MODEL, **options):
+        """Build a hashable registry key from a model name and runtime options"""
+        return (model_name, tuple(sorted((k, _freeze(v)) for k, v in options.items())))
+
+    def get(self, model_name=DEFAULT_MODEL, **options):
+        """Return the shared session for this model, loading it on first use"""
+        key = self.make_key(model_name, **options)
+
+        session = self._sessions.get(key)
+        if session is not None:
+            self._record_hit(key)
+            return session
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model; the others wait for it
+        with key_lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._record_hit(key)
+                return session
+
+            start_time = time.time()
+            session = new_session(model_name, **_session_kwargs(options))
+            with self._lock:
+                self._sessions[key] = session
+                self._loaded_at[key] = time.time()
+                self._load_times[key] = self._loaded_at[key] - start_time
+                self._hits[key] = 0
+            metrics.inc('image_api_model_session_loads_total', model=model_name)
+            return session
+
+    def warm(self, model_name=DEFAULT_MODEL, **options):
+        """Load a session ahead of the first request"""
+        self.get(model_name, **options)
+
+    def is_warm(self, model_name=DEFAULT_MODEL, **options):
+        """Whether a session is already loaded in this process"""
+        return self.make_key(model_name, **options) in self._sessions
+
+    def evict(self, model_name=DEFAULT_MODEL, **options):
+        """Drop a loaded session so its memory can be reclaimed"""
+        key = self.make_key(model_name, **options)
+        with self._lock:
+            self._loaded_at.pop(key, None)
+            self._load_times.pop(key, None)
+            self._hits.pop(key, None)
+            return self._sessions.pop(key, None) is not None
+
+    def status(self):
+        """Warm/cold status of every session known to this process"""
+        with self._lock:
+            return [
+                {
+                    'model_name': key[0],
+                    'options': dict(key[1]),
+                    'warm': True,
+                    'loaded_at': self._loaded_at[key],
+                    'load_time': self._load_times[key],
+                    'hits': self._hits[key],
+                }
+                for key in self._sessions
+            ]
+
+    def _record_hit(self, key):
+        with self._lock:
+            if key in self._hits:
+                self._hits[key] += 1
+        metrics.inc('image_api_model_session_hits_total', model=key[0])
+
+
+def _freeze(value):
+    """Make list/dict option values hashable"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _session_kwargs(options):
+    """Translate registry options into rembg ``new_session`` arguments"""
+    kwargs = dict(options)
+    if 'providers' in kwargs:
+        kwargs['providers'] = list(kwargs['providers'])
+    return kwargs
+
+
+registry = SessionRegistry()
+
+
+def get_session(model_name=None, **options):
+    """
+    Return the shared session for a model.
+
+    Without arguments the model and options configured in settings
+    (``REMBG_MODEL``, ``REMBG_SESSION_OPTIONS``) are used.
+    """
+    if model_name is None:
+        model_name, default_options = configured_model()
+        options = {**default_options, **options}
+    return registry.get(model_name, **options)
+
+
+def configured_model():
+    """Model name and session options from Django settings"""
+    from django.conf import settings
+
+    model_name = getattr(settings, 'REMBG_MODEL', DEFAULT_MODEL)
+    options = getattr(settings, 'REMBG_SESSION_OPTIONS', {})
+    return model_name, dict(options)
+
+
+def supports_batching(session):
+    """
+    Whether a session can run several images per inference call: the model
+    must be a U2-Net variant and its ONNX graph must not fix the batch size
+    """
+    if getattr(session, 'model_name', None) not in BATCHABLE_MODELS:
+        return False
+    inner_session = getattr(session, 'inner_session', None)
+    if inner_session is None:
+        return False
+    batch_dim = inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int)
+
+
+def predict_masks(session, images, batch_size=8):
+    """
+    Foreground mask for each PIL image.
+
+    Batchable sessions stack up to ``batch_size`` normalized inputs into one
+    onnxruntime call and post-process each prediction exactly as rembg's
+    U2-Net predict() does. Other sessions (or models with a fixed batch
+    dimension) fall back to one predict() call per image.
+    """
+    if not supports_batching(session):
+        return [session.predict(image)[0] for image in images]
+
+    input_name = session.inner_session.get_inputs()[0].name
+    masks = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        batch = np.concatenate([
+            session.normalize(image, U2NET_MEAN, U2NET_STD, U2NET_INPUT_SIZE)[input_name]
+            for image in chunk
+        ])
+        predictions = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+
+        for image, pred in zip(chunk, predictions):
+            # Normalized per image, as if it had been predicted on its own
+            pred = (pred - pred.min()) / (pred.max() - pred.min())
+            mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+            masks.append(mask.resize(image.size, Image.Resampling.LANCZOS))
+    return masks
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Q
+from django.utils import timezone
+
+HEX_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+# Files written or reused more recently than this are never deleted: an
+# identical upload may be about to save a row referencing them
+GRACE_SECONDS = getattr(settings, 'IMAGE_RETENTION', {}).get('GRACE_SECONDS', 3600)
+
+
+def shard_path(prefix, digest, ext):
+    """
+    Storage name for a file keyed by a hex digest, two directory levels
+    deep (prefix/ab/cd/abcd...ext), so no directory grows past 65536 entries
+    """
+    return f'{prefix}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def processed_name(output, ext):
+    """File name to save an encoded result under: its SHA-256 and extension"""
+    return hashlib.sha256(output).hexdigest() + ext
+
+
+class ContentAddressedMixin:
+    """
+    Storage mixin for content-addressed names: a name that already exists
+    holds the same bytes, so saving it again writes nothing and returns
+    the existing name instead of a renamed copy.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is not None and self.exists(name):
+            self.touch(name)
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def touch(self, name):
+        """
+        Mark an existing file as just used, where the backend supports it,
+        so garbage collection leaves it alone for its grace period
+        """
+
+
+class ShardedFileSystemStorage(ContentAddressedMixin, FileSystemStorage):
+    """
+    Local media storage for sharded content-addressed names. Concurrent
+    saves of the same name overwrite each other with identical bytes.
+    """
+
+    def __init__(self, *args, allow_overwrite=True, **kwargs):
+        super().__init__(*args, allow_overwrite=allow_overwrite, **kwargs)
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+
+
+try:
+    from storages.backends.s3 import S3Storage
+except ImportError:
+    # django-storages is only needed for the S3 backend
+    S3Storage = None
+
+if S3Storage is not None:
+    class ShardedS3Storage(ContentAddressedMixin, S3Storage):
+        """
+        S3-compatible media storage (AWS S3, MinIO, ...) for sharded
+        content-addressed names. Uploads are streamed from the uploaded
+        file object with multipart transfers.
+        """
+
+        def touch(self, name):
+            # Copying an object onto itself is the only way to update its
+            # LastModified; the metadata is carried over explicitly
+            obj = self.bucket.Object(self._normalize_name(name))
+            obj.copy_from(
+                CopySource={'Bucket': self.bucket_name, 'Key': obj.key},
+                MetadataDirective='REPLACE',
+                ContentType=obj.content_type,
+                Metadata=obj.metadata,
+            )
+else:
+    class ShardedS3Storage:
+        """Placeholder failing clearly when django-storages is not installed"""
+
+        def __init__(self, *args, **kwargs):
+            raise ImproperlyConfigured(
+                "IMAGE_STORAGE_BACKEND=s3 requires django-storages: "
+                "pip install 'django-storages[s3]'"
+            )
+
+
+def sharded_original_path(instance, filename):
+    """Upload path of an original image: the SHA-256 of its content"""
+    from .uploadhandlers import content_hash
+
+    ext = os.path.splitext(filename)[1].lower()
+    return shard_path('originals', content_hash(instance.original_image.file), ext)
+
+
+def sharded_processed_path(instance, filename):
+    """
+    Upload path of a processed image. Results are saved as
+    processed_name(output, ext); other names get a random key.
+    """
+    digest, ext = os.path.splitext(os.path.basename(filename))
+    if not HEX_DIGEST.match(digest):
+        digest = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    return shard_path('processed', digest, ext.lower())
+
+
+def recently_written(storage, name, grace_seconds=None):
+    """Whether a stored file was written or reused within the grace period"""
+    grace_seconds = GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    return storage.get_modified_time(name) > cutoff
+
+
+def delete_if_unreferenced(field_file):
+    """
+    Delete a stored file unless another row still references it (identical
+    content is stored once and shared) or it was written or reused within
+    GRACE_SECONDS, when a concurrent identical upload may not have saved
+    its row yet; cleanup_media deletes it later. Returns whether it was
+    deleted.
+    """
+    if not field_file:
+        return False
+    instance = field_file.instance
+    name = field_file.name
+    storage = field_file.storage
+    shared = type(instance)._default_manager.filter(
+        Q(original_image=name) | Q(processed_image=name)
+    ).exclude(pk=instance.pk).exists()
+    if shared or not storage.exists(name) or recently_written(storage, name):
+        return False
+    field_file.delete(save=False)
+    return True
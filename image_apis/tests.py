@@ -1,3 +1,1170 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+import zlib
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFile
+from rembg.sessions.u2net import U2netSession
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import compute, image_processing, transport, views
+from .cache import result_cache
+from .compute import compute_pool
+from .derivatives import derivative_cache
+from .encoders import OUTPUT_FORMATS, encode, negotiate, prefers_image
+from .storage import S3Storage, ShardedS3Storage, delete_if_unreferenced
+from .image_processing import (
+    UPSCALE_BYTES_PER_PIXEL, adaptive_sharpening, enhance_colors, enhance_colors_and_sharpen,
+    enhance_contrast, enhance_contrast_and_finish, enhance_final_quality, enhance_frame,
+    remove_object_frame, upscale_frame, upscale_frame_tiled
+)
+from .jobs import job_queue
+from .metrics import EXITED_FILE, Metrics
+from .models import ProcessedImage
+from .operations import ENHANCE_PARALLELISM, OPERATIONS, get_operation
+from .sessions import SessionRegistry, predict_masks, supports_batching
+from .timing import StageTimer
+from .validation import ImageInfo, check_limits
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    # The S3 storage tests run against moto's in-memory S3
+    mock_aws = None
+
+
+def make_image(width, height, seed=0):
+    """Smooth random BGR test image"""
+    img = np.random.RandomState(seed).randint(0, 256, (height, width, 3), np.uint8)
+    return cv2.GaussianBlur(img, (15, 15), 5)
+
+
+def make_upload(width=300, height=200, name='photo.jpg', seed=0):
+    ext = '.' + name.rsplit('.', 1)[1]
+    data = cv2.imencode(ext, make_image(width, height, seed))[1].tobytes()
+    content_type = 'image/png' if ext == '.png' else 'image/jpeg'
+    return SimpleUploadedFile(name, data, content_type=content_type)
+
+
+class MediaTestCase(TestCase):
+    """Test case writing uploaded and processed files to a temporary MEDIA_ROOT"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
+class UpscaleTests(TestCase):
+    def test_tiled_matches_whole_frame(self):
+        img = make_image(173, 131)
+        for quality in ('fast', 'balanced', 'best'):
+            for scale_factor in (2, 3):
+                whole = upscale_frame(img, scale_factor, quality=quality)
+                tiled = upscale_frame_tiled(img, scale_factor, tile_size=40, quality=quality)
+                self.assertTrue(np.array_equal(np.asarray(tiled), whole), (quality, scale_factor))
+
+    def test_memory_budget_switches_to_tiles(self):
+        img = make_image(200, 150)
+        budget = 400 * 300 * UPSCALE_BYTES_PER_PIXEL // 4
+        with mock.patch('image_apis.image_processing.upscale_frame_tiled',
+                        wraps=upscale_frame_tiled) as tiled:
+            bounded = upscale_frame(img, 2, memory_budget=budget)
+        tiled.assert_called_once()
+        # The output frame exceeds half the budget, so it is memory-mapped
+        self.assertIsInstance(bounded, np.memmap)
+        self.assertTrue(np.array_equal(np.asarray(bounded), upscale_frame(img, 2)))
+
+
+def reference_object_removal(img, x1, y1, x2, y2):
+    """
+    Object removal as it was before the region-only compositor: Telea, NS
+    and two-pass inpainting of the whole frame blended in float64, then
+    the (no-op) post-processing blend
+    """
+    mask = np.zeros(img.shape[:2], np.uint8)
+    mask[y1:y2, x1:x2] = 255
+    telea = cv2.inpaint(img, mask, 3, cv2.INPAINT_TELEA)
+    ns = cv2.inpaint(img, mask, 3, cv2.INPAINT_NS)
+    expanded = cv2.dilate(mask, np.ones((5, 5), np.uint8), iterations=1)
+    advanced = cv2.inpaint(cv2.inpaint(img, expanded, 5, cv2.INPAINT_TELEA), mask, 3, cv2.INPAINT_NS)
+
+    distance = cv2.distanceTransform(255 - mask, cv2.DIST_L2, 5)
+    weight = np.clip(distance / distance.max(), 0, 1)[:, :, np.newaxis]
+    blended = (telea * weight + ns * (1 - weight) * 0.5 + advanced * (1 - weight) * 0.5).astype(np.uint8)
+
+    alpha = (cv2.GaussianBlur(mask, (5, 5), 0) / 255.0)[:, :, np.newaxis]
+    return (blended * alpha + blended * (1 - alpha)).astype(np.uint8)
+
+
+class ObjectRemovalTests(TestCase):
+    def test_compositor_matches_old_blend(self):
+        # Boxes in the middle, at a corner and at the opposite edges
+        cases = [
+            ((300, 200), (40, 30, 120, 90)),
+            ((400, 300), (0, 0, 80, 60)),
+            ((320, 240), (200, 150, 320, 240)),
+        ]
+        for (width, height), box in cases:
+            img = make_image(width, height)
+            expected = reference_object_removal(img, *box).astype(np.int16)
+            result = remove_object_frame(img, *box, quality='best').astype(np.int16)
+            self.assertLessEqual(np.abs(result - expected).max(), 1, box)
+
+            # Inside the box the result is the exact mean of the two inpaintings
+            x1, y1, x2, y2 = box
+            self.assertTrue(np.array_equal(result[y1:y2, x1:x2], expected[y1:y2, x1:x2]), box)
+
+    def test_box_covering_the_frame(self):
+        img = make_image(300, 200)
+        with warnings.catch_warnings():
+            # The distance to the box is 0 everywhere: no division by zero
+            warnings.simplefilter('error')
+            result = remove_object_frame(img, 0, 0, 300, 200, quality='best')
+        self.assertEqual(result.shape, img.shape)
+
+
+class EnhancementTests(MediaTestCase):
+    def test_fused_stages_match_separate_stages(self):
+        sample = cv2.imread(str(settings.BASE_DIR / 'test_upscale.jpg'))
+        denoised = cv2.fastNlMeansDenoisingColored(make_image(800, 600), None, 10, 10, 7, 11)
+        for img in (sample, denoised):
+            separate = enhance_final_quality(enhance_contrast(
+                adaptive_sharpening(enhance_colors(img))
+            ))
+            fused = enhance_contrast_and_finish(enhance_colors_and_sharpen(img))
+            self.assertTrue(np.array_equal(fused, separate))
+
+    def test_parallel_matches_sequential(self):
+        # Full-size and doubled (small) frames, with and without denoising
+        cases = [
+            ((600, 560), 'fast', 128), ((400, 300), 'fast', 128),
+            ((600, 560), 'balanced', 100), ((300, 260), 'best', 64),
+        ]
+        for (width, height), quality, tile_size in cases:
+            img = make_image(width, height)
+            sequential = enhance_frame(img, workers=None, quality=quality)
+            for workers in (2, 4):
+                parallel = enhance_frame(img, workers=workers, tile_size=tile_size, quality=quality)
+                self.assertEqual(parallel.shape, sequential.shape)
+                self.assertTrue(np.array_equal(parallel, sequential), (width, height, quality, workers))
+
+    def test_parallel_records_stage_timings(self):
+        timer = StageTimer()
+        with timer.activate():
+            enhance_frame(make_image(600, 600), workers=4, tile_size=128, quality='fast')
+        self.assertEqual(set(timer.stages), {'local_stages', 'contrast', 'final_quality'})
+
+    def test_parallel_endpoint_stores_stage_timings(self):
+        with mock.patch.dict(ENHANCE_PARALLELISM, workers=4, tile_size=128):
+            response = self.client.post('/api/enhance/', {
+                'original_image': make_upload(600, 600), 'quality': 'fast',
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        timings = ProcessedImage.objects.get(pk=response.json()['id']).stage_timings
+        self.assertIn('local_stages', timings)
+        self.assertIn('storage_write', timings)
+
+    def test_auto_workers_share_the_cpus_of_a_compute_pool(self):
+        with mock.patch('os.cpu_count', return_value=8):
+            self.assertEqual(compute.cpu_share(), 8)
+            with mock.patch.object(compute, '_pool_workers', 8):
+                self.assertEqual(compute.cpu_share(), 1)
+            with mock.patch.object(compute, '_pool_workers', 2):
+                self.assertEqual(compute.cpu_share(), 4)
+                with mock.patch.object(image_processing, 'enhance_frame_parallel') as parallel:
+                    enhance_frame(make_image(600, 600), workers='auto', tile_size=128)
+                self.assertEqual(parallel.call_args.args[1], 4)
+
+
+class EncoderTests(MediaTestCase):
+    def test_negotiate_orders_by_q_then_position(self):
+        self.assertEqual(negotiate('image/png;q=0.5, image/jpeg;q=0.9').name, 'jpeg')
+        self.assertEqual(negotiate('image/png, image/jpeg').name, 'png')
+        self.assertEqual(negotiate('image/jpeg;q=0.8, image/png;q=0.8').name, 'jpeg')
+        self.assertEqual(negotiate('image/webp').name, 'webp')
+        self.assertEqual(negotiate('text/html, image/gif, image/png;q=0.1').name, 'png')
+
+    def test_negotiate_ignores_wildcards_and_refusals(self):
+        self.assertIsNone(negotiate('image/*'))
+        self.assertIsNone(negotiate('*/*'))
+        self.assertIsNone(negotiate('image/png;q=0, image/jpeg;q=bad'))
+        self.assertIsNone(negotiate(''))
+
+    def test_prefers_image(self):
+        self.assertTrue(prefers_image('image/*'))
+        self.assertTrue(prefers_image('image/webp, application/json'))
+        self.assertTrue(prefers_image('application/json;q=0.5, image/png'))
+        self.assertFalse(prefers_image('text/html,application/xhtml+xml,image/avif,image/webp,*/*;q=0.8'))
+        self.assertFalse(prefers_image('application/json, image/*'))
+        self.assertFalse(prefers_image('*/*'))
+        self.assertFalse(prefers_image(''))
+
+    def test_encode_round_trips(self):
+        img = make_image(64, 48)
+        for name, fmt in OUTPUT_FORMATS.items():
+            with self.subTest(output_format=name):
+                decoded = cv2.imdecode(np.frombuffer(encode(img, name, 90), np.uint8), cv2.IMREAD_UNCHANGED)
+                self.assertEqual(decoded.shape, img.shape)
+                if name in ('png', 'webp_lossless'):
+                    np.testing.assert_array_equal(decoded, img)
+                else:
+                    self.assertLess(np.abs(decoded.astype(int) - img).mean(), 8)
+
+    def test_encode_output_quality_and_alpha(self):
+        img = make_image(128, 96)
+        for name in ('jpeg', 'webp'):
+            self.assertLess(len(encode(img, name, 10)), len(encode(img, name, 95)))
+
+        bgra = np.dstack((img, np.zeros(img.shape[:2], np.uint8)))
+        jpeg = cv2.imdecode(np.frombuffer(encode(bgra, 'jpeg'), np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(jpeg.shape, img.shape)
+        self.assertGreater(jpeg.min(), 240)
+        webp = cv2.imdecode(np.frombuffer(encode(bgra, 'webp_lossless'), np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(webp.shape, bgra.shape)
+
+    def test_webp_upload_with_output_quality_is_lossy(self):
+        data = encode(make_image(300, 200), 'webp_lossless')
+        for params, chunk in (({}, b'VP8L'), ({'output_quality': 10}, b'VP8 ')):
+            with self.subTest(**params):
+                upload = SimpleUploadedFile('photo.webp', data, content_type='image/webp')
+                response = self.client.post('/api/upscale/', {'original_image': upload, 'quality': 'fast', **params})
+                self.assertEqual(response.status_code, 201, response.content)
+                processed_image = ProcessedImage.objects.get(pk=response.json()['id'])
+                with processed_image.processed_image.open('rb') as f:
+                    self.assertEqual(f.read()[12:16], chunk)
+
+
+def png_header(width, height):
+    """
+    PNG declaring width x height with a single, tiny IDAT chunk: a valid
+    header whose pixel data would fail to decode
+    """
+    def chunk(kind, data):
+        return len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big')
+
+    ihdr = width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes([8, 2, 0, 0, 0])
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr)
+            + chunk(b'IDAT', zlib.compress(b'\x00' * 16)) + chunk(b'IEND', b''))
+
+
+class ValidationTests(MediaTestCase):
+    def post(self, upload, url='/api/upscale/', **params):
+        return self.client.post(url, {'original_image': upload, 'quality': 'fast', **params})
+
+    def test_spoofed_extension_and_content_type(self):
+        gif = BytesIO()
+        Image.new('RGB', (32, 32)).save(gif, 'GIF')
+        for upload in (SimpleUploadedFile('photo.png', gif.getvalue(), content_type='image/png'),
+                       SimpleUploadedFile('photo.jpg', b'not an image', content_type='image/jpeg')):
+            with self.subTest(name=upload.name):
+                response = self.post(upload)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('original_image', response.json())
+        self.assertFalse(ProcessedImage.objects.exists())
+
+    def test_real_format_is_read_from_magic_bytes(self):
+        data = cv2.imencode('.png', make_image(32, 32))[1].tobytes()
+        response = self.post(SimpleUploadedFile('photo.jpg', data, content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_header_over_megapixel_limit_is_rejected_before_decoding(self):
+        upload = SimpleUploadedFile('huge.png', png_header(8000, 6000), content_type='image/png')
+        with mock.patch.object(ImageFile.ImageFile, 'load') as load, mock.patch('cv2.imdecode') as imdecode:
+            response = self.post(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Image too large: 8000x6000', response.json()['original_image'][0])
+        load.assert_not_called()
+        imdecode.assert_not_called()
+
+    def test_output_megapixels_checked_against_scale_factor(self):
+        upload = SimpleUploadedFile('large.png', png_header(3000, 2000), content_type='image/png')
+        response = self.post(upload, url='/api/upscale-advanced/', scale_factor=8)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Output too large', response.json()['original_image'][0])
+        self.assertIn('24000x16000', response.json()['original_image'][0])
+
+        operation = get_operation('upscale_advanced')
+        self.assertIsNone(check_limits(operation, ImageInfo('png', 4000, 2500), {'scale_factor': 4}))
+        self.assertIsNotNone(check_limits(operation, ImageInfo('png', 4000, 2501), {'scale_factor': 4}))
+        self.assertIsNone(check_limits(operation, ImageInfo('png', 6000, 6000), {'scale_factor': 2}))
+
+
+def failing_operation(image_data, **kwargs):
+    """Processing function for pool tests; runs in a worker process"""
+    raise ValueError('Could not decode image')
+
+
+class AsyncViewTests(MediaTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Workers need no models for upscaling
+        cls.pool_options = mock.patch.dict(compute_pool.options, PRELOAD_MODELS=[], WORKERS=1)
+        cls.pool_options.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        compute_pool.shutdown()
+        cls.pool_options.stop()
+        super().tearDownClass()
+
+    def test_post_without_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post('/api/async/upscale/', {
+            'original_image': make_upload(), 'quality': 'fast', 'return': 'binary',
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_sync_and_async_views_agree_on_binary_responses(self):
+        browser = 'text/html,application/xhtml+xml,image/avif,image/webp,*/*;q=0.8'
+        for accept, content_type in ((browser, None), ('image/*', 'image/jpeg'), ('image/webp', 'image/webp')):
+            for url in ('/api/upscale/', '/api/async/upscale/'):
+                with self.subTest(accept=accept, url=url):
+                    response = self.client.post(url, {
+                        'original_image': make_upload(), 'quality': 'fast',
+                    }, HTTP_ACCEPT=accept)
+                    self.assertIn(response.status_code, (200, 201), response.content)
+                    if content_type is None:
+                        # JSON, or the browsable API's rendering of it
+                        self.assertFalse(response['Content-Type'].startswith('image/'))
+                    else:
+                        self.assertEqual(response['Content-Type'], content_type)
+
+    def segments(self):
+        """Shared memory segments created by this process"""
+        prefix = f'{transport.SEGMENT_PREFIX}{os.getpid()}_'
+        return [name for name in os.listdir(transport.SHM_DIR) if name.startswith(prefix)]
+
+    def test_large_upload_and_result_pass_through_shared_memory(self):
+        upload = make_upload()
+        with mock.patch.dict(compute_pool.options, SHARED_MEMORY_MIN_BYTES=1024), \
+                mock.patch.object(transport, 'write', wraps=transport.write) as write, \
+                mock.patch.object(transport, 'read', wraps=transport.read) as read:
+            response = self.client.post('/api/async/upscale-advanced/', {
+                'original_image': upload, 'quality': 'fast', 'scale_factor': 2,
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        # The upload was shared by this process, the result by the worker
+        self.assertEqual(write.call_args.args[1], upload.file.getvalue())
+        self.assertEqual(read.call_args.args[0].nbytes, ProcessedImage.objects.get().processed_size)
+        self.assertEqual(self.segments(), [])
+
+    def test_small_upload_with_large_result(self):
+        with mock.patch.dict(compute_pool.options, SHARED_MEMORY_MIN_BYTES=64 * 1024), \
+                mock.patch.object(transport, 'write', wraps=transport.write) as write, \
+                mock.patch.object(transport, 'read', wraps=transport.read) as read:
+            response = self.client.post('/api/async/upscale-advanced/', {
+                'original_image': make_upload(name='photo.png'), 'quality': 'fast', 'scale_factor': 4,
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        write.assert_not_called()
+        self.assertGreaterEqual(read.call_args.args[0].nbytes, 64 * 1024)
+        self.assertEqual(self.segments(), [])
+
+    def test_segments_are_unlinked_when_the_worker_raises(self):
+        with mock.patch.dict(compute_pool.options, SHARED_MEMORY_MIN_BYTES=1024):
+            with self.assertRaisesMessage(ValueError, 'Could not decode image'):
+                async_to_sync(compute_pool.process)(failing_operation, bytes(4096))
+        self.assertEqual(self.segments(), [])
+
+    def test_cleanup_stale_removes_segments_of_dead_processes(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        dead = transport.write(f'{transport.SEGMENT_PREFIX}{process.pid}_0123456789abcdef', b'stale')
+        live = transport.write(transport.segment_name(), b'live')
+        try:
+            self.assertGreaterEqual(transport.cleanup_stale(), 1)
+            self.assertNotIn(dead.name, os.listdir(transport.SHM_DIR))
+            self.assertEqual(self.segments(), [live.name])
+        finally:
+            transport.unlink(live.name)
+
+
+class JobQueueTests(MediaTestCase):
+    """
+    Async submissions, polled on the processed image endpoint. Jobs are
+    collected instead of being run on the queue's threads, then run here
+    in the test's transaction.
+    """
+
+    def setUp(self):
+        self.jobs = []
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda fn, *args: self.jobs.append((fn, args))
+        for patcher in (mock.patch.object(job_queue, '_executor', executor),
+                        mock.patch('image_apis.jobs.close_old_connections')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self):
+        return self.client.post('/api/upscale/?async=true', {
+            'original_image': make_upload(), 'quality': 'fast',
+        })
+
+    def run_jobs(self):
+        while self.jobs:
+            fn, args = self.jobs.pop(0)
+            fn(*args)
+
+    def test_submit_and_poll(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(job_queue.pending, 1)
+
+        location = response['Location']
+        self.assertTrue(location.endswith(f"/api/processed-images/{response.json()['id']}/"))
+        self.assertEqual(self.client.get(location).json()['status'], 'pending')
+
+        self.run_jobs()
+        self.assertEqual(job_queue.pending, 0)
+        data = self.client.get(location).json()
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual(data['error'], '')
+        self.assertIsNotNone(data['processed_image_url'])
+        self.assertIsNotNone(data['finished_at'])
+
+    def test_failed_job_records_the_error(self):
+        operation = get_operation('upscale')
+        with mock.patch.object(operation, 'func', side_effect=ValueError('Could not decode image')):
+            response = self.submit()
+        self.assertEqual(response.status_code, 202, response.content)
+        self.run_jobs()
+
+        data = self.client.get(response['Location']).json()
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(data['error'], 'Could not decode image')
+        self.assertIsNone(data['processed_image_url'])
+
+    def test_full_queue_returns_503(self):
+        with mock.patch.object(job_queue, '_slots', threading.BoundedSemaphore(1)):
+            job_queue._slots.acquire()
+            response = self.submit()
+        self.assertEqual(response.status_code, 503, response.content)
+        self.assertEqual(response.json()['error'], 'Processing queue is full, please retry later.')
+        self.assertFalse(ProcessedImage.objects.exists())
+        self.assertEqual(job_queue.pending, 0)
+
+        # The cache key was released: the retry is queued, not served the dropped row
+        response = self.submit()
+        self.assertEqual(response.status_code, 202, response.content)
+        self.run_jobs()
+
+
+class ResultCacheTests(MediaTestCase):
+    def post_upscale(self):
+        return self.client.post('/api/upscale/', {
+            'original_image': make_upload(seed=1), 'quality': 'fast',
+        })
+
+    def test_identical_request_is_a_hit(self):
+        first = self.post_upscale()
+        self.assertEqual(first.status_code, 201)
+        second = self.post_upscale()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json()['id'], first.json()['id'])
+
+    def test_hits_record_access_once_per_evict_interval(self):
+        first = self.post_upscale().json()
+        self.post_upscale()
+        row = ProcessedImage.objects.get(pk=first['id'])
+        accessed = row.last_accessed_at
+        self.assertIsNotNone(accessed)
+
+        # A hit within the interval is a read only
+        with self.assertNumQueries(1):
+            self.assertEqual(result_cache.lookup(row.cache_key).pk, first['id'])
+        self.assertEqual(ProcessedImage.objects.get(pk=first['id']).last_accessed_at, accessed)
+
+        with mock.patch.dict(result_cache.options, EVICT_INTERVAL=0):
+            self.post_upscale()
+        self.assertGreater(ProcessedImage.objects.get(pk=first['id']).last_accessed_at, accessed)
+
+    def test_abandoned_row_is_recomputed(self):
+        first = self.post_upscale().json()
+        # A worker died mid-job long ago, leaving the row in flight
+        long_ago = timezone.now() - timedelta(seconds=result_cache.options['WAIT_TIMEOUT'] + 60)
+        ProcessedImage.objects.filter(pk=first['id']).update(
+            status='processing', created_at=long_ago, started_at=long_ago
+        )
+        response = self.post_upscale()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['id'], first['id'])
+
+    def test_row_in_flight_in_this_process_is_not_stale(self):
+        first = self.post_upscale().json()
+        processed_image = ProcessedImage.objects.get(pk=first['id'])
+        long_ago = timezone.now() - timedelta(seconds=result_cache.options['WAIT_TIMEOUT'] + 60)
+        ProcessedImage.objects.filter(pk=first['id']).update(
+            status='processing', created_at=long_ago, started_at=long_ago
+        )
+        result_cache.register(processed_image)
+        try:
+            self.assertEqual(result_cache.lookup(processed_image.cache_key).pk, first['id'])
+        finally:
+            result_cache.finished(processed_image)
+        self.assertIsNone(result_cache.lookup(processed_image.cache_key))
+
+    def test_claim_defers_to_an_earlier_row(self):
+        upload = make_upload(seed=2)
+        key = result_cache.make_key(upload, 'upscale_advanced', {})
+        # Claimed by a request in another worker process, still running
+        rival = ProcessedImage.objects.create(
+            original_image='originals/rival.jpg', processing_type='upscale_advanced',
+            cache_key=key, status='processing', started_at=timezone.now(),
+        )
+        processed_image, created = result_cache.claim(
+            key, original_image=upload, processing_type='upscale_advanced', quality='fast'
+        )
+        self.assertFalse(created)
+        self.assertEqual(processed_image.pk, rival.pk)
+        self.assertEqual(ProcessedImage.objects.filter(cache_key=key).count(), 1)
+
+    def test_inline_request_claims_its_key_before_processing(self):
+        seen = []
+
+        def upscale(img, *args, **kwargs):
+            # What an identical request in another process would find
+            seen.extend(ProcessedImage.objects.values_list('status', 'cache_key'))
+            return img
+
+        with mock.patch('image_apis.image_processing.upscale_frame', side_effect=upscale):
+            response = self.client.post('/api/upscale-advanced/', {
+                'original_image': make_upload(seed=3), 'quality': 'fast', 'scale_factor': 2,
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        [(status, cache_key)] = seen
+        self.assertEqual(status, 'processing')
+        self.assertEqual(ProcessedImage.objects.get(pk=response.json()['id']).cache_key, cache_key)
+
+    def test_eviction_deletes_processed_file(self):
+        first = self.post_upscale().json()
+        processed_image = ProcessedImage.objects.get(pk=first['id'])
+        path = processed_image.processed_image.path
+        original_path = processed_image.original_image.path
+
+        # Just written: kept in the cache until its grace period is over
+        with mock.patch.dict(result_cache.options, MAX_BYTES=0):
+            self.assertEqual(result_cache.evict(), 0)
+            os.utime(path, (0, 0))
+            self.assertEqual(result_cache.evict(), 1)
+
+        processed_image.refresh_from_db()
+        self.assertIsNone(processed_image.cache_key)
+        self.assertFalse(processed_image.processed_image)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(original_path))
+        response = self.client.get(f"/api/processed-images/{first['id']}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['processed_image_url'])
+        # No longer reused
+        self.assertEqual(self.post_upscale().status_code, 201)
+
+    def test_eviction_keeps_files_shared_with_other_rows(self):
+        first = self.post_upscale().json()
+        processed_image = ProcessedImage.objects.get(pk=first['id'])
+        os.utime(processed_image.processed_image.path, (0, 0))
+        # An uncached row with the same result
+        ProcessedImage.objects.create(
+            original_image=processed_image.original_image.name,
+            processed_image=processed_image.processed_image.name,
+            processing_type='upscale_advanced', status='completed',
+        )
+        with mock.patch.dict(result_cache.options, MAX_BYTES=0):
+            self.assertEqual(result_cache.evict(), 1)
+        self.assertTrue(os.path.exists(processed_image.processed_image.path))
+
+
+class DerivativeTests(MediaTestCase):
+    def setUp(self):
+        response = self.client.post('/api/upscale-advanced/', {
+            'original_image': make_upload(300, 200), 'quality': 'fast', 'scale_factor': 2,
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        self.url = f"/api/processed-images/{response.json()['id']}/derivative/"
+
+    def get_image(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, getattr(response, 'content', b''))
+        image = Image.open(BytesIO(b''.join(response.streaming_content)))
+        return response, image
+
+    def test_miss_then_hit(self):
+        first, image = self.get_image(width=100, output_format='png')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(first['Content-Type'], 'image/png')
+        second, cached = self.get_image(width=100, output_format='png')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        np.testing.assert_array_equal(np.asarray(image), np.asarray(cached))
+        # Other parameters are another derivative
+        self.assertEqual(self.get_image(width=101, output_format='png')[0]['X-Cache'], 'MISS')
+
+    def test_fit_modes(self):
+        # The processed image is 600x400
+        for fit, size in (('contain', (150, 100)), ('cover', (150, 150)), ('fill', (150, 150))):
+            with self.subTest(fit=fit):
+                self.assertEqual(self.get_image(width=150, height=150, fit=fit)[1].size, size)
+        self.assertEqual(self.get_image(height=50)[1].size, (75, 50))
+        # Never upscaled, except by fill
+        self.assertEqual(self.get_image(width=1000, height=1000)[1].size, (600, 400))
+        self.assertEqual(self.get_image(width=1000, height=1000, fit='fill')[1].size, (1000, 1000))
+
+    def test_source_original(self):
+        self.assertEqual(self.get_image(width=1000, source='original')[1].size, (300, 200))
+        self.assertEqual(self.get_image(width=1000)[1].size, (600, 400))
+
+    def test_evicted_while_served(self):
+        # Every write evicts every derivative, including the one being served
+        with mock.patch.dict(derivative_cache.options, MAX_BYTES=0, EVICT_INTERVAL=0):
+            for _ in range(2):
+                response, image = self.get_image(width=100)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual(image.size, (100, 67))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.metrics = Metrics({'DIR': self.directory, 'FLUSH_INTERVAL': 3600})
+
+    def dead_pid(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        return process.pid
+
+    def write_snapshot(self, pid, requests, in_flight=1, token='other'):
+        samples = [
+            ['image_api_requests_total', {'code': '201'}, requests],
+            ['image_api_requests_in_flight', {'mode': 'single'}, in_flight],
+            ['image_api_request_duration_seconds', {}, [requests] + [0] * 10 + [0.01 * requests]],
+            ['image_api_process_resident_memory_bytes', {}, 1000],
+        ]
+        with open(os.path.join(self.directory, f'{pid}.json'), 'w') as f:
+            json.dump({'pid': pid, 'token': token, 'samples': samples}, f)
+
+    def sample(self, text, line):
+        return [row.rsplit(' ', 1)[1] for row in text.splitlines() if row.startswith(line + ' ')]
+
+    def test_render_sums_counters_and_drops_dead_gauges(self):
+        self.metrics.inc('image_api_requests_total', code='201')
+        self.metrics.inc('image_api_requests_in_flight', mode='single')
+        self.write_snapshot(os.getppid(), 2)
+        self.write_snapshot(self.dead_pid(), 4)
+
+        text = self.metrics.render()
+        self.assertEqual(self.sample(text, 'image_api_requests_total{code="201"}'), ['7'])
+        self.assertEqual(self.sample(text, 'image_api_requests_in_flight{mode="single"}'), ['2'])
+        self.assertEqual(self.sample(text, 'image_api_request_duration_seconds_count'), ['6'])
+        self.assertEqual(self.sample(text, f'image_api_process_resident_memory_bytes{{pid="{os.getppid()}"}}'),
+                         ['1000'])
+        # Only the live process's memory; this instance has no collector of its own
+        self.assertEqual(text.count('image_api_process_resident_memory_bytes{'), 1)
+
+    def test_exited_processes_are_folded(self):
+        for requests in (3, 4):
+            self.write_snapshot(self.dead_pid(), requests)
+            text = self.metrics.render()
+            self.assertEqual(sorted(os.listdir(self.directory)), sorted([EXITED_FILE, f'{os.getpid()}.json', '.lock']))
+        for _ in range(2):
+            text = self.metrics.render()
+            self.assertEqual(self.sample(text, 'image_api_requests_total{code="201"}'), ['7'])
+            self.assertEqual(self.sample(text, 'image_api_request_duration_seconds_count'), ['7'])
+
+    def test_reused_pid_keeps_the_exited_process_counters(self):
+        self.write_snapshot(os.getpid(), 5)
+        self.metrics.inc('image_api_requests_total', code='201')
+        text = self.metrics.render()
+        self.assertEqual(self.sample(text, 'image_api_requests_total{code="201"}'), ['6'])
+        self.assertEqual(self.sample(text, 'image_api_requests_in_flight{mode="single"}'), [])
+        self.metrics.flush()
+        text = self.metrics.render()
+        self.assertEqual(self.sample(text, 'image_api_requests_total{code="201"}'), ['6'])
+
+
+class OperationRoutingTests(MediaTestCase):
+    def test_every_operation_is_routed(self):
+        for operation in OPERATIONS.values():
+            for prefix, suffix in (('', ''), ('batch/', '_batch'), ('async/', '_async')):
+                with self.subTest(operation=operation.name, variant=suffix):
+                    url = reverse(operation.url_name + suffix)
+                    self.assertEqual(url, f'/api/{prefix}{operation.route}/')
+                    self.assertEqual(resolve(url).kwargs, {'operation': operation.name})
+
+    def test_every_operation_rejects_invalid_params(self):
+        for operation in OPERATIONS.values():
+            invalid = [{'quality': 'bogus'}, {'output_format': 'gif'}, {'output_quality': 0}]
+            if 'scale_factor' in operation.params().fields:
+                invalid.append({'scale_factor': 9})
+            for url in (reverse(operation.url_name), reverse(operation.url_name + '_async')):
+                for params in invalid:
+                    with self.subTest(url=url, **params):
+                        response = self.client.post(url, {'original_image': make_upload(), **params})
+                        self.assertEqual(response.status_code, 400, response.content)
+                        self.assertEqual(list(response.json()), list(params))
+        self.assertFalse(ProcessedImage.objects.exists())
+
+
+class QualityTierTests(MediaTestCase):
+    def test_every_operation_accepts_every_tier(self):
+        params = {'x1': 20, 'y1': 20, 'x2': 50, 'y2': 40}
+        for operation in OPERATIONS.values():
+            for quality in ('fast', 'balanced', 'best'):
+                with self.subTest(operation=operation.name, quality=quality), \
+                        mock.patch('image_apis.image_processing.get_session', return_value=StubSession()), \
+                        mock.patch.object(operation, 'func', wraps=operation.func) as func:
+                    response = self.client.post(reverse(operation.url_name), {
+                        'original_image': make_upload(96, 64), 'quality': quality, **params,
+                    })
+                    self.assertEqual(response.status_code, 201, response.content)
+                    self.assertEqual(response.json()['quality'], quality)
+                    self.assertEqual(ProcessedImage.objects.get(pk=response.json()['id']).quality, quality)
+                    self.assertEqual(func.call_args.kwargs['quality'], quality)
+
+
+class ListingTests(MediaTestCase):
+    def setUp(self):
+        # Three rows share a timestamp, so pages split ties by id
+        base = timezone.make_aware(datetime(2024, 3, 1, 12))
+        days = [0, 1, 1, 1, 2, 3, 4]
+        for index, day in enumerate(days):
+            row = ProcessedImage.objects.create(
+                original_image=f'originals/{index}.jpg',
+                processing_type='upscale' if index % 2 else 'enhancement',
+                status='completed',
+            )
+            ProcessedImage.objects.filter(pk=row.pk).update(created_at=base + timedelta(days=day))
+        self.expected = list(ProcessedImage.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def ids(self, data):
+        return [item['id'] for item in data['results']]
+
+    def test_cursor_pages_are_newest_first_without_gaps(self):
+        url, pages = '/api/processed-images/?page_size=2', []
+        while url:
+            data = self.client.get(url).json()
+            pages.append(self.ids(data))
+            url = data['next']
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        # Going back from the last page returns the one before it
+        self.assertEqual(self.ids(self.client.get(data['previous']).json()), pages[-2])
+
+    def test_filters(self):
+        rows = ProcessedImage.objects.all()
+        data = self.client.get('/api/processed-images/?processing_type=upscale').json()
+        self.assertEqual(self.ids(data), [pk for pk in self.expected if rows.get(pk=pk).processing_type == 'upscale'])
+
+        data = self.client.get('/api/processed-images/?created_after=2024-03-02').json()
+        self.assertEqual(self.ids(data), self.expected[:-1])
+        data = self.client.get('/api/processed-images/', {
+            'created_after': '2024-03-02T12:00:00Z', 'created_before': '2024-03-04',
+            'processing_type': 'upscale',
+        }).json()
+        self.assertEqual(self.ids(data), [
+            pk for pk in self.expected[2:6] if rows.get(pk=pk).processing_type == 'upscale'
+        ])
+
+        response = self.client.get('/api/processed-images/?created_after=yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('created_after', response.json())
+
+
+class BinaryResponseTests(MediaTestCase):
+    def post(self, url, upload, accept='image/*', **params):
+        with mock.patch('image_apis.image_processing.get_session', return_value=StubSession()):
+            return self.client.post(url, {'original_image': upload, 'quality': 'fast', **params},
+                                    HTTP_ACCEPT=accept)
+
+    def decode(self, response):
+        return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def test_accept_image_returns_raw_bytes(self):
+        cases = [
+            ('/api/upscale/', 'photo.jpg', 'image/jpeg', (400, 600, 3)),
+            ('/api/upscale/', 'photo.png', 'image/png', (400, 600, 3)),
+            ('/api/remove-background/', 'photo.jpg', 'image/png', (200, 300, 4)),
+        ]
+        for url, name, content_type, shape in cases:
+            with self.subTest(url=url, name=name):
+                response = self.post(url, make_upload(name=name))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], content_type)
+                self.assertIn('Accept', response['Vary'])
+                self.assertIn('X-Processing-Time', response)
+                self.assertEqual(self.decode(response).shape, shape)
+        self.assertFalse(ProcessedImage.objects.exists())
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_specific_image_type_selects_the_format(self):
+        response = self.post('/api/upscale/', make_upload(), accept='image/png;q=0.5, image/webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response.content[8:12], b'WEBP')
+
+    def test_errors_are_still_json(self):
+        response = self.post('/api/upscale/', make_upload(), quality='bogus')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('quality', response.json())
+
+
+class PipelineTests(MediaTestCase):
+    steps = [
+        {'operation': 'remove-object-advanced', 'x1': 10, 'y1': 10, 'x2': 60, 'y2': 60},
+        {'operation': 'upscale_advanced', 'scale_factor': 2},
+    ]
+
+    def test_intermediates_keep_their_operation(self):
+        response = self.client.post('/api/pipeline/', {
+            'original_image': make_upload(), 'quality': 'fast',
+            'steps': json.dumps(self.steps), 'intermediates': 'true',
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()
+        self.assertEqual(data['processing_type'], 'pipeline')
+        self.assertEqual([item['operation'] for item in data['intermediates']], ['object_removal_advanced'])
+        self.assertEqual(data['intermediates'][0]['processing_type'], 'object_removal_advanced')
+
+        listing = self.client.get('/api/processed-images/?processing_type=pipeline').json()
+        self.assertEqual([item['id'] for item in listing['results']], [data['id']])
+
+
+class StorageTests(MediaTestCase):
+    def test_identical_uploads_share_the_original(self):
+        first = self.client.post('/api/upscale/', {'original_image': make_upload(), 'quality': 'fast'})
+        second = self.client.post('/api/enhance/', {'original_image': make_upload(name='other.JPG'), 'quality': 'fast'})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(first.json()['original_image_url'], second.json()['original_image_url'])
+        self.assertIn('/media/originals/', first.json()['original_image_url'])
+
+    def test_delete_if_unreferenced_honours_grace_period(self):
+        response = self.client.post('/api/upscale/', {'original_image': make_upload(), 'quality': 'fast'})
+        processed_image = ProcessedImage.objects.get(pk=response.json()['id'])
+        field_file = processed_image.processed_image
+        path = field_file.path
+
+        # Just written: an identical upload may be about to reference it
+        self.assertFalse(delete_if_unreferenced(field_file))
+        self.assertTrue(os.path.exists(path))
+
+        os.utime(path, (0, 0))
+        self.assertTrue(delete_if_unreferenced(field_file))
+        self.assertFalse(os.path.exists(path))
+
+
+class CleanupMediaTests(MediaTestCase):
+    def make_row(self, seed, days_ago=0, route='upscale'):
+        response = self.client.post(f'/api/{route}/', {'original_image': make_upload(seed=seed), 'quality': 'fast'})
+        self.assertEqual(response.status_code, 201, response.content)
+        ProcessedImage.objects.filter(pk=response.json()['id']).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return ProcessedImage.objects.get(pk=response.json()['id'])
+
+    def cleanup(self, *args):
+        out = StringIO()
+        call_command('cleanup_media', '--grace-seconds', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def stored_files(self):
+        return {
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, files in os.walk(self.media_root) for name in files
+        }
+
+    def test_dry_run_reports_what_a_run_deletes(self):
+        for seed in (1, 2):
+            self.make_row(seed, days_ago=10)
+        recent = self.make_row(3)
+        files = self.stored_files()
+
+        report = self.cleanup('--max-age-days', '5', '--dry-run')
+        self.assertIn('Would delete 2 rows and 4 files', report)
+        self.assertEqual(self.stored_files(), files)
+        self.assertEqual(ProcessedImage.objects.count(), 3)
+
+        self.assertEqual(
+            self.cleanup('--max-age-days', '5'),
+            report.replace('Would delete', 'Deleted').replace('would reclaim', 'reclaimed')
+        )
+        self.assertEqual(list(ProcessedImage.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(self.stored_files(), {recent.original_image.name, recent.processed_image.name})
+
+    def test_shared_original_survives_while_referenced(self):
+        old = self.make_row(1, days_ago=10)
+        recent = self.make_row(1, route='enhance')
+        self.assertEqual(old.original_image.name, recent.original_image.name)
+
+        self.cleanup('--max-age-days', '5')
+        self.assertFalse(ProcessedImage.objects.filter(pk=old.pk).exists())
+        self.assertNotIn(old.processed_image.name, self.stored_files())
+        self.assertIn(recent.original_image.name, self.stored_files())
+
+    def test_queued_rows_are_kept_whatever_their_age(self):
+        row = self.make_row(1, days_ago=10)
+        ProcessedImage.objects.filter(pk=row.pk).update(status='pending')
+        self.cleanup('--max-age-days', '5', '--max-bytes', '0')
+        self.assertTrue(ProcessedImage.objects.filter(pk=row.pk).exists())
+        self.assertIn(row.original_image.name, self.stored_files())
+
+    def test_orphaned_files_are_swept(self):
+        row = self.make_row(1)
+        default_storage.save('processed/00/00/orphan.png', ContentFile(b'orphan'))
+        default_storage.save('original_images/tmp_upload.jpg', ContentFile(b'temp'))
+        default_storage.save('unrelated/keep.txt', ContentFile(b'keep'))
+
+        report = self.cleanup()
+        self.assertIn('(2 orphaned, 10 B)', report)
+        self.assertEqual(self.stored_files(), {
+            row.original_image.name, row.processed_image.name, 'unrelated/keep.txt',
+        })
+
+    def test_max_bytes_deletes_oldest_first(self):
+        rows = [self.make_row(seed, days_ago=days) for seed, days in ((1, 1), (2, 3), (3, 2))]
+        ProcessedImage.objects.update(original_size=100, processed_size=100)
+
+        self.cleanup('--max-bytes', '300', '--skip-orphans')
+        # 600 bytes: the two oldest go, the newest stays
+        self.assertEqual(list(ProcessedImage.objects.values_list('pk', flat=True)), [rows[0].pk])
+
+
+@skipUnless(S3Storage is not None and mock_aws is not None, 'django-storages and moto are not installed')
+class S3StorageTests(MediaTestCase):
+    s3_settings = {
+        'STORAGES': {
+            'default': {'BACKEND': 'image_apis.storage.ShardedS3Storage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        },
+        'AWS_STORAGE_BUCKET_NAME': 'image-api',
+        'AWS_S3_REGION_NAME': 'us-east-1',
+        'AWS_QUERYSTRING_AUTH': False,
+    }
+
+    def setUp(self):
+        credentials = mock.patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+        })
+        credentials.start()
+        self.addCleanup(credentials.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='image-api')
+        self.bucket = boto3.resource('s3', region_name='us-east-1').Bucket('image-api')
+
+    def test_results_are_stored_once_under_sharded_names(self):
+        with override_settings(**self.s3_settings):
+            first = self.client.post('/api/upscale/', {'original_image': make_upload(), 'quality': 'fast'})
+            second = self.client.post('/api/enhance/', {'original_image': make_upload(), 'quality': 'fast'})
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual(second.status_code, 201, second.content)
+
+        keys = sorted(obj.key for obj in self.bucket.objects.all())
+        self.assertEqual(len([key for key in keys if key.startswith('originals/')]), 1)
+        self.assertEqual(len([key for key in keys if key.startswith('processed/')]), 2)
+        self.assertIn('image-api', first.json()['original_image_url'])
+
+    def test_dedupe_hit_refreshes_modified_time(self):
+        with override_settings(**self.s3_settings):
+            storage = ShardedS3Storage()
+            name = storage.save('originals/ab/cd/abcd.jpg', ContentFile(b'jpeg bytes'))
+            before = storage.get_modified_time(name)
+            time.sleep(1.1)
+            self.assertEqual(storage.save(name, ContentFile(b'jpeg bytes')), name)
+            self.assertGreater(storage.get_modified_time(name), before)
+            self.assertEqual(storage.open(name).read(), b'jpeg bytes')
+
+
+class SessionRegistryTests(TestCase):
+    def test_concurrent_get_loads_each_session_once(self):
+        registry = SessionRegistry()
+        keys = [('u2net', {}), ('u2netp', {}), ('u2net', {'providers': ['CPUExecutionProvider']})]
+        barrier = threading.Barrier(len(keys) * 8)
+        results = {}
+
+        def slow_new_session(model_name, **kwargs):
+            # Long enough for every other thread to reach the registry
+            time.sleep(0.05)
+            return object()
+
+        def get(index, model_name, options):
+            barrier.wait()
+            results[index] = registry.get(model_name, **options)
+
+        with mock.patch('image_apis.sessions.new_session', side_effect=slow_new_session) as new_session:
+            threads = [
+                threading.Thread(target=get, args=(index, *keys[index % len(keys)]))
+                for index in range(barrier.parties)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(new_session.call_count, len(keys))
+        for offset in range(len(keys)):
+            sessions = {id(results[index]) for index in range(offset, barrier.parties, len(keys))}
+            self.assertEqual(len(sessions), 1)
+        self.assertEqual(len({id(session) for session in results.values()}), len(keys))
+        self.assertEqual(sum(entry['hits'] for entry in registry.status()), barrier.parties - len(keys))
+
+
+class StubSession:
+    """Background removal session keeping a centred square of every image"""
+
+    model_name = 'stub'
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def predict(self, image):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError('inference failed')
+        mask = Image.new('L', image.size, 0)
+        width, height = image.size
+        mask.paste(255, (width // 4, height // 4, width * 3 // 4, height * 3 // 4))
+        return [mask]
+
+
+class FakeInferenceSession:
+    """
+    onnxruntime session standing in for a U2-Net graph with a dynamic batch
+    dimension; every image's prediction depends on that image alone
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input.1', shape=['batch_size', 3, 320, 320])]
+
+    def run(self, output_names, inputs):
+        [batch] = inputs.values()
+        self.batch_sizes.append(len(batch))
+        return [np.tanh(batch[:, :1] * batch[:, 1:2] - batch[:, 2:])]
+
+
+def make_u2net_session():
+    """rembg's U2-Net session running on FakeInferenceSession"""
+    session = U2netSession.__new__(U2netSession)
+    session.model_name = 'u2netp'
+    session.inner_session = FakeInferenceSession()
+    return session
+
+
+class BatchTests(MediaTestCase):
+    url = '/api/batch/remove-background/'
+
+    def post_batch(self, images, session=None):
+        session = session or StubSession()
+        with mock.patch('image_apis.image_processing.get_session', return_value=session):
+            return self.client.post(self.url, {'images': images, 'quality': 'fast'})
+
+    def invalid_upload(self):
+        return SimpleUploadedFile('notes.jpg', b'not an image', content_type='image/jpeg')
+
+    def test_all_succeed(self):
+        session = StubSession()
+        response = self.post_batch([make_upload(seed=2), make_upload(name='b.png', seed=3)], session)
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()
+        self.assertEqual((data['status'], data['succeeded'], data['failed']), ('completed', 2, 0))
+        self.assertEqual(session.calls, 2)
+        for result in data['results']:
+            processed_image = ProcessedImage.objects.get(pk=result['result']['id'])
+            self.assertTrue(processed_image.processed_image.name.endswith('.png'))
+
+    def test_some_fail(self):
+        response = self.post_batch([make_upload(seed=4), self.invalid_upload()])
+        self.assertEqual(response.status_code, 207, response.content)
+        data = response.json()
+        self.assertEqual((data['status'], data['succeeded'], data['failed']), ('partial', 1, 1))
+        self.assertEqual([result['status'] for result in data['results']], ['completed', 'failed'])
+
+    def test_all_fail(self):
+        response = self.post_batch([self.invalid_upload(), self.invalid_upload()])
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json()['status'], 'failed')
+
+    def test_inference_error_fails_items(self):
+        response = self.post_batch([make_upload(seed=5), make_upload(seed=6)], StubSession(fail=True))
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(
+            [result['error'] for result in response.json()['results']],
+            ['inference failed', 'inference failed']
+        )
+
+    def test_storage_error_fails_only_its_item(self):
+        store_result = views.store_result
+
+        def flaky_store_result(upload, *args, **kwargs):
+            if upload.name == 'b.jpg':
+                raise OSError('No space left on device')
+            return store_result(upload, *args, **kwargs)
+
+        with mock.patch('image_apis.views.store_result', side_effect=flaky_store_result):
+            response = self.post_batch([make_upload(seed=7), make_upload(name='b.jpg', seed=8)])
+        self.assertEqual(response.status_code, 207, response.content)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['completed', 'failed'])
+        self.assertEqual(results[1]['error'], 'No space left on device')
+        self.assertTrue(ProcessedImage.objects.filter(pk=results[0]['result']['id']).exists())
+
+    def test_no_images(self):
+        response = self.client.post(self.url, {'quality': 'fast'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batched_masks_match_single_predictions(self):
+        session = make_u2net_session()
+        self.assertTrue(supports_batching(session))
+        images = [
+            Image.fromarray(make_image(width, height, seed)[..., ::-1])
+            for seed, (width, height) in enumerate([(300, 200), (120, 160), (320, 320)])
+        ]
+        masks = predict_masks(session, images, batch_size=2)
+        self.assertEqual(session.inner_session.batch_sizes, [2, 1])
+        for image, mask in zip(images, masks):
+            np.testing.assert_array_equal(np.asarray(mask), np.asarray(session.predict(image)[0]))
+
+    def test_batch_endpoint_runs_stacked_inference(self):
+        session = make_u2net_session()
+        response = self.post_batch([make_upload(seed=seed) for seed in range(3)], session)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(session.inner_session.batch_sizes, [3])
@@ -0,0 +1,205 @@
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def iter_tiles(height, width, tile_height, tile_width):
+    """Yield (y0, y1, x0, x1) for tiles covering a height x width frame"""
+    for y0 in range(0, height, tile_height):
+        for x0 in range(0, width, tile_width):
+            yield y0, min(y0 + tile_height, height), x0, min(x0 + tile_width, width)
+
+
+def run_tiles(func, tiles, workers):
+    """
+    Call ``func(y0, y1, x0, x1)`` for every tile on a shared thread pool of
+    ``workers`` threads and wait for all of them, re-raising the first error.
+    OpenCV releases the GIL, so tiles are processed on several cores.
+    """
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-tile')
+            _executors[workers] = executor
+
+    futures = [executor.submit(func, *tile) for tile in tiles]
+    for future in futures:
+        future.result()
+
+
+def allocate_frame(shape, dtype=np.uint8, memory_budget=None):
+    """
+    Allocate an output frame, backed by a temporary memory-mapped file
+    when it would not fit in the memory budget
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if memory_budget is None or nbytes <= memory_budget:
+        return np.empty(shape, dtype=dtype)
+    backing = tempfile.TemporaryFile()
+    return np.memmap(backing, dtype=dtype, mode='w+', shape=shape)
+
+
+def apply_in_place(frame, tile_size, halo, func):
+    """
+    Run ``func(patch, y0, x0)`` over overlapping tiles of a frame and write
+    the results back into the same frame.
+
+    Each patch carries ``halo`` pixels of unprocessed context on every side
+    (clipped at the frame border) so neighbourhood filters produce the same
+    values as on the whole frame. Context that neighbouring tiles have
+    already overwritten is restored from saved copies, so only one frame
+    plus a few strips is ever held in memory.
+    """
+    height, width = frame.shape[:2]
+    prev_rows = None
+
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        py0, py1 = max(y0 - halo, 0), min(y1 + halo, height)
+
+        # Original values of this band's last rows, needed by the next band
+        next_prev_rows = np.array(frame[max(y1 - halo, 0):y1])
+        prev_cols = None
+
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            px0, px1 = max(x0 - halo, 0), min(x1 + halo, width)
+
+            patch = np.array(frame[py0:py1, px0:px1])
+            if prev_rows is not None and y0 > py0:
+                patch[:y0 - py0] = prev_rows[-(y0 - py0):, px0:px1]
+            if prev_cols is not None and x0 > px0:
+                patch[y0 - py0:y1 - py0, :x0 - px0] = prev_cols
+
+            next_prev_cols = np.array(frame[y0:y1, max(x1 - halo, 0):x1])
+            result = func(patch, py0, px0)
+            frame[y0:y1, x0:x1] = result[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+            prev_cols = next_prev_cols
+
+        prev_rows = next_prev_rows
+
+    return frame
+
+
+class TiledCLAHE:
+    """
+    CLAHE over a frame that is only ever seen one tile at a time.
+
+    Histograms for the 8x8 contextual regions are accumulated from every
+    tile first (``accumulate``), turned into clipped equalization tables
+    (``finalize``) and then applied tile by tile with the same bilinear
+    interpolation as ``cv2.createCLAHE``. Results match OpenCV's CLAHE on
+    the whole frame to within one grey level.
+    """
+
+    def __init__(self, shape, clip_limit=2.0, tile_grid_size=(8, 8)):
+        self.height, self.width = shape[:2]
+        self.grid_x, self.grid_y = tile_grid_size
+
+        # Unless both sides divide evenly, OpenCV pads the frame (reflect-101)
+        # by grid - size % grid on both axes, a whole cell on an even axis
+        self.ext_height, self.ext_width = self.height, self.width
+        if self.height % self.grid_y or self.width % self.grid_x:
+            self.ext_height += self.grid_y - self.height % self.grid_y
+            self.ext_width += self.grid_x - self.width % self.grid_x
+        self.cell_height = self.ext_height // self.grid_y
+        self.cell_width = self.ext_width // self.grid_x
+        self.cell_area = self.cell_height * self.cell_width
+
+        self.clip = 0
+        if clip_limit > 0:
+            self.clip = max(int(clip_limit * self.cell_area / 256), 1)
+
+        self.hist = np.zeros((self.grid_y, self.grid_x, 256), dtype=np.int64)
+        self.luts = None
+
+    def accumulate(self, channel, y0, x0):
+        """Add a tile of the 8-bit channel at (y0, x0) to the histograms"""
+        h, w = channel.shape[:2]
+
+        # Pixels of the tile itself, split along the region grid
+        for cy in range(y0 // self.cell_height, (y0 + h - 1) // self.cell_height + 1):
+            ry0 = max(cy * self.cell_height, y0) - y0
+            ry1 = min((cy + 1) * self.cell_height, y0 + h) - y0
+            for cx in range(x0 // self.cell_width, (x0 + w - 1) // self.cell_width + 1):
+                rx0 = max(cx * self.cell_width, x0) - x0
+                rx1 = min((cx + 1) * self.cell_width, x0 + w) - x0
+                block = channel[ry0:ry1, rx0:rx1]
+                self.hist[cy, cx] += np.bincount(block.ravel(), minlength=256)
+
+        # Pixels mirrored into the padding below / right of the frame
+        rows = self._axis_positions(y0, h, self.height, self.ext_height)
+        cols = self._axis_positions(x0, w, self.width, self.ext_width)
+        all_rows = (np.arange(y0, y0 + h), np.arange(h))
+        all_cols = (np.arange(x0, x0 + w), np.arange(w))
+        if len(rows[0]):
+            self._add_positions(channel, rows, all_cols)
+        if len(cols[0]):
+            self._add_positions(channel, all_rows, cols)
+        if len(rows[0]) and len(cols[0]):
+            self._add_positions(channel, rows, cols)
+
+    def finalize(self):
+        """Clip the histograms and build the per-region lookup tables"""
+        hist = self.hist.reshape(-1, 256).copy()
+
+        if self.clip > 0:
+            excess = np.maximum(hist - self.clip, 0).sum(axis=1)
+            np.minimum(hist, self.clip, out=hist)
+            hist += (excess // 256)[:, np.newaxis]
+            for region, residual in enumerate(excess % 256):
+                if residual:
+                    step = max(256 // residual, 1)
+                    hist[region, np.arange(0, 256, step)[:residual]] += 1
+
+        scale = np.float32(255.0 / self.cell_area)
+        cdf = np.cumsum(hist, axis=1).astype(np.float32)
+        luts = np.clip(np.rint(cdf * scale), 0, 255).astype(np.uint8)
+        self.luts = luts.reshape(self.grid_y, self.grid_x, 256)
+        return self.luts
+
+    def apply(self, channel, y0, x0):
+        """Equalize a tile of the 8-bit channel located at (y0, x0)"""
+        h, w = channel.shape[:2]
+        ty1, ty2, ya = self._interpolation(y0, h, self.cell_height, self.grid_y)
+        tx1, tx2, xa = self._interpolation(x0, w, self.cell_width, self.grid_x)
+        ty1, ty2, ya = ty1[:, None], ty2[:, None], ya[:, None]
+        tx1, tx2, xa = tx1[None, :], tx2[None, :], xa[None, :]
+
+        top = self.luts[ty1, tx1, channel] * (1 - xa)
+        top += self.luts[ty1, tx2, channel] * xa
+        bottom = self.luts[ty2, tx1, channel] * (1 - xa)
+        bottom += self.luts[ty2, tx2, channel] * xa
+        top *= 1 - ya
+        bottom *= ya
+        top += bottom
+        return np.clip(np.rint(top), 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def _interpolation(start, length, cell, grid):
+        pos = np.arange(start, start + length, dtype=np.float32)
+        pos = pos * np.float32(1.0 / cell) - np.float32(0.5)
+        first = np.floor(pos)
+        weight = (pos - first).astype(np.float32)
+        first = first.astype(np.intp)
+        return np.maximum(first, 0), np.minimum(first + 1, grid - 1), weight
+
+    @staticmethod
+    def _axis_positions(start, length, size, ext_size):
+        """Padding positions along one axis whose mirrored source is in the tile"""
+        padding = np.arange(size, ext_size)
+        source = 2 * (size - 1) - padding
+        inside = (source >= start) & (source < start + length)
+        return padding[inside], source[inside] - start
+
+    def _add_positions(self, channel, rows, cols):
+        (row_pos, row_idx), (col_pos, col_idx) = rows, cols
+        values = channel[np.ix_(row_idx, col_idx)].astype(np.intp)
+        regions = (row_pos // self.cell_height)[:, None] * self.grid_x + (col_pos // self.cell_width)[None, :]
+        counts = np.bincount((regions * 256 + values).ravel(), minlength=self.hist.size)
+        self.hist += counts.reshape(self.hist.shape)
@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_active_timer = ContextVar('stage_timer', default=None)
+
+
+class StageTimer:
+    """
+    Wall time spent in each named stage of one request, in seconds.
+
+    Processing functions mark their stages with ``stage(name)``; the
+    durations land in the timer activated around the call, and cost
+    nothing when no timer is active. A stage entered several times
+    accumulates.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def activate(self):
+        token = _active_timer.set(self)
+        try:
+            yield self
+        finally:
+            _active_timer.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        """Stage durations rounded to microseconds, for the stage_timings field"""
+        return {name: round(seconds, 6) for name, seconds in self.stages.items()}
+
+    def server_timing(self):
+        """The stages as a Server-Timing header value (milliseconds)"""
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items())
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a stage of the active StageTimer, if there is one"""
+    timer = _active_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
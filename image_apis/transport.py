@@ -0,0 +1,133 @@
+import os
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+# Segments are named <prefix><pid of the creating web process>_<id>, so the
+# ones left behind by a process that died can be found and removed
+SEGMENT_PREFIX = 'imgapi_'
+SHM_DIR = '/dev/shm'
+
+
+class BufferRef:
+    """Picklable handle to encoded image bytes in a shared memory segment"""
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+
+
+def segment_name():
+    return f'{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:16]}'
+
+
+def write(name, data):
+    """Copy bytes into a new segment; returns its BufferRef"""
+    ref = BufferRef(name, len(data))
+    # Zero-length segments are not allowed
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(ref.nbytes, 1))
+    try:
+        segment.buf[:ref.nbytes] = data
+    finally:
+        segment.close()
+    return ref
+
+
+@contextmanager
+def attach(ref):
+    """
+    Map a segment and yield a memoryview of its bytes without copying.
+    Nothing referencing it may outlive the block.
+    """
+    segment = shared_memory.SharedMemory(name=ref.name)
+    data = segment.buf[:ref.nbytes]
+    try:
+        yield data
+    finally:
+        data.release()
+        try:
+            segment.close()
+        except BufferError:
+            # Still referenced (e.g. by a traceback); unmapped when collected
+            pass
+
+
+def read(ref):
+    """Copy a segment's bytes out"""
+    with attach(ref) as data:
+        return bytes(data)
+
+
+def unlink(name):
+    """Remove a segment if it exists"""
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    segment.close()
+    segment.unlink()
+    return True
+
+
+class SharedBuffers:
+    """
+    Shared memory segments used by one task, owned by the web process.
+
+    Inputs are written with share(); outputs get a name from reserve()
+    that the worker creates its segment under. Every segment, including
+    one a crashed worker created but never reported, is unlinked when the
+    block exits.
+    """
+
+    def __init__(self):
+        self._names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for name in self._names:
+            unlink(name)
+        self._names = []
+
+    def share(self, data):
+        name = self.reserve()
+        return write(name, data)
+
+    def reserve(self):
+        name = segment_name()
+        self._names.append(name)
+        return name
+
+
+def cleanup_stale():
+    """
+    Unlink segments created by web processes that no longer exist (Linux,
+    where segments are files under /dev/shm). Returns the number removed.
+    """
+    try:
+        entries = os.listdir(SHM_DIR)
+    except OSError:
+        return 0
+
+    removed = 0
+    for entry in entries:
+        if not entry.startswith(SEGMENT_PREFIX):
+            continue
+        try:
+            pid = int(entry[len(SEGMENT_PREFIX):].split('_', 1)[0])
+        except ValueError:
+            continue
+        if not _pid_alive(pid) and unlink(entry):
+            removed += 1
+    return removed
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,57 @@
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler, TemporaryFileUploadHandler
+)
+
+
+class ContentHashMixin:
+    """
+    Hash uploaded files while they are streamed in.
+
+    The SHA-256 hex digest is stored on the resulting file object as
+    ``content_hash`` so the result cache never has to re-read the upload.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._hashing():
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_hash = self.hasher.hexdigest()
+        return uploaded_file
+
+    def _hashing(self):
+        return True
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    """Keep small uploads in memory, hashing them as they arrive"""
+
+    def _hashing(self):
+        # Large uploads are passed on to the next handler, which hashes them
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    """Stream large uploads to a temporary file, hashing them as they arrive"""
+
+
+def content_hash(uploaded_file):
+    """SHA-256 of an uploaded file, reusing the digest taken while streaming"""
+    digest = getattr(uploaded_file, 'content_hash', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in uploaded_file.chunks():
+            hasher.update(chunk)
+        uploaded_file.seek(0)
+        digest = hasher.hexdigest()
+        uploaded_file.content_hash = digest
+    return digest
@@ -1,20 +1,35 @@
 from django.urls import path
-from . import views
+from . import views, async_views
+from .operations import OPERATIONS
 
 urlpatterns = [
-    # Basic Image processing APIs
-    path('upscale/', views.upscale_image_api, name='upscale_image'),
-    path('remove-background/', views.remove_background_api, name='remove_background'),
-    path('remove-object/', views.remove_object_api, name='remove_object'),
-    path('enhance/', views.enhance_image_api, name='enhance_image'),
-    
-    # Advanced Image processing APIs (AI-powered)
-    path('upscale-advanced/', views.upscale_image_advanced_api, name='upscale_image_advanced'),
-    path('remove-background-advanced/', views.remove_background_advanced_api, name='remove_background_advanced'),
-    path('remove-object-advanced/', views.remove_object_advanced_api, name='remove_object_advanced'),
-    path('enhance-advanced/', views.enhance_image_advanced_api, name='enhance_image_advanced'),
+    # Image processing APIs, one route per registered operation
+    path(f'{operation.route}/', views.process_image_api, {'operation': operation.name},
+         name=operation.url_name)
+    for operation in OPERATIONS.values()
+] + [
+    # Batch variant of every operation
+    path(f'batch/{operation.route}/', views.batch_process_api, {'operation': operation.name},
+         name=f'{operation.url_name}_batch')
+    for operation in OPERATIONS.values()
+] + [
+    # Async variant of every operation for ASGI servers, processed on a process pool
+    path(f'async/{operation.route}/', async_views.process_image_async, {'operation': operation.name},
+         name=f'{operation.url_name}_async')
+    for operation in OPERATIONS.values()
+] + [
+    # Several operations chained on one upload
+    path('pipeline/', views.process_pipeline_api, name='process_pipeline'),
     
     # Get processed images
     path('processed-images/', views.get_processed_images, name='get_processed_images'),
     path('processed-images/<int:image_id>/', views.get_processed_image, name='get_processed_image'),
-] 
\ No newline at end of file
+    path('processed-images/<int:image_id>/derivative/', views.get_processed_image_derivative,
+         name='processed_image_derivative'),
+    
+    # Model status
+    path('models/', views.model_status, name='model_status'),
+    
+    # Health check (async, answers while images are processing)
+    path('health/', async_views.health, name='health'),
+]
@@ -0,0 +1,94 @@
+from django.conf import settings
+from PIL import Image
+
+# Uploads larger than these (width * height, in megapixels) are rejected from
+# their headers, before any pixel data is decoded
+MAX_INPUT_MEGAPIXELS = getattr(settings, 'IMAGE_MAX_INPUT_MEGAPIXELS', 40)
+MAX_OUTPUT_MEGAPIXELS = getattr(settings, 'IMAGE_MAX_OUTPUT_MEGAPIXELS', 160)
+
+# Per-operation overrides: {processing_type: {'input': MP, 'output': MP}}
+OPERATION_LIMITS = getattr(settings, 'IMAGE_OPERATION_MEGAPIXEL_LIMITS', {})
+
+
+class ImageInfo:
+    """Format and dimensions of an upload, read without decoding it"""
+
+    def __init__(self, format, width, height):
+        self.format = format
+        self.width = width
+        self.height = height
+
+    @property
+    def megapixels(self):
+        return self.width * self.height / 1e6
+
+
+def sniff_format(head):
+    """Image format named by the leading magic bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def inspect_image(upload):
+    """
+    Read an upload's real format from its magic bytes and its dimensions
+    from its header. Returns None when it is not a JPEG, PNG or WebP file.
+    """
+    upload.seek(0)
+    image_format = sniff_format(upload.read(12))
+    upload.seek(0)
+    if image_format is None:
+        return None
+
+    # Django's ImageField has already parsed the header; otherwise open
+    # lazily, which reads the header but none of the pixel data
+    image = getattr(upload, 'image', None)
+    if image is None:
+        image = Image.open(upload)
+    width, height = image.size
+    upload.seek(0)
+    return ImageInfo(image_format, width, height)
+
+
+def megapixel_limits(processing_type):
+    """(input, output) megapixel limits of an operation"""
+    limits = OPERATION_LIMITS.get(processing_type, {})
+    return (limits.get('input', MAX_INPUT_MEGAPIXELS),
+            limits.get('output', MAX_OUTPUT_MEGAPIXELS))
+
+
+def check_limits(operation, info, params):
+    """
+    Error message when processing an image of this size with these
+    parameters would exceed the operation's megapixel limits, else None
+    """
+    max_input, max_output = megapixel_limits(operation.name)
+    if max_input and info.megapixels > max_input:
+        return (f"Image too large: {info.width}x{info.height} is {info.megapixels:.1f} "
+                f"megapixels. Maximum is {max_input} megapixels.")
+
+    out_width, out_height = operation.output_size(info.width, info.height, params)
+    out_megapixels = out_width * out_height / 1e6
+    if max_output and out_megapixels > max_output:
+        return (f"Output too large: {operation.label} would produce {out_width}x{out_height} "
+                f"({out_megapixels:.1f} megapixels). Maximum is {max_output} megapixels.")
+    return None
+
+
+def check_pipeline_limits(steps, info):
+    """
+    check_limits for every step of a pipeline, each on the dimensions the
+    step before it produces
+    """
+    for operation, params in steps:
+        error = check_limits(operation, info, params)
+        if error:
+            return error
+        width, height = operation.output_size(info.width, info.height, params)
+        info = ImageInfo(info.format, width, height)
+    return None
@@ -1,220 +1,262 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework.decorators import api_view, parser_classes, renderer_classes
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.settings import api_settings
 from django.conf import settings
 import os
-import time
 from .models import ProcessedImage
-from .serializers import ImageUploadSerializer, ProcessedImageSerializer
-from .image_processing import (
-    upscale_image, remove_background, remove_object, enhance_image_quality,
-    upscale_image_advanced, remove_background_advanced, remove_object_advanced, enhance_image_quality_advanced
+from .serializers import (
+    ImageUploadSerializer, ProcessedImageSerializer, DerivativeParamsSerializer,
+    ThumbnailParamsSerializer, PipelineParamsSerializer
 )
-from django.core.files import File
+from .derivatives import derivative_cache
+from .operations import get_operation
+from .sessions import registry, configured_model
+from .jobs import job_queue, process_and_store, run_processing, store_result, QueueFull
+from .batch import extract_archive, ArchiveError
+from .cache import result_cache
+from .pagination import ProcessedImageCursorPagination
+from .renderers import ImageRenderer, wants_binary
+from .encoders import OUTPUT_FORMATS, format_for_ext, negotiate
+from .timing import StageTimer
+from .metrics import metrics
+from .validation import check_limits, check_pipeline_limits
+from .pipeline import parse_steps, pipeline_operation
+from .storage import delete_if_unreferenced
+from django.http import HttpResponse, FileResponse
+from django.views.decorators.http import require_GET
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound
+from datetime import datetime, time
 
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def upscale_image_api(request):
+# Upper bounds for one batch request
+BATCH_MAX_ITEMS = getattr(settings, 'IMAGE_BATCH_MAX_ITEMS', 100)
+BATCH_MAX_ARCHIVE_BYTES = getattr(settings, 'IMAGE_BATCH_MAX_ARCHIVE_BYTES', 200 * 1024 * 1024)
+
+
+def _wants_async(request):
+    """Whether the client asked for submit-and-poll processing"""
+    value = request.query_params.get('async', request.data.get('async', ''))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _resolve_output(request, upload, operation, params, binary=None):
     """
-    API endpoint for image upscaling
+    Replace the output_format / output_quality / effort parameters with the
+    extension of the result (params['ext']) and, when the client chose an
+    encoding, params['encoding']. Binary responses also honour a specific
+    image type in the Accept header.
     """
-    try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='upscale'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image
-            output_path, processing_time = upscale_image(image_path, scale_factor=2)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
-            )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    output_format = params.pop('output_format', None)
+    output_quality = params.pop('output_quality', None)
+    effort = params.pop('effort', None)
     
-    except Exception as e:
-        return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    if binary is None:
+        binary = wants_binary(request)
+    if output_format is None and binary:
+        negotiated = negotiate(request.META.get('HTTP_ACCEPT', ''))
+        if negotiated is not None:
+            output_format = negotiated.name
+    
+    # Processed images keep the upload's format unless the operation sets one
+    ext = operation.output_ext or _upload_ext(upload)
+    if output_format is None and output_quality is None and effort is None:
+        params['ext'] = ext
+        return params
+    
+    fmt = OUTPUT_FORMATS[output_format] if output_format else format_for_ext(ext, output_quality)
+    params['ext'] = fmt.ext
+    params['encoding'] = {
+        'output_format': fmt.name,
+        'output_quality': output_quality,
+        'effort': effort or 'default',
+    }
+    return params
 
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def upscale_image_advanced_api(request):
+
+def _process_image(request, upload, operation, params):
     """
-    Advanced API endpoint for image upscaling using AI models
+    Process an image inline and return 201, or queue it and return 202
+    with the job id when the client opted into async mode.
+
+    Identical uploads processed with the same parameters are served from
+    the result cache, or wait for the matching request already in flight.
     """
-    try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Get scale factor from request, default to 4
-            scale_factor = int(request.data.get('scale_factor', 4))
-            
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='upscale_advanced'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image with advanced algorithm
-            output_path, processing_time = upscale_image_advanced(image_path, scale_factor=scale_factor)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
-            )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    _resolve_output(request, upload, operation, params)
     
-    except Exception as e:
-        return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    if wants_binary(request):
+        return _binary_response(upload, operation, params)
+    
+    cache_key = None
+    if result_cache.enabled:
+        cache_key = result_cache.make_key(upload, operation.name, params)
+    
+    if _wants_async(request):
+        return _submit_job(request, upload, operation, params, cache_key)
+    
+    # Inline processing works from the upload buffer, never re-reading the saved file
+    upload.seek(0)
+    image_data = upload.read()
+    upload.seek(0)
+    
+    if cache_key:
+        # Claim the key before processing: identical requests, in this
+        # process or another, find the pending row and wait for it
+        processed_image, cached = _claim(upload, operation, params, cache_key)
+        if cached:
+            return _cached_response(request, processed_image)
+        processed_image = run_processing(
+            processed_image, operation.func, image_data=image_data, **params
+        )
+    else:
+        processed_image = process_and_store(
+            upload, operation.name, operation.func, image_data, **params
         )
+    
+    # Return response
+    response_serializer = ProcessedImageSerializer(
+        processed_image, 
+        context={'request': request}
+    )
+    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def remove_background_api(request):
+
+def _binary_response(upload, operation, params):
     """
-    API endpoint for background removal
+    Process an upload and send the encoded result as the response body.
+    Nothing is written: no ProcessedImage row, no original or result file.
     """
+    upload.seek(0)
+    timer = StageTimer()
+    with timer.activate():
+        output, processing_time = operation.func(upload.read(), **params)
+    
+    ext = params['ext']
+    encoding = params.get('encoding')
+    fmt = OUTPUT_FORMATS[encoding['output_format']] if encoding else format_for_ext(ext)
+    response = HttpResponse(output, content_type=fmt.media_type)
+    response['Content-Disposition'] = f'inline; filename="{operation.name}{ext}"'
+    response['X-Processing-Time'] = f'{processing_time:.3f}'
+    response['Server-Timing'] = timer.server_timing()
+    metrics.inc('image_api_output_bytes_total', len(output), processing_type=operation.name)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def _submit_job(request, upload, operation, params, cache_key):
+    """Create a pending ProcessedImage and queue it for processing"""
+    processed_image, cached = _claim(upload, operation, params, cache_key)
+    if cached:
+        return _cached_response(request, processed_image)
+    
     try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='background_removal'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image
-            output_path, processing_time = remove_background(image_path)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
+        job_queue.submit(processed_image, operation.func, **params)
+    except QueueFull as e:
+        if cache_key:
+            result_cache.finished(processed_image)
+        delete_if_unreferenced(processed_image.original_image)
+        processed_image.delete()
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return _accepted_response(request, processed_image)
+
+
+def _claim(upload, operation, params, cache_key):
+    """
+    Create the pending ProcessedImage for a request, claiming its cache
+    key. Returns (processed_image, cached): cached is True when an
+    identical request's completed or in-flight row was found instead.
+    """
+    fields = {
+        'original_image': upload,
+        'original_size': upload.size,
+        'processing_type': operation.name,
+        'quality': params['quality'],
+    }
+    if not cache_key:
+        return ProcessedImage.objects.create(**fields), False
+    
+    with result_cache.lock(cache_key):
+        existing = result_cache.lookup(cache_key)
+        if existing is not None:
+            return existing, True
+        processed_image, created = result_cache.claim(cache_key, **fields)
+        return processed_image, not created
+
+
+def _upload_ext(upload):
+    """Lower-cased extension of an uploaded file, defaulting to PNG"""
+    ext = os.path.splitext(upload.name)[1].lower()
+    return ext if ext in ('.jpg', '.jpeg', '.png', '.webp') else '.png'
+
+
+def _accepted_response(request, processed_image):
+    """202 response pointing the client at the job to poll"""
+    response_serializer = ProcessedImageSerializer(
+        processed_image, 
+        context={'request': request}
+    )
+    response = Response(response_serializer.data, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = request.build_absolute_uri(
+        reverse('get_processed_image', args=[processed_image.id])
+    )
+    return response
+
+
+def _cached_response(request, processed_image):
+    """Serve a cached result, waiting for it first if it is still in flight"""
+    if processed_image.status != 'completed':
+        if _wants_async(request):
+            response = _accepted_response(request, processed_image)
+            response['X-Cache'] = 'HIT'
+            return response
+        processed_image = result_cache.wait(processed_image)
+        if processed_image.status == 'failed':
+            return Response(
+                {'error': processed_image.error}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    except Exception as e:
-        return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    response_serializer = ProcessedImageSerializer(
+        processed_image, 
+        context={'request': request}
+    )
+    response = Response(response_serializer.data, status=status.HTTP_200_OK)
+    response['X-Cache'] = 'HIT'
+    return response
+
 
+@metrics.track_request('single')
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def remove_background_advanced_api(request):
+@renderer_classes(list(api_settings.DEFAULT_RENDERER_CLASSES) + [ImageRenderer])
+def process_image_api(request, operation):
     """
-    Advanced API endpoint for background removal using multiple AI models
+    API endpoint for every registered processing operation
+
+    The operation name comes from the URL pattern generated for it in
+    urls.py; its parameters are validated by the operation's serializer.
+    With return=binary (or Accept: image/*) the processed image is
+    returned directly instead of being stored.
     """
     try:
+        operation = get_operation(operation)
         serializer = ImageUploadSerializer(data=request.data)
         if serializer.is_valid():
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='background_removal_advanced'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image with advanced algorithm
-            output_path, processing_time = remove_background_advanced(image_path)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
-            )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+            params, errors = operation.parse_params(request.data)
+            if errors:
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Reject oversized images from their headers, before decoding
+            upload = serializer.validated_data['original_image']
+            error = check_limits(operation, upload.image_info, params)
+            if error:
+                return Response({'original_image': [error]}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Process the image (or queue it in async mode)
+            return _process_image(request, upload, operation, params)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -224,179 +266,209 @@ def remove_background_advanced_api(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _parse_datetime_param(value):
+    """Parse an ISO 8601 date or datetime query parameter, or None if invalid"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            return None
+        parsed = datetime.combine(parsed_date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+@metrics.track_request('batch')
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def remove_object_api(request):
+def batch_process_api(request, operation):
     """
-    API endpoint for object removal
+    API endpoint processing many images with one operation
+
+    Images are sent as repeated ``images`` files and/or one zip or tar
+    ``archive``; the operation's parameters apply to every image. The
+    response lists a result or an error per image plus a combined status
+    (201 when all succeed, 207 when some fail, 400 when none succeed).
     """
     try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Get coordinates from request
-            x1 = int(request.data.get('x1', 0))
-            y1 = int(request.data.get('y1', 0))
-            x2 = int(request.data.get('x2', 0))
-            y2 = int(request.data.get('y2', 0))
-            
-            if x1 >= x2 or y1 >= y2:
-                return Response(
-                    {'error': 'Invalid coordinates. x2 must be greater than x1 and y2 must be greater than y1.'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='object_removal'
+        operation = get_operation(operation)
+        params, errors = operation.parse_params(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        uploads = list(request.FILES.getlist('images'))
+        archive = request.FILES.get('archive')
+        if archive is not None:
+            uploads += extract_archive(archive, BATCH_MAX_ITEMS, BATCH_MAX_ARCHIVE_BYTES)
+        if not uploads:
+            return Response(
+                {'error': 'No images provided. Send "images" files or an "archive".'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image
-            output_path, processing_time = remove_object(image_path, x1, y1, x2, y2)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
+        if len(uploads) > BATCH_MAX_ITEMS:
+            return Response(
+                {'error': f'Too many images. Maximum is {BATCH_MAX_ITEMS} per batch.'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        
+        results = _process_batch(request, uploads, operation, params)
+        succeeded = sum(1 for result in results if result['status'] == 'completed')
+        if succeeded == len(results):
+            batch_status, http_status = 'completed', status.HTTP_201_CREATED
+        elif succeeded:
+            batch_status, http_status = 'partial', status.HTTP_207_MULTI_STATUS
         else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            batch_status, http_status = 'failed', status.HTTP_400_BAD_REQUEST
+        
+        return Response({
+            'processing_type': operation.name,
+            'status': batch_status,
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results,
+        }, status=http_status)
     
+    except ArchiveError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def remove_object_advanced_api(request):
+
+def _process_batch(request, uploads, operation, params):
     """
-    Advanced API endpoint for object removal using multiple inpainting methods
+    Validate, process and store each upload of a batch, returning one
+    result entry per upload in order. Cached results are reused; the rest
+    go through the operation's batch function when it has one.
     """
-    try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Get coordinates from request
-            x1 = int(request.data.get('x1', 0))
-            y1 = int(request.data.get('y1', 0))
-            x2 = int(request.data.get('x2', 0))
-            y2 = int(request.data.get('y2', 0))
-            
-            if x1 >= x2 or y1 >= y2:
-                return Response(
-                    {'error': 'Invalid coordinates. x2 must be greater than x1 and y2 must be greater than y1.'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='object_removal_advanced'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image with advanced algorithm
-            output_path, processing_time = remove_object_advanced(image_path, x1, y1, x2, y2)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
+    results = [None] * len(uploads)
+    items = []
+    for index, upload in enumerate(uploads):
+        serializer = ImageUploadSerializer(data={'original_image': upload})
+        if not serializer.is_valid():
+            results[index] = _batch_error(index, upload, serializer.errors['original_image'][0])
+            continue
+        error = check_limits(operation, upload.image_info, params)
+        if error:
+            results[index] = _batch_error(index, upload, error)
+            continue
+        
+        item_params = _resolve_output(request, upload, operation, dict(params))
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = result_cache.make_key(upload, operation.name, item_params)
+            existing = result_cache.lookup(cache_key)
+            if existing is not None and existing.status == 'completed':
+                results[index] = _batch_result(request, index, upload, existing, cached=True)
+                continue
+        
+        upload.seek(0)
+        items.append((index, upload, upload.read(), item_params, cache_key))
+    
+    started_at = timezone.now()
+    timers = []
+    if operation.batch_func is not None and operation.output_ext:
+        # Items share the operation's fixed format, so any item's parameters do.
+        # Stages of batched calls are shared out equally, like processing_time.
+        batch_timer = StageTimer()
+        with batch_timer.activate():
+            outputs = operation.batch_func(
+                [item[2] for item in items], **items[0][3]
+            ) if items else []
+        for _ in items:
+            timer = StageTimer()
+            for name, seconds in batch_timer.stages.items():
+                timer.add(name, seconds / len(items))
+            timers.append(timer)
+    else:
+        outputs = []
+        for _, _, image_data, item_params, _ in items:
+            timer = StageTimer()
+            try:
+                with timer.activate():
+                    outputs.append(operation.func(image_data, **item_params))
+            except Exception as e:
+                outputs.append(e)
+            timers.append(timer)
+    
+    for (index, upload, _, item_params, cache_key), output, timer in zip(items, outputs, timers):
+        if isinstance(output, Exception):
+            results[index] = _batch_error(index, upload, str(output))
+            continue
+        try:
+            processed_image = store_result(
+                upload, operation.name, output[0], output[1], started_at,
+                cache_key=cache_key, ext=item_params['ext'], quality=item_params['quality'],
+                timer=timer
             )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            # A storage or database error fails this item, not the batch
+            results[index] = _batch_error(index, upload, e)
+            continue
+        results[index] = _batch_result(request, index, upload, processed_image)
     
-    except Exception as e:
-        return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    if result_cache.enabled:
+        result_cache.maybe_evict()
+    return results
+
+
+def _batch_result(request, index, upload, processed_image, cached=False):
+    serializer = ProcessedImageSerializer(processed_image, context={'request': request})
+    return {
+        'index': index,
+        'name': upload.name,
+        'status': 'completed',
+        'cached': cached,
+        'result': serializer.data,
+    }
 
+
+def _batch_error(index, upload, error):
+    return {'index': index, 'name': upload.name, 'status': 'failed', 'error': str(error)}
+
+
+@metrics.track_request('pipeline')
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def enhance_image_api(request):
+@renderer_classes(list(api_settings.DEFAULT_RENDERER_CLASSES) + [ImageRenderer])
+def process_pipeline_api(request):
     """
-    API endpoint for image enhancement
+    API endpoint chaining several operations on one upload
+
+    ``steps`` is a JSON list of {"operation": <name or route>, ...parameters}
+    applied in order to a single decoded image, which is encoded and stored
+    once at the end. The output encoding, return=binary and async mode work
+    as for a single operation; intermediates=true also stores the result of
+    every step before the last.
     """
     try:
         serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='enhancement'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image
-            output_path, processing_time = enhance_image_quality(image_path)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
-            )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
+        if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params_serializer = PipelineParamsSerializer(data=request.data)
+        if not params_serializer.is_valid():
+            return Response(params_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = dict(params_serializer.validated_data)
+        steps, errors = parse_steps(params.pop('steps'), params['quality'])
+        if errors:
+            return Response({'steps': errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Check every step against the limits on the size it receives
+        upload = serializer.validated_data['original_image']
+        error = check_pipeline_limits(steps, upload.image_info)
+        if error:
+            return Response({'original_image': [error]}, status=status.HTTP_400_BAD_REQUEST)
+        
+        operation = pipeline_operation(steps)
+        params['steps'] = [(step.name, step_params) for step, step_params in steps]
+        if params.pop('intermediates'):
+            return _process_pipeline_intermediates(request, upload, operation, params)
+        return _process_image(request, upload, operation, params)
     
     except Exception as e:
         return Response(
@@ -404,71 +476,94 @@ def enhance_image_api(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-@api_view(['POST'])
-@parser_classes([MultiPartParser, FormParser])
-def enhance_image_advanced_api(request):
+
+def _process_pipeline_intermediates(request, upload, operation, params):
     """
-    Advanced API endpoint for image enhancement using AI models
+    Process a pipeline inline, storing the result of every step as well as
+    the final one. Intermediate results are not cached.
     """
-    try:
-        serializer = ImageUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            # Create ProcessedImage instance
-            processed_image = ProcessedImage.objects.create(
-                original_image=serializer.validated_data['original_image'],
-                processing_type='enhancement_advanced'
-            )
-            
-            # Get the file path
-            image_path = processed_image.original_image.path
-            
-            # Process the image with advanced algorithm
-            output_path, processing_time = enhance_image_quality_advanced(image_path)
-            
-            # Save the processed image
-            with open(output_path, 'rb') as f:
-                processed_image.processed_image.save(
-                    os.path.basename(output_path),
-                    File(f),
-                    save=True
-                )
-            
-            # Update processing time
-            processed_image.processing_time = processing_time
-            processed_image.save()
-            
-            # Clean up temporary file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
-            # Return response
-            response_serializer = ProcessedImageSerializer(
-                processed_image, 
-                context={'request': request}
-            )
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-    except Exception as e:
+    if _wants_async(request) or wants_binary(request):
         return Response(
-            {'error': str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'intermediates': ['Intermediate results are only stored by inline requests.']}, 
+            status=status.HTTP_400_BAD_REQUEST
         )
+    _resolve_output(request, upload, operation, params)
+    
+    upload.seek(0)
+    image_data = upload.read()
+    upload.seek(0)
+    
+    started_at = timezone.now()
+    intermediates = []
+    processed_image = process_and_store(
+        upload, operation.name, operation.func, image_data,
+        intermediates=intermediates, **params
+    )
+    # Intermediate results are stored under their step's operation, so they
+    # are not listed as pipeline results
+    stored = [
+        (name, store_result(
+            upload, name, output, processing_time, started_at,
+            ext=params['ext'], quality=params['quality']
+        ))
+        for name, output, processing_time in intermediates
+    ]
+    
+    context = {'request': request}
+    data = ProcessedImageSerializer(processed_image, context=context).data
+    data['intermediates'] = [
+        {'operation': name, **ProcessedImageSerializer(image, context=context).data}
+        for name, image in stored
+    ]
+    return Response(data, status=status.HTTP_201_CREATED)
+
 
 @api_view(['GET'])
 def get_processed_images(request):
     """
-    API endpoint to get all processed images
+    API endpoint to list processed images, newest first, one page at a time
+
+    Optional filters: processing_type, created_after and created_before
+    (ISO 8601 dates or datetimes). Pages are cursor based: follow the
+    ``next`` / ``previous`` links. ``thumbnail=<size>`` adds a
+    thumbnail_url to every item.
     """
     try:
         processed_images = ProcessedImage.objects.all()
+        
+        processing_type = request.query_params.get('processing_type')
+        if processing_type:
+            processed_images = processed_images.filter(processing_type=processing_type)
+        
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            value = request.query_params.get(param)
+            if value:
+                parsed = _parse_datetime_param(value)
+                if parsed is None:
+                    return Response(
+                        {param: ['Enter a valid ISO 8601 date or datetime.']}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                processed_images = processed_images.filter(**{lookup: parsed})
+        
+        thumbnails = ThumbnailParamsSerializer(data=request.query_params)
+        if not thumbnails.is_valid():
+            return Response(thumbnails.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        paginator = ProcessedImageCursorPagination()
+        page = paginator.paginate_queryset(processed_images, request)
         serializer = ProcessedImageSerializer(
-            processed_images, 
+            page, 
             many=True, 
-            context={'request': request}
+            context={
+                'request': request,
+                'thumbnail_size': thumbnails.validated_data.get('thumbnail'),
+            }
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
+    
+    except NotFound:
+        raise
     
     except Exception as e:
         return Response(
@@ -480,12 +575,16 @@ def get_processed_images(request):
 def get_processed_image(request, image_id):
     """
     API endpoint to get a specific processed image
+
+    Async jobs are polled here until status is completed or failed.
+    ?timings=true adds the per-stage breakdown of the processing time.
     """
     try:
         processed_image = ProcessedImage.objects.get(id=image_id)
+        include_timings = request.query_params.get('timings', '').lower() in ('1', 'true', 'yes')
         serializer = ProcessedImageSerializer(
             processed_image, 
-            context={'request': request}
+            context={'request': request, 'include_timings': include_timings}
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
     
@@ -499,3 +598,68 @@ def get_processed_image(request, image_id):
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+@api_view(['GET'])
+def get_processed_image_derivative(request, image_id):
+    """
+    API endpoint serving a resized derivative (thumbnail) of a processed image
+
+    Derivatives are rendered on first request and kept in a bounded
+    on-disk cache; see DerivativeParamsSerializer for the parameters.
+    """
+    try:
+        serializer = DerivativeParamsSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(serializer.validated_data)
+        source = params.pop('source')
+        
+        processed_image = ProcessedImage.objects.get(id=image_id)
+        if not getattr(processed_image, f'{source}_image'):
+            return Response(
+                {'error': f'The {source} image is not available yet.'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        derivative, hit = derivative_cache.open(processed_image, source, params)
+        response = FileResponse(
+            derivative, 
+            content_type=OUTPUT_FORMATS[params['output_format']].media_type
+        )
+        response['Cache-Control'] = 'public, max-age=86400'
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    
+    except ProcessedImage.DoesNotExist:
+        return Response(
+            {'error': 'Image not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+def model_status(request):
+    """
+    API endpoint to report which models are loaded in this worker process
+    """
+    model_name, options = configured_model()
+    return Response({
+        'default_model': model_name,
+        'default_model_warm': registry.is_warm(model_name, **options),
+        'sessions': registry.status(),
+    }, status=status.HTTP_200_OK)
+
+
+@require_GET
+def prometheus_metrics(request):
+    """
+    Metrics of every worker process in the Prometheus text format
+    """
+    return HttpResponse(
+        metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -123,7 +124,146 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media storage. Originals and results are stored under sharded content-hash
+# names (originals/ab/cd/<sha256>.jpg), so identical files are stored once.
+# For S3-compatible storage (AWS S3, or MinIO locally) install
+# django-storages[s3] and set IMAGE_STORAGE_BACKEND=s3 plus the AWS_* settings
+# (AWS_STORAGE_BUCKET_NAME, AWS_S3_ENDPOINT_URL, credentials).
+STORAGES = {
+    'default': {
+        'BACKEND': 'image_apis.storage.ShardedFileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+if os.environ.get('IMAGE_STORAGE_BACKEND') == 's3':
+    STORAGES['default'] = {'BACKEND': 'image_apis.storage.ShardedS3Storage'}
+    AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME', 'image-api')
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+    AWS_QUERYSTRING_AUTH = False
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Background removal model (rembg)
+# Sessions are loaded once per worker process and shared between requests
+REMBG_MODEL = 'u2net'
+REMBG_SESSION_OPTIONS = {}
+REMBG_PRELOAD = False
+
+# Default quality tier (fast, balanced or best) when a request sets none
+IMAGE_DEFAULT_QUALITY = 'best'
+
+# Async processing jobs
+# Requests sent with async=true return 202 and are processed on a bounded pool
+IMAGE_PROCESSING_WORKERS = 2
+IMAGE_PROCESSING_MAX_PENDING = 32
+
+# Uploads are hashed while they stream in so results can be cached by content
+FILE_UPLOAD_HANDLERS = [
+    'image_apis.uploadhandlers.HashingMemoryFileUploadHandler',
+    'image_apis.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Result cache
+# Identical uploads with the same operation and parameters reuse the stored
+# result. Entries beyond MAX_BYTES / MAX_ENTRIES (least recently used first)
+# or older than TTL seconds are no longer reused and their processed files
+# are deleted; their rows and originals are kept until the retention policy
+# (IMAGE_RETENTION) deletes them.
+IMAGE_RESULT_CACHE = {
+    'ENABLED': True,
+    'MAX_BYTES': 1024 * 1024 * 1024,
+    'MAX_ENTRIES': None,
+    'TTL': 7 * 24 * 60 * 60,
+    'EVICT_INTERVAL': 60,
+    'WAIT_TIMEOUT': 300,
+}
+
+# Upscaling whose whole-frame pipeline would need more than this many bytes
+# is done in overlapping tiles with bounded memory (None disables tiling)
+IMAGE_UPSCALE_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# Enhancement splits images into bands of IMAGE_ENHANCE_TILE_SIZE rows and
+# processes them on IMAGE_ENHANCE_WORKERS threads (None or 1 disables this).
+# 'auto' uses every CPU, or inside a compute pool worker the CPU count
+# divided by the pool's WORKERS, so concurrent tasks do not oversubscribe.
+IMAGE_ENHANCE_WORKERS = 'auto'
+IMAGE_ENHANCE_TILE_SIZE = 256
+
+# Processed images listing: cursor pages of this many rows (clients may ask
+# for up to PROCESSED_IMAGES_MAX_PAGE_SIZE with ?page_size=)
+PROCESSED_IMAGES_PAGE_SIZE = 50
+PROCESSED_IMAGES_MAX_PAGE_SIZE = 200
+
+# Batch endpoints (/api/batch/<operation>/): at most IMAGE_BATCH_MAX_ITEMS
+# images per request (Django's DATA_UPLOAD_MAX_NUMBER_FILES also applies to
+# multipart uploads) and IMAGE_BATCH_MAX_ARCHIVE_BYTES of uncompressed
+# archive contents. Background removal runs IMAGE_BATCH_INFERENCE_SIZE
+# images per model call.
+IMAGE_BATCH_MAX_ITEMS = 100
+IMAGE_BATCH_MAX_ARCHIVE_BYTES = 200 * 1024 * 1024
+IMAGE_BATCH_INFERENCE_SIZE = 8
+
+# Uploads are checked from their headers before decoding: at most
+# IMAGE_MAX_INPUT_MEGAPIXELS (width * height / 1e6) in, and at most
+# IMAGE_MAX_OUTPUT_MEGAPIXELS out (e.g. width * height * scale_factor² for
+# upscaling). IMAGE_OPERATION_MEGAPIXEL_LIMITS overrides them per processing
+# type, e.g. {'enhancement_advanced': {'input': 12}}
+IMAGE_MAX_INPUT_MEGAPIXELS = 40
+IMAGE_MAX_OUTPUT_MEGAPIXELS = 160
+IMAGE_OPERATION_MEGAPIXEL_LIMITS = {}
+
+# Resized derivatives (/api/processed-images/<id>/derivative/) are cached on
+# disk under ROOT (default MEDIA_ROOT/derivatives); the least recently used
+# are deleted beyond MAX_BYTES
+IMAGE_DERIVATIVE_CACHE = {
+    'ROOT': None,
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'EVICT_INTERVAL': 60,
+}
+
+# Stage timings are saved with each ProcessedImage. The time of that save
+# (db_write) is only known afterwards; True stores it with an extra UPDATE.
+IMAGE_STAGE_TIMINGS_DB_WRITE = False
+
+# Metrics (/metrics, Prometheus text format). With DIR set, every worker
+# process writes its counters there at most once per FLUSH_INTERVAL seconds
+# and a scrape of any worker reports the sum of all of them. Empty the
+# directory when the server is redeployed.
+IMAGE_METRICS = {
+    'DIR': os.environ.get('IMAGE_METRICS_DIR'),
+    'FLUSH_INTERVAL': 5,
+}
+
+# Async processing endpoints (/api/async/<operation>/, for ASGI servers) run
+# the image work on a pool of WORKERS processes (default: one per CPU).
+# Each worker loads PRELOAD_MODELS when it starts (None: REMBG_MODEL, []:
+# none) and is replaced after MAX_TASKS_PER_CHILD tasks to contain memory
+# growth. Uploads and results of at least SHARED_MEMORY_MIN_BYTES (each
+# checked on its own) are passed to and from the workers in shared memory
+# instead of being pickled (None always pickles).
+IMAGE_COMPUTE_POOL = {
+    'WORKERS': None,
+    'MAX_TASKS_PER_CHILD': 100,
+    'PRELOAD_MODELS': None,
+    'SHARED_MEMORY_MIN_BYTES': 256 * 1024,
+}
+
+# Retention (python manage.py cleanup_media): rows older than MAX_AGE_DAYS
+# are deleted, then the oldest finished rows until their originals and
+# results total at most MAX_BYTES (None disables either policy). Files no
+# row references are deleted too, but never ones written or reused within
+# GRACE_SECONDS, whose rows may still be on their way.
+IMAGE_RETENTION = {
+    'MAX_AGE_DAYS': None,
+    'MAX_BYTES': None,
+    'GRACE_SECONDS': 3600,
+    'BATCH_SIZE': 500,
+}
+
+# Pipelines (/api/pipeline/) chain at most this many operations per request
+IMAGE_PIPELINE_MAX_STEPS = 8
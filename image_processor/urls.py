@@ -18,10 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from image_apis.views import prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('image_apis.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
 
 # Serve media files during development
@@ -151,9 +151,12 @@ def test_get_processed_images():
         if response.status_code == 200:
             data = response.json()
             print("✅ Get Processed Images API Test Passed!")
-            print(f"Number of processed images: {len(data)}")
-            for img in data:
+            # The listing is paginated: images are under "results", more pages behind "next"
+            print(f"Processed images on the first page: {len(data['results'])}")
+            for img in data['results']:
                 print(f"- ID: {img.get('id')}, Type: {img.get('processing_type')}")
+            if data.get('next'):
+                print(f"Next page: {data['next']}")
         else:
             print("❌ Get Processed Images API Test Failed!")
             print(f"Error: {response.text}")